@@ -0,0 +1,68 @@
+# Precalcola l'area in km^2 di ogni isocrona salvata in isochrone_walk e la scrive accanto al convex_hull:
+#   isochrone.{min}.{vel}.area_km2
+# L'area è calcolata nella proiezione equivalente usata da Parameters.compute_area_km2.
+#
+# Uso: python -m backend.BackfillIsochroneAreas [--batch-size 200] [--force]
+
+import argparse
+
+from pymongo import UpdateOne
+
+from backend.Parameters import compute_area_km2
+from backend.db import db
+import logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+
+def backfill_isochrone_areas(batch_size: int = 200, force: bool = False) -> int:
+    """
+    Scrive area_km2 per tutte le combinazioni minuti/velocità di ogni nodo.
+    Senza force le aree già presenti non vengono ricalcolate, quindi il job può essere rilanciato.
+
+    :param batch_size: Documenti aggiornati per ogni bulk_write
+    :param force: Ricalcola anche le aree già presenti
+    :return: Numero di documenti aggiornati
+    """
+    collection = db["isochrone_walk"]
+
+    updated = 0
+    operations = []
+    for document in collection.find({}, {"_id": 1, "isochrone": 1}):
+        areas = {}
+        for minute, velocities in (document.get("isochrone") or {}).items():
+            for velocity, isochrone_data in velocities.items():
+                if not force and isochrone_data.get("area_km2") is not None:
+                    continue
+                features = isochrone_data.get("convex_hull", {}).get("features", [])
+                if not features:
+                    continue
+                try:
+                    coordinates = features[0]["geometry"]["coordinates"]
+                    areas[f"isochrone.{minute}.{velocity}.area_km2"] = compute_area_km2(coordinates)
+                except Exception as e:
+                    logging.warning(f"Area non calcolabile per {document['_id']} ({minute} min, {velocity} km/h): {e}")
+
+        if areas:
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": areas}))
+
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            logging.info(f"Documenti aggiornati: {updated}")
+
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    logging.info(f"Backfill completato: {updated} documenti aggiornati")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcola l'area delle isocrone in isochrone_walk")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--force", action="store_true", help="ricalcola anche le aree già presenti")
+    args = parser.parse_args()
+
+    backfill_isochrone_areas(args.batch_size, args.force)
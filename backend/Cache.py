@@ -0,0 +1,203 @@
+# Cache condivisa dei risultati per nodo: isocrone, POI, parametri e ricerche complete.
+#
+# La chiave è (DATASET_VERSION, tipo, node_id, min, vel, categorie ordinate): click vicini che
+# agganciano lo stesso nodo e i nodi di confine rivisitati dai confronti tra quartieri
+# vengono serviti senza rileggere MongoDB. Cambiando DATASET_VERSION dopo un aggiornamento
+# dei dati tutte le voci precedenti smettono di essere usate.
+#
+# Il primo livello è in memoria (LRU con TTL) nel processo; con CACHE_BACKEND=mongo c'è un
+# secondo livello nella collezione 'result_cache', condiviso tra i worker di uvicorn.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Hashable, List, Tuple, Union
+
+from pymongo import ASCENDING
+
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+# Numero massimo di voci in memoria e durata di una voce in secondi
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "4096"))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "600"))
+# "memory" (solo nel processo) oppure "mongo" (anche nella collezione 'result_cache')
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+# Versione dei dati precalcolati: va cambiata dopo ogni aggiornamento delle collezioni
+DATASET_VERSION = os.getenv("DATASET_VERSION", "1")
+
+CACHE_COLLECTION = "result_cache"
+
+
+class TTLCache:
+    """
+    Cache LRU in memoria con scadenza delle voci, sicura tra thread.
+    Le voci scadute vengono scartate quando vengono lette o quando la cache è piena.
+    """
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL_S):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """:return: (True, valore) se la voce è presente e valida, altrimenti (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Hashable, value: Any, ttl: Union[float, None] = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Rimuove le voci per cui predicate(chiave, valore) è vero; :return: quante ne ha rimosse"""
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+class ResultCache:
+    """Cache dei risultati per nodo: TTLCache in memoria più, opzionalmente, la collezione MongoDB."""
+
+    def __init__(self, backend: str = CACHE_BACKEND, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL_S):
+        self.backend = backend
+        self.local = TTLCache(max_size, ttl)
+        self.shared_hits = 0
+        self.kinds: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._collection = None
+        if backend == "mongo":
+            self._collection = db[CACHE_COLLECTION]
+            # Mongo cancella da solo le voci scadute
+            self._collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+    def _count(self, kind: str, outcome: str):
+        with self._lock:
+            counters = self.kinds.setdefault(kind, {"hits": 0, "misses": 0})
+            counters[outcome] += 1
+
+    def get(self, kind: str, key: Tuple) -> Tuple[bool, Any]:
+        hit, value = self.local.get(key)
+        if not hit and self._collection is not None:
+            document = self._collection.find_one(
+                {"_id": json.dumps(key), "expires_at": {"$gt": datetime.now(timezone.utc)}}
+            )
+            if document is not None:
+                # i tuple (status, messaggio, risultato) tornano da BSON come liste
+                hit, value = True, tuple(document["value"])
+                self.local.set(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+        self._count(kind, "hits" if hit else "misses")
+        return hit, value
+
+    def set(self, key: Tuple, value: Any):
+        self.local.set(key, value)
+        if self._collection is not None:
+            try:
+                self._collection.replace_one(
+                    {"_id": json.dumps(key)},
+                    {"value": list(value),
+                     "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.local.ttl)},
+                    upsert=True
+                )
+            except Exception as e:
+                logging.warning(f"Scrittura nella cache condivisa non riuscita: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
+        if self._collection is not None:
+            self._collection.delete_many({})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": CACHE_ENABLED,
+            "backend": self.backend,
+            "dataset_version": DATASET_VERSION,
+            **self.local.stats(),
+            "shared_hits": self.shared_hits,
+            "kinds": {kind: dict(counters) for kind, counters in self.kinds.items()},
+        }
+
+
+def cache_key(kind: str, node_id: int, min: Union[int, List[int]], vel: int,
+              categories: Union[List[str], None] = None) -> Tuple:
+    """
+    Chiave normalizzata: categorie ordinate, liste di fasce ordinate e senza duplicati.
+    I duplicati nelle categorie restano nella chiave perché cambiano il risultato (entropia e conteggi
+    usano len(categories)).
+    """
+    if isinstance(min, (list, tuple)):
+        min = tuple(sorted(set(min)))
+    return (DATASET_VERSION, kind, node_id, min, vel, tuple(sorted(categories)) if categories is not None else None)
+
+
+result_cache = ResultCache()
+
+
+def cached_call(kind: str, func: Callable, node_id: int, min: Union[int, List[int]], vel: int,
+                categories: Union[List[str], None] = None) -> Tuple:
+    """
+    Chiama func(node_id, min, vel[, categories]) passando dalla cache.
+    Vengono salvati solo i risultati riusciti; i valori restituiti sono condivisi e non vanno modificati.
+    """
+    args = (node_id, min, vel) if categories is None else (node_id, min, vel, categories)
+    if not CACHE_ENABLED:
+        return func(*args)
+
+    key = cache_key(kind, node_id, min, vel, categories)
+    hit, value = result_cache.get(kind, key)
+    if hit:
+        return value
+
+    value = func(*args)
+    # get_detailed_pois_by_node_id segnala gli errori con 200 e l'eccezione al posto del messaggio
+    if value[0] == 200 and not isinstance(value[1], Exception):
+        result_cache.set(key, value)
+    return value
@@ -0,0 +1,211 @@
+# Closeness per nodo calcolata sulla rete pedonale (backend.Graph) e salvata in 'node_closeness'.
+#
+# Per ogni combinazione (min, vel) il raggio è la distanza percorribile r = vel * 1000 / 60 * min metri.
+# La closeness di un nodo è la closeness armonica locale H = somma di 1 / d sui nodi raggiungibili
+# entro r (d distanza di rete, al minimo CLOSENESS_MIN_DISTANCE_M): cresce con il numero di nodi
+# raggiungibili e con la loro vicinanza, quindi un incrocio in un'area densa vale più di un nodo
+# isolato o in fondo a un vicolo cieco. Alla fine del calcolo H viene divisa per il massimo della
+# stessa combinazione su tutta la rete, così il valore servito è tra 0 e 1.
+# Per ogni nodo si esegue un solo Dijkstra fino al raggio massimo e se ne ricavano tutte le combinazioni.
+#
+# Documento salvato: {"node_id": ..., "harmonic": {"<min>": {"<vel>": H}}, "closeness": {"<min>": {"<vel>": H / H_max}}}
+#
+# Uso: python -m backend.Closeness [--workers N] [--batch-size 500] [--force]
+#      python -m backend.Closeness --check   (verifica la misura su una rete di prova, senza MongoDB)
+
+import argparse
+import os
+from multiprocessing import Pool
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+from backend.Graph import MISSING_WALK_GRAPH, WalkGraph, load_walk_graph
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+# Griglia precalcolata: i minuti e le velocità offerti dall'interfaccia
+CLOSENESS_MINUTES = [5, 10, 15, 20]
+CLOSENESS_VELOCITIES = [3, 5, 12, 20]
+# Distanza minima usata in 1 / d: sotto mezzo isolato la differenza a piedi non conta, e senza
+# soglia un nodo isolato con un solo vicino a pochi metri varrebbe più di un incrocio con tanti vicini
+CLOSENESS_MIN_DISTANCE_M = 50.0
+
+# Grafo condiviso dai processi worker, impostato da _init_worker
+_graph: Union[WalkGraph, None] = None
+
+
+def preset_radius(min: int, vel: int) -> float:
+    """Distanza in metri percorribile in min minuti a vel km/h."""
+    return vel * 1000 / 60 * min
+
+
+def harmonic_closeness(distances: np.ndarray, radius: float) -> float:
+    """Closeness armonica: somma di 1 / d sui nodi raggiunti entro radius (il nodo di partenza escluso)."""
+    reached = distances[(distances > 0) & (distances <= radius)]
+    return float(np.sum(1 / np.maximum(reached, CLOSENESS_MIN_DISTANCE_M)))
+
+
+def get_closeness_by_node_id(node_id: int, min: int, vel: int) -> Tuple[int, str, Union[float, None]]:
+    """
+    Legge la closeness precalcolata di un nodo per (min, vel).
+
+    :return: Tuple con codice di stato, messaggio e valore della closeness
+    """
+    try:
+        path = f"closeness.{min}.{vel}"
+        document = db["node_closeness"].find_one({"node_id": node_id}, {"_id": 0, path: 1})
+        value = (((document or {}).get("closeness") or {}).get(str(min)) or {}).get(str(vel))
+        if value is None:
+            return 404, f"Closeness non precalcolata per {min} minuti e velocità {vel}", None
+        return 200, "OK", value
+    except Exception as e:
+        return 500, f"Errore del server: {str(e)}", None
+
+
+def _init_worker(graph: WalkGraph):
+    global _graph
+    _graph = graph
+
+
+def _compute_rows(rows: List[int]) -> List[Tuple[int, Dict[str, Dict[str, float]]]]:
+    max_radius = max(preset_radius(min, vel) for min in CLOSENESS_MINUTES for vel in CLOSENESS_VELOCITIES)
+    results = []
+    for row in rows:
+        _, distances = _graph.bounded_dijkstra(row, max_radius)
+        harmonic = {
+            str(min): {str(vel): harmonic_closeness(distances, preset_radius(min, vel)) for vel in CLOSENESS_VELOCITIES}
+            for min in CLOSENESS_MINUTES
+        }
+        results.append((int(_graph.node_ids[row]), harmonic))
+    return results
+
+
+def normalize_closeness(batch_size: int = 500) -> int:
+    """
+    Scrive closeness = H / H_max per ogni combinazione, con H_max il massimo su tutti i nodi calcolati.
+
+    :return: Numero di documenti aggiornati
+    """
+    collection = db["node_closeness"]
+    documents = list(collection.find({"harmonic": {"$exists": True}}, {"_id": 0, "node_id": 1, "harmonic": 1}))
+    maxima = {
+        (str(min), str(vel)): max((d["harmonic"][str(min)][str(vel)] for d in documents), default=0.0)
+        for min in CLOSENESS_MINUTES for vel in CLOSENESS_VELOCITIES
+    }
+
+    updated = 0
+    operations = []
+    for document in documents:
+        closeness = {
+            str(min): {
+                str(vel): document["harmonic"][str(min)][str(vel)] / maxima[(str(min), str(vel))]
+                if maxima[(str(min), str(vel))] > 0 else 0.0
+                for vel in CLOSENESS_VELOCITIES
+            }
+            for min in CLOSENESS_MINUTES
+        }
+        operations.append(UpdateOne({"node_id": document["node_id"]}, {"$set": {"closeness": closeness}}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+
+    logging.info(f"Closeness normalizzata per {len(documents)} nodi")
+    return updated
+
+
+def compute_node_closeness(workers: int = os.cpu_count() or 1, batch_size: int = 500, force: bool = False) -> int:
+    """
+    Calcola la closeness di tutti i nodi della rete pedonale su più processi.
+    Ogni batch viene scritto appena pronto, quindi il job può essere interrotto e rilanciato:
+    senza force i nodi già presenti in 'node_closeness' vengono saltati. La normalizzazione
+    sul massimo della rete viene rifatta alla fine di ogni esecuzione.
+
+    :param workers: Processi usati per i Dijkstra
+    :param batch_size: Nodi per ogni task e per ogni bulk_write
+    :param force: Ricalcola anche i nodi già presenti
+    :return: Numero di documenti scritti
+    """
+    graph = load_walk_graph()
+    if graph is None:
+        raise RuntimeError(MISSING_WALK_GRAPH)
+
+    collection = db["node_closeness"]
+    collection.create_index([("node_id", ASCENDING)], unique=True)
+
+    todo = np.arange(len(graph))
+    if not force:
+        done = np.array(collection.distinct("node_id", {"harmonic": {"$exists": True}}), dtype=np.int64)
+        todo = todo[~np.isin(graph.node_ids, done)]
+    batches = [todo[start:start + batch_size].tolist() for start in range(0, len(todo), batch_size)]
+    logging.info(f"Closeness da calcolare per {len(todo)} nodi su {len(graph)}")
+
+    written = 0
+    with Pool(processes=workers, initializer=_init_worker, initargs=(graph,)) as pool:
+        for results in pool.imap_unordered(_compute_rows, batches):
+            operations = [
+                UpdateOne({"node_id": node_id}, {"$set": {"node_id": node_id, "harmonic": harmonic}}, upsert=True)
+                for node_id, harmonic in results
+            ]
+            result = collection.bulk_write(operations, ordered=False)
+            written += result.upserted_count + result.modified_count
+            logging.info(f"Closeness salvata per {written} nodi")
+
+    normalize_closeness(batch_size)
+    return written
+
+
+def check_closeness():
+    """
+    Verifica la misura su una rete di prova: una griglia di 11 x 11 incroci a 100 m, un vicolo cieco
+    di 20 m attaccato a un angolo e una coppia di nodi isolati a 5 m. L'incrocio centrale deve
+    valere più del vicolo cieco e della coppia isolata per ogni combinazione (min, vel).
+    """
+    side, spacing = 11, 100.0
+    node_ids = list(range(side * side))
+    edges_u, edges_v, lengths = [], [], []
+    for i in range(side):
+        for j in range(side):
+            if j + 1 < side:
+                edges_u.append(i * side + j), edges_v.append(i * side + j + 1), lengths.append(spacing)
+            if i + 1 < side:
+                edges_u.append(i * side + j), edges_v.append((i + 1) * side + j), lengths.append(spacing)
+    dead_end, isolated, neighbour = side * side, side * side + 1, side * side + 2
+    node_ids += [dead_end, isolated, neighbour]
+    edges_u += [0, isolated]
+    edges_v += [dead_end, neighbour]
+    lengths += [20.0, 5.0]
+    graph = WalkGraph(node_ids, [0.0] * len(node_ids), [0.0] * len(node_ids), edges_u, edges_v, lengths)
+
+    _init_worker(graph)
+    centre = side * side // 2
+    results = dict(_compute_rows([graph.row(centre), graph.row(dead_end), graph.row(isolated)]))
+    for min in CLOSENESS_MINUTES:
+        for vel in CLOSENESS_VELOCITIES:
+            values = {node_id: results[node_id][str(min)][str(vel)] for node_id in (centre, dead_end, isolated)}
+            assert values[centre] > values[dead_end] > 0 and values[centre] > values[isolated], \
+                f"closeness non monotona per {min} minuti e velocità {vel}: {values}"
+    logging.info("Verifica della closeness superata: l'incrocio centrale precede vicolo cieco e nodi isolati")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Precalcola la closeness per nodo sulla rete pedonale")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--force", action="store_true", help="ricalcola anche i nodi già presenti")
+    parser.add_argument("--check", action="store_true", help="verifica la misura su una rete di prova ed esce")
+    args = parser.parse_args()
+
+    if args.check:
+        check_closeness()
+    else:
+        compute_node_closeness(args.workers, args.batch_size, args.force)
@@ -0,0 +1,198 @@
+# Cache persistente delle risposte di Nominatim e circuit breaker verso il servizio.
+#
+# Le risposte sono salvate nella collezione 'geocode_cache' con chiave la query normalizzata,
+# quindi sopravvivono ai riavvii e sono condivise tra i worker di uvicorn. Ogni voce è "fresca"
+# per GEOCODE_CACHE_TTL_S e poi resta disponibile come "vecchia" per altri GEOCODE_CACHE_STALE_S:
+# le voci vecchie vengono usate solo se Nominatim è lento o non raggiungibile. Le ricerche senza
+# risultati sono salvate come voci negative di breve durata; gli errori non vengono mai salvati.
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple, Union
+
+from pymongo import ASCENDING
+
+from backend.Cache import TTLCache
+from backend.Geocoder import normalize
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+GEOCODE_CACHE_ENABLED = os.getenv("GEOCODE_CACHE_ENABLED", "1") == "1"
+# Durata in secondi delle voci fresche, della finestra in cui restano utilizzabili se Nominatim
+# non risponde e delle voci negative (ricerche senza risultati)
+GEOCODE_CACHE_TTL_S = float(os.getenv("GEOCODE_CACHE_TTL_S", str(30 * 24 * 3600)))
+GEOCODE_CACHE_STALE_S = float(os.getenv("GEOCODE_CACHE_STALE_S", str(90 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL_S = float(os.getenv("GEOCODE_NEGATIVE_TTL_S", "3600"))
+# Voci fresche tenute anche in memoria nel processo
+GEOCODE_CACHE_MEMORY_SIZE = int(os.getenv("GEOCODE_CACHE_MEMORY_SIZE", "1000"))
+# Errori consecutivi dopo cui il circuito si apre e secondi prima di riprovare
+GEOCODE_BREAKER_FAILURES = int(os.getenv("GEOCODE_BREAKER_FAILURES", "5"))
+GEOCODE_BREAKER_RESET_S = float(os.getenv("GEOCODE_BREAKER_RESET_S", "30"))
+
+GEOCODE_CACHE_COLLECTION = "geocode_cache"
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+def normalize_query(query: str) -> str:
+    """Chiave della cache: la query senza maiuscole, accenti, punteggiatura e spazi ripetuti."""
+    return normalize(query) or " ".join(query.lower().split())
+
+
+class GeocodeCache:
+    """Voci (luoghi come dict) nella collezione MongoDB, con le voci fresche anche in memoria."""
+
+    def __init__(self, ttl: float = GEOCODE_CACHE_TTL_S, stale: float = GEOCODE_CACHE_STALE_S,
+                 negative_ttl: float = GEOCODE_NEGATIVE_TTL_S, memory_size: int = GEOCODE_CACHE_MEMORY_SIZE):
+        self.ttl = ttl
+        self.stale = stale
+        self.negative_ttl = negative_ttl
+        self.local = TTLCache(memory_size, ttl)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._collection = db[GEOCODE_CACHE_COLLECTION]
+        self._indexed = False
+
+    def _ensure_index(self):
+        # creato alla prima scrittura: all'import MongoDB potrebbe non essere raggiungibile
+        if not self._indexed:
+            self._collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+            self._indexed = True
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, query: str) -> Tuple[Union[str, None], Union[List[Dict], None]]:
+        """:return: (FRESH o STALE, luoghi) se la query è in cache, altrimenti (None, None)"""
+        key = normalize_query(query)
+        hit, places = self.local.get(key)
+        if hit:
+            self._count("hits")
+            return FRESH, places
+
+        try:
+            document = self._collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logging.warning(f"Lettura della cache di geocoding non riuscita: {str(e)}")
+            document = None
+        if document is None:
+            self._count("misses")
+            return None, None
+
+        fresh_until = document["fresh_until"]
+        # PyMongo restituisce date senza fuso orario, in UTC
+        if fresh_until.tzinfo is None:
+            fresh_until = fresh_until.replace(tzinfo=timezone.utc)
+        remaining = (fresh_until - datetime.now(timezone.utc)).total_seconds()
+        if remaining > 0:
+            self.local.set(key, document["places"], ttl=remaining)
+            self._count("hits")
+            return FRESH, document["places"]
+        self._count("stale_hits")
+        return STALE, document["places"]
+
+    def set(self, query: str, places: List[Dict]):
+        """Salva i luoghi trovati; una lista vuota diventa una voce negativa di breve durata."""
+        key = normalize_query(query)
+        ttl = self.ttl if places else self.negative_ttl
+        now = datetime.now(timezone.utc)
+        self.local.set(key, places, ttl=ttl)
+        try:
+            self._ensure_index()
+            self._collection.replace_one(
+                {"_id": key},
+                {"query": query,
+                 "places": places,
+                 "negative": not places,
+                 "fetched_at": now,
+                 "fresh_until": now + timedelta(seconds=ttl),
+                 # anche le voci negative restano utilizzabili se Nominatim non risponde
+                 "expires_at": now + timedelta(seconds=ttl + self.stale)},
+                upsert=True
+            )
+        except Exception as e:
+            logging.warning(f"Scrittura nella cache di geocoding non riuscita: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
+        self._collection.delete_many({})
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.stale_hits + self.misses
+        return {
+            "enabled": GEOCODE_CACHE_ENABLED,
+            "memory_size": len(self.local),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / requests if requests else 0.0,
+        }
+
+
+class CircuitBreaker:
+    """
+    Dopo max_failures errori consecutivi il circuito si apre e le chiamate non vengono tentate per
+    reset_timeout secondi; poi passa una sola chiamata di prova, che lo richiude se riesce.
+    Se l'esito della prova non viene registrato entro reset_timeout secondi ne passa un'altra,
+    così il circuito non resta mai bloccato.
+    """
+
+    def __init__(self, max_failures: int = GEOCODE_BREAKER_FAILURES, reset_timeout: float = GEOCODE_BREAKER_RESET_S):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Union[float, None] = None
+        self._trial = False
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            if self._trial and now - self._trial_at < self.reset_timeout:
+                return False
+            self._trial = True
+            self._trial_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.max_failures:
+                if self.opened_at is None or self._trial:
+                    logging.warning(f"Nominatim non disponibile dopo {self.failures} errori: circuito aperto")
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures}
+
+
+geocode_cache = GeocodeCache()
+nominatim_breaker = CircuitBreaker()
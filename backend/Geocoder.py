@@ -0,0 +1,280 @@
+# Geocoder locale costruito dai nostri dati: nomi dei POI ('pois'), quartieri ('neighbourhood_polygon')
+# e la città stessa. Risponde a /api/reverse_geocoding senza chiamate di rete; Nominatim resta
+# solo come ripiego opzionale per le ricerche che l'indice locale non conosce (vedi ReverseGeocoding).
+#
+# L'indice è in memoria: i nomi vengono normalizzati (minuscole, senza accenti né punteggiatura)
+# e divisi in token; ogni token punta ai luoghi che lo contengono. I token sono anche tenuti
+# ordinati, così l'ultimo token della ricerca può essere un prefisso (ricerca durante la digitazione).
+# Per i suggerimenti di /api/autocomplete c'è un secondo indice, ordinato per prefisso dei nomi.
+
+import bisect
+import os
+import re
+import unicodedata
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import shapely
+
+from backend.Neighbourhoods import get_all_neighbourhoods
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+GEOCODER_ENABLED = os.getenv("GEOCODER_ENABLED", "1") == "1"
+# Città coperta dai dati, aggiunta in coda ai nomi dei luoghi
+GEOCODER_CITY_NAME = os.getenv("GEOCODER_CITY_NAME", "Torino")
+GEOCODER_MAX_RESULTS = int(os.getenv("GEOCODER_MAX_RESULTS", "10"))
+# Suggerimenti restituiti di default e al massimo (quanti ne vengono precalcolati per prefisso);
+# i prefissi con più nomi di AUTOCOMPLETE_PRECOMPUTED_MIN hanno i risultati precalcolati
+AUTOCOMPLETE_MAX_RESULTS = int(os.getenv("AUTOCOMPLETE_MAX_RESULTS", "8"))
+AUTOCOMPLETE_MAX_LIMIT = max(int(os.getenv("AUTOCOMPLETE_MAX_LIMIT", "20")), AUTOCOMPLETE_MAX_RESULTS)
+AUTOCOMPLETE_PRECOMPUTED_MIN = int(os.getenv("AUTOCOMPLETE_PRECOMPUTED_MIN", "256"))
+
+# Importanza dei luoghi per tipo, sulla stessa scala (0..1) di Nominatim
+CITY_IMPORTANCE = 0.9
+NEIGHBOURHOOD_IMPORTANCE = 0.6
+POI_IMPORTANCE = 0.3
+
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text: str) -> str:
+    """Minuscole, senza accenti e con la punteggiatura sostituita da spazi."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALPHANUMERIC.sub(" ", text.lower()).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split()
+
+
+class GeocoderIndex:
+    """
+    Indice per token e per prefisso sui nomi dei luoghi.
+    I luoghi sono (nome cercabile, nome visualizzato, importanza, [lat, lon]) e vengono restituiti
+    per importanza decrescente.
+    """
+
+    # oltre questo numero di token con lo stesso prefisso conviene filtrare i candidati già trovati
+    MAX_PREFIX_UNION = 64
+
+    def __init__(self, places: List[Tuple[str, str, float, List[float]]]):
+        # a parità di importanza prima i nomi più corti (più specifici per la ricerca)
+        places = sorted(places, key=lambda p: (-p[2], len(p[0]), p[0]))
+        self.normalized = [normalize(p[0]) for p in places]
+        self.names = [p[1] for p in places]
+        self.importance = np.array([p[2] for p in places], dtype=np.float64)
+        self.coordinates = [p[3] for p in places]
+
+        postings: Dict[str, List[int]] = {}
+        for place_id, name in enumerate(self.normalized):
+            for token in set(name.split()):
+                postings.setdefault(token, []).append(place_id)
+        # id crescenti = importanza decrescente, per ogni token
+        self.tokens = sorted(postings)
+        self.postings = [np.array(postings[token], dtype=np.int64) for token in self.tokens]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _token_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + "\uffff", lo=start)
+        return start, end
+
+    def _matching(self, token: str) -> np.ndarray:
+        """Id dei luoghi che contengono esattamente il token."""
+        position = bisect.bisect_left(self.tokens, token)
+        if position < len(self.tokens) and self.tokens[position] == token:
+            return self.postings[position]
+        return np.empty(0, dtype=np.int64)
+
+    def _matching_prefix(self, prefix: str, candidates: Union[np.ndarray, None]) -> np.ndarray:
+        """Id dei luoghi con un token che inizia con il prefisso, ristretti ai candidati se dati."""
+        start, end = self._token_range(prefix)
+        if end == start:
+            return np.empty(0, dtype=np.int64)
+        if candidates is not None and end - start > self.MAX_PREFIX_UNION:
+            return np.array([i for i in candidates if any(token.startswith(prefix) for token in self.normalized[i].split())],
+                            dtype=np.int64)
+        matches = self.postings[start] if end - start == 1 else np.unique(np.concatenate(self.postings[start:end]))
+        return matches if candidates is None else np.intersect1d(candidates, matches, assume_unique=True)
+
+    def search(self, query: str, limit: int = GEOCODER_MAX_RESULTS, prefix: bool = True) -> List[Tuple[str, float, List[float]]]:
+        """
+        Luoghi che contengono tutti i token della ricerca; con prefix l'ultimo token può essere incompleto.
+
+        :return: lista di (nome, importanza, [lat, lon]) per importanza decrescente
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        # token completi: si interseca partendo dalla lista più corta
+        complete = tokens[:-1] if prefix else tokens
+        candidates = None
+        for matches in sorted((self._matching(token) for token in complete), key=len):
+            candidates = matches if candidates is None else np.intersect1d(candidates, matches, assume_unique=True)
+            if len(candidates) == 0:
+                return []
+        if prefix:
+            candidates = self._matching_prefix(tokens[-1], candidates)
+
+        # i nomi che coincidono esattamente con la ricerca vanno in testa, poi tutti gli altri candidati
+        # per importanza: l'ordinamento riguarda l'intero insieme, il taglio a limit viene dopo
+        normalized = " ".join(tokens)
+        exact = [i for i in candidates if self.normalized[i] == normalized]
+        ordered = exact + [i for i in candidates if self.normalized[i] != normalized][:limit]
+        return [(self.names[i], float(self.importance[i]), self.coordinates[i]) for i in ordered[:limit]]
+
+    def exact_matches(self, query: str, limit: int = GEOCODER_MAX_RESULTS) -> List[Tuple[str, float, List[float]]]:
+        """Luoghi con esattamente il nome cercato (a meno di maiuscole, accenti e punteggiatura), per importanza."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        candidates = None
+        for matches in sorted((self._matching(token) for token in tokens), key=len):
+            candidates = matches if candidates is None else np.intersect1d(candidates, matches, assume_unique=True)
+        normalized = " ".join(tokens)
+        exact = [i for i in candidates if self.normalized[i] == normalized][:limit]
+        return [(self.names[i], float(self.importance[i]), self.coordinates[i]) for i in exact]
+
+
+class AutocompleteIndex:
+    """
+    Indice per prefisso sui nomi dei luoghi per i suggerimenti durante la digitazione.
+
+    Per ogni luogo vengono indicizzati il nome normalizzato e i suoi suffissi che iniziano a ogni token
+    ("bar crocetta" e "crocetta"), in un'unica lista ordinata con accanto l'id del luogo: i nomi che
+    iniziano con un prefisso sono una slice contigua trovata con due bisect. Gli id sono in ordine di
+    importanza, quindi i migliori k sono i k id più piccoli della slice; per i prefissi con slice più
+    lunghe di precomputed_min i risultati sono precalcolati, così ogni ricerca legge al più
+    precomputed_min voci.
+    """
+
+    def __init__(self, index: GeocoderIndex, limit: int = AUTOCOMPLETE_MAX_LIMIT,
+                 precomputed_min: int = AUTOCOMPLETE_PRECOMPUTED_MIN):
+        self.index = index
+        self.limit = limit
+
+        keys, ids = [], []
+        for place_id, name in enumerate(index.normalized):
+            tokens = name.split()
+            for i in range(len(tokens)):
+                keys.append(" ".join(tokens[i:]))
+                ids.append(place_id)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.ids = np.array(ids, dtype=np.int64)[order]
+
+        # visita dei prefissi come in un trie, scendendo solo nelle slice più lunghe della soglia
+        self.precomputed: Dict[str, List[int]] = {}
+        stack = [("", 0, len(self.keys))]
+        while stack:
+            prefix, start, end = stack.pop()
+            if prefix:
+                self.precomputed[prefix] = self._top(start, end)
+            length = len(prefix) + 1
+            while start < end:
+                key = self.keys[start]
+                if len(key) < length:
+                    start += 1
+                    continue
+                child = key[:length]
+                child_end = bisect.bisect_left(self.keys, child + "\uffff", lo=start, hi=end)
+                if child_end - start > precomputed_min:
+                    stack.append((child, start, child_end))
+                start = child_end
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(self.keys, prefix)
+        return start, bisect.bisect_left(self.keys, prefix + "\uffff", lo=start)
+
+    def _top(self, start: int, end: int) -> List[int]:
+        """I luoghi più importanti della slice, senza ripetere lo stesso nome."""
+        top, names = [], set()
+        for place_id in np.unique(self.ids[start:end]):
+            name = self.index.names[place_id]
+            if name not in names:
+                names.add(name)
+                top.append(int(place_id))
+                if len(top) == self.limit:
+                    break
+        return top
+
+    def complete(self, query: str, limit: int = AUTOCOMPLETE_MAX_RESULTS) -> List[Tuple[str, float, List[float]]]:
+        """
+        :param limit: al massimo self.limit, il numero di risultati precalcolati per prefisso
+        :return: fino a limit luoghi (nome, importanza, [lat, lon]) il cui nome ha un token che inizia con query
+        """
+        if limit > self.limit:
+            raise ValueError(f"limit must be at most {self.limit}")
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        top = self.precomputed.get(prefix)
+        if top is None:
+            top = self._top(*self._range(prefix))
+        index = self.index
+        return [(index.names[i], float(index.importance[i]), index.coordinates[i]) for i in top[:limit]]
+
+
+def _neighbourhood_name(neighbourhood: Dict) -> str:
+    properties = neighbourhood.get("properties") or {}
+    for key in ("name", "nome", "NOME", "denominazione", "DENOMINAZIONE"):
+        if properties.get(key):
+            return str(properties[key])
+    return f"Quartiere {neighbourhood['id']}"
+
+
+def _load_places() -> List[Tuple[str, str, float, List[float]]]:
+    places = []
+
+    status_code, message, neighbourhoods = get_all_neighbourhoods()
+    if status_code == 200:
+        polygons = []
+        for neighbourhood in neighbourhoods:
+            # coordinate già in formato Leaflet [lat, lon]
+            rings = neighbourhood["coordinates"]
+            polygon = shapely.Polygon(rings[0], rings[1:])
+            polygons.append(polygon)
+            centroid = polygon.representative_point()
+            name = _neighbourhood_name(neighbourhood)
+            places.append((name, f"{name}, {GEOCODER_CITY_NAME}", NEIGHBOURHOOD_IMPORTANCE, [centroid.x, centroid.y]))
+        if polygons:
+            centroid = shapely.union_all(polygons).centroid
+            places.append((GEOCODER_CITY_NAME, GEOCODER_CITY_NAME, CITY_IMPORTANCE, [centroid.x, centroid.y]))
+
+    for poi in db["pois"].find({"names.primary": {"$ne": None}},
+                               {"_id": 0, "names.primary": 1, "location.coordinates": 1}):
+        name = (poi.get("names") or {}).get("primary")
+        if not name:
+            continue
+        lon, lat = poi["location"]["coordinates"][:2]
+        places.append((name, f"{name}, {GEOCODER_CITY_NAME}", POI_IMPORTANCE, [lat, lon]))
+
+    return places
+
+
+# Indici caricati all'avvio da load_geocoder(); None se il geocoder locale non è attivo
+geocoder_index: Union[GeocoderIndex, None] = None
+autocomplete_index: Union[AutocompleteIndex, None] = None
+
+
+def load_geocoder() -> Union[GeocoderIndex, None]:
+    """Costruisce l'indice dei nomi dei luoghi da POI e quartieri e quello dei suggerimenti."""
+    global geocoder_index, autocomplete_index
+    try:
+        geocoder_index = GeocoderIndex(_load_places())
+        autocomplete_index = AutocompleteIndex(geocoder_index)
+        logging.info(f"Geocoder locale caricato: {len(geocoder_index)} luoghi, {len(geocoder_index.tokens)} token, "
+                     f"{len(autocomplete_index.keys)} prefissi")
+        return geocoder_index
+    except Exception as e:
+        logging.error(f"Errore nel caricamento del geocoder locale: {str(e)}")
+        return None
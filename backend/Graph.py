@@ -0,0 +1,137 @@
+# Rete pedonale in memoria in formato CSR (compressed sparse row).
+#
+# I nodi vengono dalla collezione 'nodes' (node_id, location), gli archi dalla collezione
+# WALK_EDGES_COLLECTION con documenti {"u": node_id, "v": node_id, "length": metri}.
+# La rete pedonale è trattata come non orientata: ogni arco è percorribile nei due sensi.
+#
+# La collezione degli archi non fa parte del dump di db_init: va importata dalla stessa rete
+# pedonale OSM da cui sono stati generati 'nodes' e 'isochrone_walk' (vedi il README, sezione
+# "Rete pedonale"); u e v devono essere i node_id della collezione 'nodes'.
+
+import heapq
+import math
+import os
+from typing import Tuple, Union
+
+import numpy as np
+
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+WALK_EDGES_COLLECTION = os.getenv("WALK_EDGES_COLLECTION", "edges")
+
+MISSING_WALK_GRAPH = (
+    f"Rete pedonale non disponibile: servono i nodi in 'nodes' e gli archi in '{WALK_EDGES_COLLECTION}' "
+    "({\"u\": node_id, \"v\": node_id, \"length\": metri}). Per importarli vedi la sezione "
+    "\"Rete pedonale\" del README."
+)
+
+
+class WalkGraph:
+    """
+    Grafo pedonale: il nodo di riga r ha come vicini indices[indptr[r]:indptr[r + 1]]
+    con lunghezze weights[indptr[r]:indptr[r + 1]] in metri.
+    """
+
+    def __init__(self, node_ids, lons, lats, edges_u, edges_v, lengths):
+        order = np.argsort(np.asarray(node_ids, dtype=np.int64), kind="stable")
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)[order]
+        self.lons = np.asarray(lons, dtype=np.float64)[order]
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+
+        u = self.rows(edges_u)
+        v = self.rows(edges_v)
+        lengths = np.asarray(lengths, dtype=np.float64)
+        valid = (u >= 0) & (v >= 0)
+        u, v, lengths = u[valid], v[valid], lengths[valid]
+
+        # ogni arco nei due sensi, ordinato per nodo di partenza
+        sources = np.concatenate((u, v))
+        targets = np.concatenate((v, u))
+        weights = np.concatenate((lengths, lengths))
+        order = np.argsort(sources, kind="stable")
+
+        self.indices = targets[order]
+        self.weights = weights[order]
+        self.indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.node_ids)), out=self.indptr[1:])
+
+        # copie in liste Python: nel ciclo di Dijkstra l'accesso per elemento è molto più veloce
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._weights = self.weights.tolist()
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def rows(self, node_ids) -> np.ndarray:
+        """Righe CSR dei node_id dati; -1 per i nodi non presenti nel grafo."""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if len(self.node_ids) == 0:
+            return np.full(len(node_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.node_ids, node_ids), len(self.node_ids) - 1)
+        return np.where(self.node_ids[positions] == node_ids, positions, -1)
+
+    def row(self, node_id: int) -> int:
+        return int(self.rows([node_id])[0])
+
+    def bounded_dijkstra(self, source: int, max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cammini minimi dalla riga source fino a max_distance metri.
+
+        :return: (righe raggiunte, distanze) in ordine di distanza crescente, source compresa
+        """
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        best = {source: 0.0}
+        settled_rows, settled_distances = [], []
+        done = set()
+        heap = [(0.0, source)]
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            settled_rows.append(u)
+            settled_distances.append(d)
+
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = d + weights[k]
+                if nd <= max_distance and nd < best.get(v, math.inf):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
+
+        return np.array(settled_rows, dtype=np.int64), np.array(settled_distances, dtype=np.float64)
+
+
+def load_walk_graph() -> Union[WalkGraph, None]:
+    """Carica nodi e archi della rete pedonale da MongoDB e costruisce il grafo CSR."""
+    try:
+        node_ids, lons, lats = [], [], []
+        for node in db["nodes"].find({}, {"_id": 0, "node_id": 1, "location.coordinates": 1}):
+            lon, lat = node["location"]["coordinates"][:2]
+            node_ids.append(node["node_id"])
+            lons.append(lon)
+            lats.append(lat)
+
+        edges_u, edges_v, lengths = [], [], []
+        for edge in db[WALK_EDGES_COLLECTION].find({}, {"_id": 0, "u": 1, "v": 1, "length": 1}):
+            edges_u.append(edge["u"])
+            edges_v.append(edge["v"])
+            lengths.append(edge["length"])
+
+        if not node_ids or not edges_u:
+            logging.error(f"{MISSING_WALK_GRAPH} (nodi: {len(node_ids)}, archi: {len(edges_u)})")
+            return None
+
+        graph = WalkGraph(node_ids, lons, lats, edges_u, edges_v, lengths)
+        logging.info(f"Rete pedonale caricata: {len(graph)} nodi, {len(graph.indices) // 2} archi")
+        return graph
+    except Exception as e:
+        logging.error(f"Errore nel caricamento della rete pedonale: {str(e)}")
+        return None
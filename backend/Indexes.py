@@ -0,0 +1,213 @@
+# Indici di MongoDB richiesti dalle query degli endpoint e verifica dei loro piani di esecuzione.
+#
+# Le prestazioni delle letture per nodo, dello snapping e delle join sui POI dipendono da indici che
+# finora venivano creati a mano: qui sono dichiarati tutti in un unico posto. ensure_indexes() li crea
+# (se esistono già con la stessa definizione MongoDB non fa nulla), verify_query_plans() esegue
+# explain() sulle query più frequenti e segnala quelle che leggono l'intera collezione (COLLSCAN).
+#
+# Uso: python -m backend.Indexes [--no-create] [--no-explain] [--strict]
+# All'avvio dell'app viene eseguito con INDEXES_ON_STARTUP=1; con INDEXES_STRICT=1 ogni problema
+# blocca l'avvio invece di essere solo segnalato nei log.
+
+import argparse
+import os
+from typing import Dict, List, Tuple, Union
+
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+
+from backend.Cache import CACHE_COLLECTION
+from backend.GeocodeCache import GEOCODE_CACHE_COLLECTION
+from backend.NodeMetrics import PRESET_NAME
+from backend.Nodes import NODE_MAX_SNAP_DISTANCE_M
+from backend.Poi import _distance_stages
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+INDEXES_ON_STARTUP = os.getenv("INDEXES_ON_STARTUP", "1") == "1"
+INDEXES_STRICT = os.getenv("INDEXES_STRICT", "0") == "1"
+
+# Punto e nodo usati solo per ottenere i piani delle query: il piano non dipende dai valori
+SAMPLE_COORDINATES = [7.6869, 45.0703]
+SAMPLE_NODE_ID = 0
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    # Isochrones.get_isocronewalk_by_node_id e le altre letture per nodo
+    "isochrone_walk": [IndexModel([("node_id", ASCENDING)])],
+    # Poi._distance_stages
+    "distances_to_pois_walk": [IndexModel([("node_id", ASCENDING)])],
+    # $lookup di Poi.get_detailed_pois_by_node_id su pois_id
+    "pois": [IndexModel([("pois_id", ASCENDING)])],
+    # snapping con $near in Nodes
+    "nodes": [IndexModel([("location", GEOSPHERE)])],
+    # poligoni dei quartieri (GeoJSON dentro la FeatureCollection del convex_hull)
+    "neighbourhood_polygon": [IndexModel([("neighbourhoods.geometry.convex_hull.features.geometry", GEOSPHERE)])],
+    "users": [IndexModel([("email", ASCENDING)], unique=True)],
+    # stessi indici creati dai job di NodeMetrics e Closeness
+    "node_metrics": [IndexModel([("node_id", ASCENDING), ("min", ASCENDING), ("vel", ASCENDING),
+                                 ("preset", ASCENDING)], unique=True)],
+    "node_closeness": [IndexModel([("node_id", ASCENDING)], unique=True)],
+    # voci scadute rimosse da MongoDB
+    CACHE_COLLECTION: [IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)],
+    GEOCODE_CACHE_COLLECTION: [IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)],
+}
+
+
+def _hot_queries() -> List[Dict]:
+    """
+    Query più frequenti degli endpoint, nella stessa forma usata dai moduli.
+    'full_scan' indica le letture che per costruzione leggono tutta la collezione.
+    """
+    near = {"type": "Point", "coordinates": SAMPLE_COORDINATES}
+    return [
+        {"name": "Nodes.get_id_node_by_coordinates", "collection": "nodes",
+         "filter": {"location": {"$near": {"$geometry": near, "$maxDistance": NODE_MAX_SNAP_DISTANCE_M}}}},
+        {"name": "Isochrones.get_isocronewalk_by_node_id", "collection": "isochrone_walk",
+         "filter": {"node_id": SAMPLE_NODE_ID}},
+        {"name": "Poi.get_detailed_pois_by_node_id", "collection": "distances_to_pois_walk",
+         "pipeline": _distance_stages(SAMPLE_NODE_ID, 1000)},
+        # il piano del $lookup non compare nell'explain dell'aggregazione: si verifica la stessa ricerca
+        {"name": "Poi.get_detailed_pois_by_node_id ($lookup su pois)", "collection": "pois",
+         "filter": {"pois_id": SAMPLE_NODE_ID}},
+        {"name": "Neighbourhoods.get_neighbourhoods_payload", "collection": "neighbourhood_polygon",
+         "filter": {"neighbourhoods": {"$exists": True}}, "full_scan": True},
+        {"name": "NodeMetrics.get_node_metrics", "collection": "node_metrics",
+         "filter": {"node_id": SAMPLE_NODE_ID, "min": 15, "vel": 5, "preset": PRESET_NAME}},
+        {"name": "Closeness.get_closeness_by_node_id", "collection": "node_closeness",
+         "filter": {"node_id": SAMPLE_NODE_ID}},
+        {"name": "users.get_user_by_email", "collection": "users",
+         "filter": {"email": "explain@example.com"}},
+    ]
+
+
+def ensure_indexes() -> List[Dict]:
+    """
+    Crea gli indici di INDEXES. Un indice già presente con la stessa definizione non viene ricostruito;
+    la creazione di un indice nuovo su una collezione grande può richiedere tempo.
+
+    :return: una voce per indice con collezione, nome, "ok" o "error" e messaggio
+    """
+    report = []
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                db[collection].create_indexes([index])
+                report.append({"collection": collection, "index": name, "status": "ok", "message": "OK"})
+            except Exception as e:
+                # es. un indice con la stessa chiave e opzioni diverse, o email duplicate in users
+                report.append({"collection": collection, "index": name, "status": "error", "message": str(e)})
+    return report
+
+
+def _winning_stages(explain: Union[Dict, List]) -> List[str]:
+    """Stage dei piani vincenti in un risultato di explain (find, aggregate, motore classico o SBE)."""
+    stages = []
+
+    def walk(node, in_winning_plan: bool):
+        if isinstance(node, dict):
+            if in_winning_plan and isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, in_winning_plan)
+
+    walk(explain, False)
+    return stages
+
+
+def explain_query(query: Dict) -> List[str]:
+    """:return: stage del piano vincente della query"""
+    collection = db[query["collection"]]
+    if "pipeline" in query:
+        explain = db.command("aggregate", query["collection"], pipeline=query["pipeline"], explain=True)
+    else:
+        explain = collection.find(query["filter"]).limit(1).explain()
+    return _winning_stages(explain)
+
+
+def verify_query_plans() -> List[Dict]:
+    """
+    Esegue explain() sulle query più frequenti.
+
+    :return: una voce per query con gli stage del piano e lo stato: "ok", "collscan" (legge tutta la
+             collezione senza esserne previsto), "full_scan" (lettura completa prevista) o "error"
+    """
+    report = []
+    for query in _hot_queries():
+        entry = {"query": query["name"], "collection": query["collection"], "stages": []}
+        try:
+            entry["stages"] = explain_query(query)
+            if "COLLSCAN" not in entry["stages"]:
+                entry["status"] = "ok"
+            else:
+                entry["status"] = "full_scan" if query.get("full_scan") else "collscan"
+        except Exception as e:
+            # $near senza indice 2dsphere non ha un piano: la query fallisce
+            entry["status"] = "error"
+            entry["message"] = str(e)
+        report.append(entry)
+    return report
+
+
+def bootstrap_indexes(create: bool = True, explain: bool = True,
+                      strict: bool = False) -> Tuple[int, str, Union[Dict, None]]:
+    """
+    Crea gli indici e verifica i piani delle query, segnalando nei log ogni problema.
+
+    :param strict: solleva RuntimeError se un indice non può essere creato o una query legge tutta la collezione
+    :return: Tuple con codice di stato, messaggio e il resoconto {"indexes": [...], "queries": [...]}
+    """
+    try:
+        db.command("ping")
+    except Exception as e:
+        if strict:
+            raise RuntimeError(f"MongoDB non raggiungibile: {str(e)}")
+        logging.error(f"Verifica degli indici saltata, MongoDB non raggiungibile: {str(e)}")
+        return 500, f"Errore del server: {str(e)}", None
+
+    report = {
+        "indexes": ensure_indexes() if create else [],
+        "queries": verify_query_plans() if explain else [],
+    }
+
+    problems = []
+    for entry in report["indexes"]:
+        if entry["status"] != "ok":
+            problems.append(f"indice {entry['index']} su {entry['collection']}: {entry['message']}")
+    for entry in report["queries"]:
+        if entry["status"] == "collscan":
+            problems.append(f"{entry['query']} legge tutta la collezione {entry['collection']} "
+                            f"({' -> '.join(entry['stages'])})")
+        elif entry["status"] == "error":
+            problems.append(f"{entry['query']}: {entry['message']}")
+
+    for problem in problems:
+        logging.error(f"Indici: {problem}")
+    if problems and strict:
+        raise RuntimeError(f"{len(problems)} problemi negli indici di MongoDB: " + "; ".join(problems))
+    if problems:
+        return 500, f"{len(problems)} problemi negli indici di MongoDB", report
+    return 200, "OK", report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea gli indici di MongoDB e verifica i piani delle query frequenti")
+    parser.add_argument("--no-create", action="store_true", help="non crea gli indici, verifica solo i piani")
+    parser.add_argument("--no-explain", action="store_true", help="crea gli indici senza verificare i piani")
+    parser.add_argument("--strict", action="store_true", help="solleva un errore invece di riportare i problemi")
+    args = parser.parse_args()
+
+    status_code, message, report = bootstrap_indexes(not args.no_create, not args.no_explain, args.strict)
+    for entry in (report or {}).get("indexes", []):
+        print(f"[{entry['status']:>9}] indice {entry['collection']}.{entry['index']}")
+    for entry in (report or {}).get("queries", []):
+        print(f"[{entry['status']:>9}] {entry['query']}: {' -> '.join(entry['stages']) or entry.get('message', '')}")
+    print(message)
+    raise SystemExit(0 if status_code == 200 else 1)
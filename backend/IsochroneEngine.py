@@ -0,0 +1,67 @@
+# Calcolo delle isocrone al volo sulla rete pedonale in memoria (backend.Graph), usato quando
+# la combinazione minuti/velocità richiesta non è precalcolata in 'isochrone_walk'.
+#
+# L'isocrona di un nodo è il convex hull dei nodi raggiungibili entro la distanza
+# vel * 1000 / 60 * min metri, come per le isocrone precalcolate.
+
+import os
+from functools import lru_cache
+from typing import Dict, Union
+
+import shapely
+from shapely.geometry import mapping
+
+from backend.Graph import WalkGraph, load_walk_graph
+from backend.Parameters import compute_area_km2
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+# Il grafo occupa memoria ed è lento da caricare: il motore va attivato esplicitamente
+ISOCHRONE_ENGINE_ENABLED = os.getenv("ISOCHRONE_ENGINE_ENABLED", "0") == "1"
+# Numero massimo di isocrone calcolate tenute in cache (LRU)
+ISOCHRONE_ENGINE_CACHE_SIZE = int(os.getenv("ISOCHRONE_ENGINE_CACHE_SIZE", "1024"))
+# Buffer in gradi (~10 m) per i nodi che raggiungono meno di tre punti non allineati
+DEGENERATE_HULL_BUFFER = 0.0001
+
+# Grafo caricato all'avvio da load_isochrone_engine(); None se il motore non è attivo
+walk_graph: Union[WalkGraph, None] = None
+
+
+def load_isochrone_engine() -> Union[WalkGraph, None]:
+    """Carica la rete pedonale per il calcolo delle isocrone al volo."""
+    global walk_graph
+    walk_graph = load_walk_graph()
+    compute_isochrone.cache_clear()
+    return walk_graph
+
+
+@lru_cache(maxsize=ISOCHRONE_ENGINE_CACHE_SIZE)
+def compute_isochrone(node_id: int, minute: int, velocity: int) -> Union[Dict, None]:
+    """
+    Calcola l'isocrona di un nodo nello stesso formato di get_isocronewalk_by_node_id.
+
+    :return: {"node_id", "convex_hull": {"coordinates", "bbox"}, "area_km2"}, None se il nodo non è nel grafo
+    """
+    if walk_graph is None:
+        return None
+    row = walk_graph.row(node_id)
+    if row < 0:
+        return None
+
+    rows, _ = walk_graph.bounded_dijkstra(row, velocity * 1000 / 60 * minute)
+    hull = shapely.MultiPoint(list(zip(walk_graph.lons[rows], walk_graph.lats[rows]))).convex_hull
+    if hull.geom_type != "Polygon":
+        hull = hull.buffer(DEGENERATE_HULL_BUFFER).convex_hull
+
+    coordinates = [[list(point) for point in ring] for ring in mapping(hull)["coordinates"]]
+    return {
+        "node_id": node_id,
+        "convex_hull": {
+            "coordinates": coordinates,
+            "bbox": list(hull.bounds)
+        },
+        "area_km2": compute_area_km2(coordinates)
+    }
@@ -1,5 +1,7 @@
 from typing import Union, List, Tuple, Dict
 
+from backend import IsochroneEngine
+from backend.SingleFlight import single_flight
 from backend.db import db
 import logging
 logging.basicConfig(
@@ -8,6 +10,49 @@ logging.basicConfig(
 )
 
 
+def _isochrone_path(minute: int, velocity: int) -> str:
+    """Percorso del sottoalbero di una combinazione minuti/velocità nel documento 'isochrone_walk'."""
+    return f"isochrone.{minute}.{velocity}"
+
+
+def _get_isochrone_subtree(document: Dict, minute: int, velocity: int) -> Dict:
+    return document.get("isochrone", {}).get(str(minute), {}).get(str(velocity), {})
+
+
+def _isochrone_projection(path: str) -> Dict[str, int]:
+    """Campi del sottoalbero 'path' restituiti al client: coordinate e bbox del convex_hull e area."""
+    return {
+        f"{path}.convex_hull.features.geometry.coordinates": 1,
+        f"{path}.convex_hull.bbox": 1,
+        f"{path}.area_km2": 1,
+    }
+
+
+def _isochrone_result(node_id: int, isochrone_data: Dict) -> Dict:
+    # Estrazione dei dati concave_hull
+    result = {
+        "node_id": node_id,
+        "convex_hull": {
+            "coordinates": isochrone_data.get("convex_hull", {}).get("features", [])[0].get("geometry", {})
+            .get("coordinates", []),
+            "bbox": isochrone_data.get("convex_hull", {}).get("bbox", [])
+        }
+    }
+    # area precalcolata accanto al convex_hull (vedi BackfillIsochroneAreas)
+    if isochrone_data.get("area_km2") is not None:
+        result["area_km2"] = isochrone_data["area_km2"]
+    return result
+
+
+def _compute_missing_isochrone(node_id: int, minute: int, velocity: int) -> Union[Dict, None]:
+    """Isocrona calcolata al volo quando non è precalcolata; None se il motore non è attivo."""
+    if IsochroneEngine.walk_graph is None:
+        return None
+    logging.debug(f"Isocrona calcolata al volo per il nodo {node_id}, {minute} minuti e velocità {velocity}")
+    return IsochroneEngine.compute_isochrone(node_id, minute, velocity)
+
+
+@single_flight
 def get_isochrone_bbox_by_node_id(node_id: int, minute: int, velocity: int) -> (
         Tuple)[int, str, Union[List[float], None]]:
     """
@@ -22,15 +67,22 @@ def get_isochrone_bbox_by_node_id(node_id: int, minute: int, velocity: int) -> (
     try:
         collection = db["isochrone_walk"]
 
-        # Query per trovare il documento con il node_id, minuto e velocità specificati
+        # Query per trovare il documento con il node_id specificato,
+        # proiettando solo la bounding box della combinazione minuti/velocità richiesta
         query = {"node_id": node_id}
-        document = collection.find_one(query)
+        projection = {"_id": 0, "node_id": 1, f"{_isochrone_path(minute, velocity)}.convex_hull.bbox": 1}
+        document = collection.find_one(query, projection)
 
+        # Naviga nella struttura annidata per estrarre la bounding box dal convex_hull
+        isochrone_data = _get_isochrone_subtree(document or {}, minute, velocity)
+        if not isochrone_data:
+            computed = _compute_missing_isochrone(node_id, minute, velocity)
+            if computed:
+                return 200, "OK", computed["convex_hull"]["bbox"]
         if not document:
             return 404, "Nessuna isocrona trovata per il node_id fornito", None
-
-        # Naviga nella struttura annidata per estrarre la bounding box dal convex_hull
-        isochrone_data = document.get("isochrone", {}).get(str(minute), {}).get(str(velocity), {})
+        if not isochrone_data:
+            return 404, f"Isocrona non precalcolata per {minute} minuti e velocità {velocity}", None
         convex_hull = isochrone_data.get("convex_hull", {})
 
         # Estrazione della bounding box
@@ -45,16 +97,26 @@ def get_isochrone_bbox_by_node_id(node_id: int, minute: int, velocity: int) -> (
         return 500, f"Errore del server: {str(e)}", None
 
 
+@single_flight
 def get_isocronewalk_by_node_id(node_id: int, minute: int, velocity: int) -> (
         Tuple)[int, str, Union[Dict[str, Union[int, Dict[str, Union[List[List[float]], List[float]]]]], None]]:
     logging.info(f"get_isocronewalk_by_node_id ")
     #print(f"get_isocronewalk_by_node_id {node_id}")
 
     collection = db["isochrone_walk"]
-    # Query per trovare il documento con il node_id specificato
+    # Query per trovare il documento con il node_id specificato: Mongo restituisce solo
+    # coordinate e bbox del convex_hull richiesto, non tutte le combinazioni minuti/velocità
+    path = _isochrone_path(minute, velocity)
     query = {"node_id": node_id}
-    document = collection.find_one(query)
+    projection = {"_id": 0, "node_id": 1, **_isochrone_projection(path)}
+    document = collection.find_one(query, projection)
     #print(document)
+    # Combinazione non precalcolata (o nodo senza documento): calcolo al volo sulla rete pedonale
+    if not _get_isochrone_subtree(document or {}, minute, velocity):
+        computed = _compute_missing_isochrone(node_id, minute, velocity)
+        if computed:
+            return 200, "OK", computed
+
     # Verifica se il documento esiste
     if not document:
         print(f"No data found for the given node_id {node_id}")
@@ -63,24 +125,51 @@ def get_isocronewalk_by_node_id(node_id: int, minute: int, velocity: int) -> (
         return 404, "No data found for the given node_id", None
 
     # Verifica se il campo isochrone esiste per il minuto e la velocità
-    isochrone_data = document.get("isochrone", {}).get(str(minute), {}).get(str(velocity), {})
+    isochrone_data = _get_isochrone_subtree(document, minute, velocity)
 
     # Log di debug per vedere cosa viene trovato
     # print(f"Document trovato: {document}")
     # print(f"isochrone_data per {minute} minuti e velocità {velocity}: {isochrone_data}")
 
     if isochrone_data:
-        # Estrazione dei dati concave_hull
-        result = {
-            "node_id": document["node_id"],
-            "convex_hull": {
-                "coordinates": isochrone_data.get("convex_hull", {}).get("features", [])[0].get("geometry", {})
-                .get("coordinates", []),
-                "bbox": isochrone_data.get("convex_hull", {}).get("bbox", [])
-            }
-        }
-        return 200, "OK", result
+        return 200, "OK", _isochrone_result(document["node_id"], isochrone_data)
     else:
-        logging.debug(f"Dati dell'isocrona non trovati per i parametri specificati")
+        logging.debug(f"Isocrona non precalcolata per {minute} minuti e velocità {velocity}")
+
+        return 404, f"Isocrona non precalcolata per {minute} minuti e velocità {velocity}", None
+
+
+@single_flight
+def get_isochrone_bands_by_node_id(node_id: int, minutes: List[int], velocity: int) -> (
+        Tuple)[int, str, Union[Dict[str, Union[int, List[Dict]]], None]]:
+    """
+    Recupera le isocrone di un nodo per più fasce di minuti con una sola lettura del documento:
+    la proiezione include i sottoalberi di tutte le fasce richieste.
 
-        return 404, "Dati dell'isocrona non trovati per i parametri specificati", None
+    :param node_id: ID del nodo
+    :param minutes: Minuti delle fasce (es. [5, 10, 15, 20])
+    :param velocity: Velocità in km/h
+    :return: Tuple con codice di stato, messaggio e {"node_id", "bands": [{"min", "convex_hull", ...}]}
+             con le fasce in ordine crescente di minuti
+    """
+    try:
+        minutes = sorted(set(minutes))
+        projection = {"_id": 0, "node_id": 1}
+        for minute in minutes:
+            projection.update(_isochrone_projection(_isochrone_path(minute, velocity)))
+        document = db["isochrone_walk"].find_one({"node_id": node_id}, projection)
+
+        bands = []
+        for minute in minutes:
+            isochrone_data = _get_isochrone_subtree(document or {}, minute, velocity)
+            if isochrone_data:
+                band = _isochrone_result(node_id, isochrone_data)
+            else:
+                band = _compute_missing_isochrone(node_id, minute, velocity)
+            if not band:
+                return 404, f"Isocrona non precalcolata per {minute} minuti e velocità {velocity}", None
+            bands.append({"min": minute, **{k: v for k, v in band.items() if k != "node_id"}})
+
+        return 200, "OK", {"node_id": node_id, "bands": bands}
+    except Exception as e:
+        return 500, f"Errore del server: {str(e)}", None
@@ -0,0 +1,131 @@
+# Livello di dettaglio (LOD) dei poligoni inviati alla mappa: semplificazione che preserva la
+# topologia e arrotondamento delle coordinate, per risposte più leggere e un rendering più veloce
+# sui dispositivi mobili. Le coordinate sono in gradi, in qualunque ordine ([lat, lon] o [lon, lat]).
+
+import math
+import os
+from typing import Dict, Hashable, List, Tuple, Union
+
+import numpy as np
+import shapely
+
+from backend.Cache import CACHE_ENABLED, CACHE_TTL_S, TTLCache
+
+# Cifre decimali massime: 7 cifre sono ~1 cm, oltre non serve a nessuno zoom
+MAX_PRECISION = 7
+MAX_ZOOM = 22
+
+# Isocrone semplificate per (chiave del risultato completo, tolleranza, precisione)
+ISOCHRONE_LOD_CACHE_SIZE = int(os.getenv("ISOCHRONE_LOD_CACHE_SIZE", "1024"))
+_simplified_isochrones = TTLCache(max_size=ISOCHRONE_LOD_CACHE_SIZE, ttl=CACHE_TTL_S)
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """Tolleranza in gradi pari a mezzo pixel di una tile da 256 px al livello di zoom dato."""
+    zoom = min(max(zoom, 0), MAX_ZOOM)
+    return 360.0 / (256 * 2 ** zoom) / 2
+
+
+def quantize_tolerance(tolerance: float) -> float:
+    """
+    Tolleranza arrotondata a quella del livello di zoom più vicino: i livelli di dettaglio possibili
+    (e quindi le voci delle cache per livello) sono al più MAX_ZOOM + 1.
+    """
+    if tolerance <= 0:
+        return 0.0
+    zoom = round(math.log2(zoom_tolerance(0) / tolerance))
+    return zoom_tolerance(min(max(zoom, 0), MAX_ZOOM))
+
+
+def tolerance_precision(tolerance: float) -> int:
+    """Cifre decimali sufficienti a rappresentare la tolleranza data."""
+    if tolerance <= 0:
+        return MAX_PRECISION
+    return min(max(math.ceil(-math.log10(tolerance)) + 1, 0), MAX_PRECISION)
+
+
+def resolve_level_of_detail(zoom: Union[int, None] = None, tolerance: Union[float, None] = None,
+                            precision: Union[int, None] = None) -> Union[Tuple[float, Union[int, None]], None]:
+    """
+    Normalizza i parametri di LOD delle richieste.
+    La tolleranza esplicita prevale sullo zoom e viene arrotondata a quella dello zoom più vicino;
+    senza precisione esplicita si usa quella della tolleranza.
+
+    :return: (tolleranza, cifre decimali o None), oppure None se non è richiesto alcun LOD
+    """
+    if tolerance is None and zoom is not None:
+        tolerance = zoom_tolerance(zoom)
+    if tolerance is None and precision is None:
+        return None
+
+    tolerance = quantize_tolerance(max(tolerance or 0.0, 0.0))
+    if precision is None and tolerance > 0:
+        precision = tolerance_precision(tolerance)
+    if precision is not None:
+        precision = min(max(precision, 0), MAX_PRECISION)
+    return tolerance, precision
+
+
+def simplify_rings(rings: List[List[List[float]]], tolerance: float,
+                   precision: Union[int, None]) -> List[List[List[float]]]:
+    """Semplifica un poligono (anello esterno e buchi) e ne arrotonda le coordinate."""
+    if tolerance > 0:
+        polygon = shapely.Polygon(rings[0], rings[1:])
+        simplified = polygon.simplify(tolerance, preserve_topology=True)
+        # un poligono minuscolo rispetto alla tolleranza resta com'è invece di sparire
+        if simplified.geom_type == "Polygon" and not simplified.is_empty:
+            polygon = simplified
+        rings = [polygon.exterior.coords] + [interior.coords for interior in polygon.interiors]
+
+    arrays = [np.asarray(ring, dtype=np.float64) for ring in rings]
+    if precision is not None:
+        arrays = [np.round(ring, precision) for ring in arrays]
+    return [ring.tolist() for ring in arrays]
+
+
+def _simplify_convex_hull(convex_hull: Dict, tolerance: float, precision: Union[int, None]) -> Dict:
+    simplified = {**convex_hull, "coordinates": simplify_rings(convex_hull["coordinates"], tolerance, precision)}
+    if precision is not None and convex_hull.get("bbox"):
+        simplified["bbox"] = [round(value, precision) for value in convex_hull["bbox"]]
+    return simplified
+
+
+def simplify_isochrone(isochrone: Dict, tolerance: float, precision: Union[int, None]) -> Dict:
+    """
+    Copia semplificata del risultato di get_isocronewalk_by_node_id o di get_isochrone_bands_by_node_id:
+    l'originale (che può essere in cache) non viene modificato.
+    """
+    if "bands" in isochrone:
+        return {
+            **isochrone,
+            "bands": [
+                {**band, "convex_hull": _simplify_convex_hull(band["convex_hull"], tolerance, precision)}
+                for band in isochrone["bands"]
+            ]
+        }
+    return {**isochrone, "convex_hull": _simplify_convex_hull(isochrone["convex_hull"], tolerance, precision)}
+
+
+def cached_simplify_isochrone(key: Hashable, isochrone: Dict, tolerance: float,
+                              precision: Union[int, None]) -> Dict:
+    """
+    simplify_isochrone passando dalla cache: key identifica il risultato completo (la chiave di
+    Cache.cache_key), così ogni livello di dettaglio di un'isocrona viene semplificato una volta sola.
+    """
+    if not CACHE_ENABLED:
+        return simplify_isochrone(isochrone, tolerance, precision)
+
+    level_key = (key, tolerance, precision)
+    hit, simplified = _simplified_isochrones.get(level_key)
+    if not hit:
+        simplified = simplify_isochrone(isochrone, tolerance, precision)
+        _simplified_isochrones.set(level_key, simplified)
+    return simplified
+
+
+def simplify_neighbourhoods(neighbourhoods: List[Dict], tolerance: float, precision: Union[int, None]) -> List[Dict]:
+    """Copie semplificate dei quartieri nel formato di get_all_neighbourhoods."""
+    return [
+        {**neighbourhood, "coordinates": simplify_rings(neighbourhood["coordinates"], tolerance, precision)}
+        for neighbourhood in neighbourhoods
+    ]
@@ -0,0 +1,78 @@
+# Migrazione di distances_to_pois_walk al formato ordinato letto da Poi._distance_stages:
+#   poi_ids / poi_distances  -> array paralleli ordinati per distanza crescente
+#   poi_bucket_counts        -> numero di POI con distanza < (i + 1) * POI_DISTANCE_BUCKET_M
+#
+# Uso: python -m backend.MigratePoiDistances [--batch-size 500] [--force] [--drop-legacy]
+
+import argparse
+from bisect import bisect_left
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+from backend.Poi import POI_DISTANCE_BUCKET_M
+from backend.db import db
+import logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+
+def sorted_distances_fields(pois: List[List]) -> Dict:
+    """Campi del formato ordinato a partire dalla lista [[poi_id, distanza], ...] di un nodo."""
+    pois = sorted(pois, key=lambda p: p[1])
+    distances = [p[1] for p in pois]
+
+    n_buckets = int(distances[-1] // POI_DISTANCE_BUCKET_M) + 1 if distances else 1
+    bucket_counts = [bisect_left(distances, (i + 1) * POI_DISTANCE_BUCKET_M) for i in range(n_buckets)]
+
+    return {
+        "poi_ids": [p[0] for p in pois],
+        "poi_distances": distances,
+        "poi_bucket_counts": bucket_counts,
+    }
+
+
+def migrate_distances_to_pois(batch_size: int = 500, force: bool = False, drop_legacy: bool = False) -> int:
+    """
+    Converte i documenti di distances_to_pois_walk al formato ordinato.
+    È idempotente: senza force i documenti già migrati vengono saltati, quindi può essere interrotta e rilanciata.
+
+    :param batch_size: Documenti aggiornati per ogni bulk_write
+    :param force: Ricalcola anche i documenti già migrati
+    :param drop_legacy: Rimuove il vecchio campo 'PoIs' dopo la conversione
+    :return: Numero di documenti aggiornati
+    """
+    collection = db["distances_to_pois_walk"]
+    query = {"PoIs": {"$exists": True}}
+    if not force:
+        query["poi_distances"] = {"$exists": False}
+
+    updated = 0
+    operations = []
+    for document in collection.find(query, {"_id": 1, "PoIs": 1}):
+        update = {"$set": sorted_distances_fields(document.get("PoIs") or [])}
+        if drop_legacy:
+            update["$unset"] = {"PoIs": ""}
+        operations.append(UpdateOne({"_id": document["_id"]}, update))
+
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            logging.info(f"Documenti migrati: {updated}")
+
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    logging.info(f"Migrazione completata: {updated} documenti aggiornati")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ordina le distanze dei POI per nodo in distances_to_pois_walk")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--force", action="store_true", help="ricalcola anche i documenti già migrati")
+    parser.add_argument("--drop-legacy", action="store_true", help="rimuove il vecchio campo PoIs")
+    args = parser.parse_args()
+
+    migrate_distances_to_pois(args.batch_size, args.force, args.drop_legacy)
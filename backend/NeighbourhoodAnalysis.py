@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Union
+
+from backend.Nodes import Coordinates, get_id_node_by_coordinates
+from backend.Cache import cached_call
+from backend.Search import get_parameters_by_node_id
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+# Numero di nodi analizzati in parallelo (le ricerche sono per lo più attesa su MongoDB)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+# metrica media del quartiere -> parametro di compute_isochrone_parameters
+METRICS = {
+    "proximity": "proximity_score",
+    "density": "density_score",
+    "entropy": "entropy_score",
+    "accessibility": "poi_accessibility",
+    "closeness": "closeness",
+}
+
+
+def _analyze_point(point: List[float], min: int, vel: int, categories: List[str]) -> Union[Dict, None]:
+    """Parametri dell'isocrona per un punto [lat, lon]; None se il punto non è analizzabile."""
+    status_code, message, node_id = get_id_node_by_coordinates(Coordinates(lat=point[0], lon=point[1]))
+    if status_code != 200:
+        return None
+
+    # i nodi di confine condivisi tra quartieri (o già analizzati) vengono dalla cache
+    status_code, message, parameters = cached_call("parameters", get_parameters_by_node_id, node_id, min, vel, categories)
+    if status_code != 200:
+        return None
+    return parameters
+
+
+def _averages(parameters: List[Dict]) -> Dict[str, Union[float, None]]:
+    averages = {}
+    for metric, key in METRICS.items():
+        values = [p[key] for p in parameters if isinstance(p.get(key), (int, float))]
+        averages[metric] = sum(values) / len(values) if values else None
+    return averages
+
+
+def _sample_points(neighbourhoods: List[Dict], max_nodes: int) -> Dict[Union[int, str], List[List[float]]]:
+    """
+    Primi max_nodes nodi di confine per quartiere. Un quartiere con più poligoni compare nel payload
+    una volta per poligono con lo stesso id: i nodi dei suoi poligoni vengono uniti in un solo campione.
+    """
+    points = {}
+    for neighbourhood in neighbourhoods:
+        rings = neighbourhood.get("coordinates") or [[]]
+        points.setdefault(neighbourhood["id"], []).extend(rings[0])
+    return {neighbourhood_id: ring[:max_nodes] for neighbourhood_id, ring in points.items()}
+
+
+def analyze_neighbourhoods(neighbourhoods: List[Dict], min: int, vel: int, categories: List[str],
+                           max_nodes: int = 25) -> Iterator[Dict]:
+    """
+    Analizza più quartieri in parallelo usando come campione i primi max_nodes nodi di confine
+    (gli stessi usati per disegnare i quartieri) e restituisce gli eventi di avanzamento:
+
+    - {"type": "start", "neighbourhood_id", "total", "coordinates"} per ogni quartiere
+    - {"type": "node", "neighbourhood_id", "index", "parameters", "done", "total"} per ogni nodo completato
+    - {"type": "result", "neighbourhood_id", "nodes_analyzed", "averages"} quando un quartiere è completo
+
+    I nodi di tutti i quartieri vengono distribuiti sullo stesso pool di thread. Se il generatore viene
+    chiuso prima della fine (il client si è disconnesso) i nodi non ancora iniziati vengono annullati.
+    """
+    futures = {}
+    totals = {}
+    pending = {}
+    collected = {}
+
+    try:
+        for neighbourhood_id, points in _sample_points(neighbourhoods, max_nodes).items():
+            totals[neighbourhood_id] = len(points)
+            pending[neighbourhood_id] = len(points)
+            collected[neighbourhood_id] = []
+            yield {"type": "start", "neighbourhood_id": neighbourhood_id, "total": len(points), "coordinates": points}
+
+            for index, point in enumerate(points):
+                future = _executor.submit(_analyze_point, point, min, vel, categories)
+                futures[future] = (neighbourhood_id, index)
+
+            if not points:
+                yield {"type": "result", "neighbourhood_id": neighbourhood_id, "nodes_analyzed": 0,
+                       "averages": _averages([])}
+
+        for future in as_completed(futures):
+            neighbourhood_id, index = futures[future]
+            try:
+                parameters = future.result()
+            except Exception as e:
+                logging.error(f"Errore nell'analisi del nodo {index} del quartiere {neighbourhood_id}: {str(e)}")
+                parameters = None
+
+            if parameters is not None:
+                collected[neighbourhood_id].append(parameters)
+            pending[neighbourhood_id] -= 1
+
+            yield {"type": "node", "neighbourhood_id": neighbourhood_id, "index": index, "parameters": parameters,
+                   "done": totals[neighbourhood_id] - pending[neighbourhood_id], "total": totals[neighbourhood_id]}
+
+            if pending[neighbourhood_id] == 0:
+                yield {"type": "result", "neighbourhood_id": neighbourhood_id,
+                       "nodes_analyzed": len(collected[neighbourhood_id]),
+                       "averages": _averages(collected[neighbourhood_id])}
+    finally:
+        # analisi abbandonata: i task in coda non occupano il pool condiviso con le altre richieste
+        for future in futures:
+            future.cancel()
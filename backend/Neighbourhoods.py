@@ -1,4 +1,16 @@
+import gzip
+import hashlib
+import json
+import math
+import os
 from typing import Union, List, Tuple, Dict
+
+import numpy as np
+import shapely
+
+from backend.Cache import DATASET_VERSION, TTLCache
+from backend.LevelOfDetail import simplify_neighbourhoods
+from backend.SingleFlight import single_flight
 from backend.db import db
 import logging
 
@@ -7,9 +19,129 @@ logging.basicConfig(
 )
 
 
+class NeighbourhoodsPayload:
+    """
+    Lista dei quartieri già convertita per Leaflet e serializzata una volta per versione dei dati:
+    JSON, JSON compresso con gzip ed ETag, pronti per essere restituiti così come sono.
+    """
+
+    def __init__(self, neighbourhoods: List[Dict]):
+        self.neighbourhoods = neighbourhoods
+        self.body = json.dumps(neighbourhoods, separators=(",", ":")).encode("utf-8")
+        self.gzip_body = gzip.compress(self.body, compresslevel=9)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{DATASET_VERSION}-{digest}"'
+        # la variante compressa ha byte diversi, quindi un ETag diverso
+        self.gzip_etag = f'"{DATASET_VERSION}-{digest}-gzip"'
+
+
+# Payload per versione dei dati, costruiti alla prima richiesta
+_payloads: Dict[str, NeighbourhoodsPayload] = {}
+# Payload semplificati per (versione, tolleranza, precisione): pochi livelli usati, senza scadenza
+NEIGHBOURHOODS_LOD_CACHE_SIZE = int(os.getenv("NEIGHBOURHOODS_LOD_CACHE_SIZE", "32"))
+_level_payloads = TTLCache(max_size=NEIGHBOURHOODS_LOD_CACHE_SIZE, ttl=math.inf)
+
+
+def _to_leaflet(documents: List[Dict]) -> List[Dict]:
+    """Estrae i poligoni dei quartieri dai documenti di 'neighbourhood_polygon' in formato Leaflet."""
+    neighbourhoods_list = []
+
+    for doc in documents:
+        # prendiamo tutti i quartieri dal documento
+        for neighbourhood in doc.get("neighbourhoods", []):
+            # prendiamo la geometria del convex_hull
+            convex_hull = neighbourhood.get("geometry", {}).get("convex_hull", {})
+            if not convex_hull or "features" not in convex_hull:
+                continue
+
+            for feature in convex_hull["features"]:
+                feature_geometry = feature.get("geometry", {})
+                coordinates = feature_geometry.get("coordinates", [])
+                if feature_geometry.get("type") != "Polygon" or not coordinates:
+                    continue
+
+                # convertiamo le coordinate per Leaflet (usa [lat, lon] invece di [lon, lat])
+                polygon_coords = [np.asarray(ring, dtype=np.float64)[:, 1::-1].tolist() for ring in coordinates]
+
+                neighbourhoods_list.append({
+                    "id": neighbourhood.get("id"),
+                    "coordinates": polygon_coords,
+                    "bbox": feature.get("bbox", []),
+                    "properties": feature.get("properties", {})
+                })
+
+    return neighbourhoods_list
+
+
+def _check_city(city_name: Union[str, None]) -> Union[str, None]:
+    # per ora abbiamo solo Torino nel database
+    if city_name and city_name.lower() not in ['torino', 'turin']:
+        return f"No neighbourhood data available for {city_name}. Currently only Torino is supported."
+    return None
+
+
+def _build_payload() -> Tuple[int, str, Union[NeighbourhoodsPayload, None]]:
+    payload = _payloads.get(DATASET_VERSION)
+    if payload is not None:
+        return 200, "OK", payload
+
+    logging.info(f"Building neighbourhoods payload for dataset version {DATASET_VERSION}")
+    collection = db["neighbourhood_polygon"]
+
+    # cerchiamo tutti i documenti con i quartieri
+    documents = list(collection.find({"neighbourhoods": {"$exists": True}}))
+    if not documents:
+        return 404, "No neighbourhoods found", None
+
+    payload = _payloads[DATASET_VERSION] = NeighbourhoodsPayload(_to_leaflet(documents))
+    logging.info(f"Found {len(payload.neighbourhoods)} neighbourhoods ({len(payload.gzip_body)} bytes gzip)")
+    return 200, "OK", payload
+
+
+@single_flight
+def get_neighbourhoods_payload(city_name: str = None, tolerance: float = None,
+                               precision: int = None) -> Tuple[int, str, Union[NeighbourhoodsPayload, None]]:
+    """
+    Restituisce il payload dei quartieri per la versione corrente dei dati, costruendolo
+    (lettura di 'neighbourhood_polygon', conversione e serializzazione) solo la prima volta.
+    Con tolerance e/o precision il payload è semplificato (vedi LevelOfDetail) e tenuto in cache per livello.
+
+    Args:
+        city_name: Nome della città per validare se i quartieri sono disponibili
+        tolerance: Tolleranza di semplificazione in gradi
+        precision: Cifre decimali delle coordinate
+
+    Returns:
+        Tuple[int, str, Union[NeighbourhoodsPayload, None]]: (status_code, message, payload)
+    """
+    try:
+        message = _check_city(city_name)
+        if message:
+            return 404, message, None
+
+        status_code, message, payload = _build_payload()
+        if status_code != 200 or (tolerance is None and precision is None):
+            return status_code, message, payload
+
+        level = (DATASET_VERSION, tolerance, precision)
+        hit, simplified = _level_payloads.get(level)
+        if not hit:
+            simplified = NeighbourhoodsPayload(simplify_neighbourhoods(payload.neighbourhoods, tolerance or 0.0, precision))
+            _level_payloads.set(level, simplified)
+            logging.info(f"Neighbourhoods payload for tolerance={tolerance}, precision={precision}: "
+                         f"{len(simplified.gzip_body)} bytes gzip")
+        return 200, "OK", simplified
+
+    except Exception as e:
+        logging.error(f"Error fetching neighbourhoods: {str(e)}")
+        return 500, f"Server error: {str(e)}", None
+
+
 def get_all_neighbourhoods(city_name: str = None) -> Tuple[int, str, Union[List[Dict], None]]:
     """
     Recupera tutti i quartieri dalla collezione 'neighbourhood_polygon'.
+    La lista viene costruita una volta per versione dei dati (vedi get_neighbourhoods_payload)
+    ed è condivisa: non va modificata.
     
     Args:
         city_name: Nome della città per validare se i quartieri sono disponibili
@@ -17,63 +149,98 @@ def get_all_neighbourhoods(city_name: str = None) -> Tuple[int, str, Union[List[
     Returns:
         Tuple[int, str, Union[List[Dict], None]]: (status_code, message, neighbourhoods_list)
     """
+    logging.info(f"Fetching neighbourhoods for city: {city_name}")
+    status_code, message, payload = get_neighbourhoods_payload(city_name)
+    if status_code != 200:
+        return status_code, message, None
+    return 200, "OK", payload.neighbourhoods
+
+
+def get_neighbourhoods_by_ids(ids: List[Union[int, str]]) -> Tuple[int, str, Union[List[Dict], None]]:
+    """
+    Recupera i quartieri con gli id indicati, nello stesso formato di get_all_neighbourhoods:
+    un quartiere formato da più poligoni compare una volta per poligono, con lo stesso id.
+
+    Args:
+        ids: Lista degli id dei quartieri
+
+    Returns:
+        Tuple[int, str, Union[List[Dict], None]]: (status_code, message, neighbourhoods_list)
+    """
+    status_code, message, neighbourhoods = get_all_neighbourhoods()
+    if status_code != 200:
+        return status_code, message, None
+
+    # confrontiamo come stringhe: gli id arrivano dal frontend sia come numeri che come testo
+    wanted = {str(i) for i in ids}
+    neighbourhoods_list = [n for n in neighbourhoods if str(n["id"]) in wanted]
+
+    if not neighbourhoods_list:
+        return 404, "No neighbourhoods found for the given ids", None
+    return 200, "OK", neighbourhoods_list
+
+
+class NeighbourhoodIndex:
+    """
+    Indice spaziale in memoria (shapely STRtree) sui poligoni dei quartieri,
+    per trovare i quartieri che contengono un punto senza interrogare MongoDB.
+    I poligoni sono in [lon, lat]; i quartieri restituiti sono nel formato di get_all_neighbourhoods.
+    """
+
+    def __init__(self, neighbourhoods: List[Dict]):
+        self.neighbourhoods = neighbourhoods
+        polygons = []
+        for neighbourhood in neighbourhoods:
+            # le coordinate del payload sono già in formato Leaflet [lat, lon]
+            rings = [np.asarray(ring, dtype=np.float64)[:, ::-1] for ring in neighbourhood["coordinates"]]
+            polygons.append(shapely.Polygon(rings[0], rings[1:]))
+        self.polygons = np.array(polygons, dtype=object)
+        self.tree = shapely.STRtree(self.polygons)
+
+    def __len__(self):
+        return len(self.neighbourhoods)
+
+    def containing(self, lon: float, lat: float) -> List[Dict]:
+        """Quartieri che contengono il punto (bordo compreso), nell'ordine del payload."""
+        positions = self.tree.query(shapely.Point(lon, lat), predicate="intersects")
+        return [self.neighbourhoods[i] for i in np.sort(positions)]
+
+    def assign(self, lons, lats) -> np.ndarray:
+        """
+        Assegna molti punti ai quartieri in una sola interrogazione dell'albero.
+
+        :return: per ogni punto la posizione del primo quartiere che lo contiene, -1 se nessuno
+        """
+        points = shapely.points(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+        point_idx, tree_idx = self.tree.query(points, predicate="intersects")
+        assigned = np.full(len(points), -1, dtype=np.int64)
+        if len(point_idx):
+            order = np.lexsort((tree_idx, point_idx))
+            first = np.unique(point_idx[order], return_index=True)[1]
+            assigned[point_idx[order][first]] = tree_idx[order][first]
+        return assigned
+
+
+# Indici per versione dei dati, costruiti alla prima richiesta
+_indexes: Dict[str, NeighbourhoodIndex] = {}
+
+
+@single_flight
+def get_neighbourhood_index() -> Tuple[int, str, Union[NeighbourhoodIndex, None]]:
+    """Restituisce l'indice dei quartieri per la versione corrente dei dati, costruendolo la prima volta."""
+    index = _indexes.get(DATASET_VERSION)
+    if index is not None:
+        return 200, "OK", index
+
+    status_code, message, payload = get_neighbourhoods_payload()
+    if status_code != 200:
+        return status_code, message, None
     try:
-        logging.info(f"Fetching neighbourhoods for city: {city_name}")
-        
-        # per ora abbiamo solo Torino nel database
-        if city_name and city_name.lower() not in ['torino', 'turin']:
-            return 404, f"No neighbourhood data available for {city_name}. Currently only Torino is supported.", None
-        
-        collection = db["neighbourhood_polygon"]
-        
-        # cerchiamo tutti i documenti con i quartieri
-        documents = list(collection.find({"neighbourhoods": {"$exists": True}}))
-        
-        if not documents:
-            return 404, "No neighbourhoods found", None
-        
-        neighbourhoods_list = []
-        
-        for doc in documents:
-            # prendiamo tutti i quartieri dal documento
-            doc_neighbourhoods = doc.get("neighbourhoods", [])
-            
-            for neighbourhood in doc_neighbourhoods:
-                # prendiamo la geometria del convex_hull
-                geometry = neighbourhood.get("geometry", {})
-                convex_hull = geometry.get("convex_hull", {})
-                
-                if convex_hull and "features" in convex_hull:
-                    features = convex_hull["features"]
-                    
-                    for feature in features:
-                        feature_geometry = feature.get("geometry", {})
-                        
-                        if feature_geometry.get("type") == "Polygon":
-                            coordinates = feature_geometry.get("coordinates", [])
-                            bbox = feature.get("bbox", [])
-                            
-                            if coordinates:
-                                # convertiamo le coordinate per Leaflet (usa [lat, lon] invece di [lon, lat])
-                                polygon_coords = []
-                                for ring in coordinates:
-                                    converted_ring = [[coord[1], coord[0]] for coord in ring]
-                                    polygon_coords.append(converted_ring)
-                                
-                                neighbourhood_data = {
-                                    "id": neighbourhood.get("id"),
-                                    "coordinates": polygon_coords,
-                                    "bbox": bbox,
-                                    "properties": feature.get("properties", {})
-                                }
-                                
-                                neighbourhoods_list.append(neighbourhood_data)
-        
-        logging.info(f"Found {len(neighbourhoods_list)} neighbourhoods")
-        return 200, "OK", neighbourhoods_list
-        
+        index = _indexes[DATASET_VERSION] = NeighbourhoodIndex(payload.neighbourhoods)
+        logging.info(f"Neighbourhood index built: {len(index)} polygons")
+        return 200, "OK", index
     except Exception as e:
-        logging.error(f"Error fetching neighbourhoods: {str(e)}")
+        logging.error(f"Error building neighbourhood index: {str(e)}")
         return 500, f"Server error: {str(e)}", None
 
 
@@ -90,68 +257,42 @@ def get_neighbourhoods_by_coordinates(lat: float, lon: float) -> Tuple[int, str,
     """
     try:
         logging.info(f"Finding neighbourhoods containing point: lat={lat}, lon={lon}")
-        collection = db["neighbourhood_polygon"]
-        
-        # cerchiamo quartieri che contengono questo punto
-        # MongoDB usa [lon, lat] per le coordinate
-        query = {
-            "neighbourhoods": {
-                "$elemMatch": {
-                    "geometry.convex_hull": {
-                        "$geoIntersects": {
-                            "$geometry": {
-                                "type": "Point",
-                                "coordinates": [lon, lat]
-                            }
-                        }
-                    }
-                }
-            }
-        }
-        
-        documents = list(collection.find(query))
-        
-        if not documents:
+        status_code, message, index = get_neighbourhood_index()
+        if status_code != 200:
+            return status_code, message, None
+
+        neighbourhoods_list = index.containing(lon, lat)
+        if not neighbourhoods_list:
             return 404, "No neighbourhoods found for the given coordinates", None
-        
-        neighbourhoods_list = []
-        
-        for doc in documents:
-            doc_neighbourhoods = doc.get("neighbourhoods", [])
-            
-            for neighbourhood in doc_neighbourhoods:
-                geometry = neighbourhood.get("geometry", {})
-                convex_hull = geometry.get("convex_hull", {})
-                
-                if convex_hull and "features" in convex_hull:
-                    features = convex_hull["features"]
-                    
-                    for feature in features:
-                        feature_geometry = feature.get("geometry", {})
-                        if feature_geometry.get("type") == "Polygon":
-                            coordinates = feature_geometry.get("coordinates", [])
-                            bbox = feature.get("bbox", [])
-                            
-                            if coordinates:
-                                # convertiamo le coordinate per Leaflet
-                                polygon_coords = []
-                                for ring in coordinates:
-                                    converted_ring = [[coord[1], coord[0]] for coord in ring]
-                                    polygon_coords.append(converted_ring)
-                                
-                                neighbourhood_data = {
-                                    "id": neighbourhood.get("id"),
-                                    "coordinates": polygon_coords,
-                                    "bbox": bbox,
-                                    "properties": feature.get("properties", {})
-                                }
-                                
-                                neighbourhoods_list.append(neighbourhood_data)
-        
+
         logging.info(f"Found {len(neighbourhoods_list)} neighbourhoods for coordinates")
         return 200, "OK", neighbourhoods_list
-        
+
     except Exception as e:
         logging.error(f"Error finding neighbourhoods by coordinates: {str(e)}")
-        logging.info("Falling back to get all neighbourhoods")
-        return get_all_neighbourhoods()
+        return 500, f"Server error: {str(e)}", None
+
+
+def assign_neighbourhoods(lats: List[float], lons: List[float]) -> Tuple[int, str, Union[List[Union[int, str, None]], None]]:
+    """
+    Assegna a ogni punto l'id del quartiere che lo contiene (None se fuori da tutti i quartieri).
+    Pensata per i job di analisi che devono collocare molti punti o nodi.
+
+    Args:
+        lats: Latitudini dei punti
+        lons: Longitudini dei punti
+
+    Returns:
+        Tuple[int, str, Union[List, None]]: (status_code, message, ids nell'ordine dei punti)
+    """
+    try:
+        status_code, message, index = get_neighbourhood_index()
+        if status_code != 200:
+            return status_code, message, None
+
+        assigned = index.assign(lons, lats)
+        return 200, "OK", [index.neighbourhoods[i]["id"] if i >= 0 else None for i in assigned]
+
+    except Exception as e:
+        logging.error(f"Error assigning neighbourhoods: {str(e)}")
+        return 500, f"Server error: {str(e)}", None
@@ -0,0 +1,151 @@
+# Metriche per nodo materializzate per i preset standard dell'interfaccia:
+# tutti i minuti e le velocità offerti dall'UI, con il set di categorie di default (tutto il catalogo).
+# Le richieste che corrispondono a un preset vengono servite con una lettura indicizzata dalla
+# collezione 'node_metrics'; le altre continuano a essere calcolate al volo.
+#
+# Uso: python -m backend.NodeMetrics [--workers 8] [--batch-size 200] [--force]
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+from pymongo import ASCENDING, UpdateOne
+
+from backend.Closeness import get_closeness_by_node_id
+from backend.Isochrones import get_isocronewalk_by_node_id
+from backend.Parameters import (compute_area_km2_from_iso, compute_isochrone_parameters_batch,
+                                stack_parameters_inputs)
+from backend.Poi import get_detailed_pois_by_node_id
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+PRESET_MINUTES = [5, 10, 15, 20]
+PRESET_VELOCITIES = [3, 5, 12, 20]
+PRESET_NAME = "default"
+
+# Set di categorie di default: tutte le categorie del catalogo (gruppi e sottocategorie).
+# Gli id di categories.json devono essere gli stessi che il frontend invia
+# (frontend/public/js/config/servicesList.js), altrimenti "seleziona tutto" non usa il preset
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "categories.json")) as f:
+    _catalogue = json.load(f)
+PRESET_CATEGORIES = sorted(set(_catalogue) | {c for group in _catalogue.values() for c in group})
+
+METRICS = ["proximity", "proximity_score", "density_score", "entropy_score", "poi_accessibility"]
+
+
+def is_preset(min: int, vel: int, categories: List[str]) -> bool:
+    """True se la richiesta corrisponde a un preset materializzato."""
+    return min in PRESET_MINUTES and vel in PRESET_VELOCITIES and sorted(categories) == PRESET_CATEGORIES
+
+
+def get_node_metrics(node_id: int, min: int, vel: int) -> Tuple[int, str, Union[Dict, None]]:
+    """
+    Legge le metriche materializzate di un nodo per il preset (min, vel).
+
+    :return: Tuple con codice di stato, messaggio e i parametri nello stesso formato di compute_isochrone_parameters
+    """
+    try:
+        document = db["node_metrics"].find_one(
+            {"node_id": node_id, "min": min, "vel": vel, "preset": PRESET_NAME},
+            {"_id": 0, **{metric: 1 for metric in METRICS}}
+        )
+        if not document:
+            return 404, "Metriche non materializzate per il nodo e il preset richiesti", None
+
+        # "ND" è salvato come null, come la proximity dei nodi senza POI
+        if document.get("proximity") is None:
+            document["proximity"] = "ND"
+        status_code, message, document["closeness"] = get_closeness_by_node_id(node_id, min, vel)
+        return 200, "OK", document
+    except Exception as e:
+        return 500, f"Errore del server: {str(e)}", None
+
+
+def _load_preset_inputs(node_id: int, min: int, vel: int) -> Union[Tuple[List[Dict], int, float], None]:
+    status_code, message, isochrone = get_isocronewalk_by_node_id(node_id=node_id, minute=min, velocity=vel)
+    if status_code != 200:
+        return None
+    status_code, message, pois, total_count = get_detailed_pois_by_node_id(node_id, min, vel, PRESET_CATEGORIES)
+    if status_code != 200 or not isinstance(pois, list):
+        return None
+    return pois, total_count, compute_area_km2_from_iso(isochrone)
+
+
+def _materialize_batch(executor: ThreadPoolExecutor, node_ids: List[int], min: int, vel: int) -> List[UpdateOne]:
+    inputs = list(executor.map(lambda node_id: _load_preset_inputs(node_id, min, vel), node_ids))
+    loaded = [(node_id, i) for node_id, i in zip(node_ids, inputs) if i is not None]
+    if not loaded:
+        return []
+
+    distances, offsets, codes = stack_parameters_inputs([i[0] for _, i in loaded], PRESET_CATEGORIES)
+    metrics = compute_isochrone_parameters_batch(
+        distances, offsets, codes,
+        total_pois=[i[1] for _, i in loaded],
+        areas_km2=[i[2] for _, i in loaded],
+        vel=vel,
+        max_minutes=60,
+        categories=PRESET_CATEGORIES
+    )
+
+    operations = []
+    for row, (node_id, _) in enumerate(loaded):
+        values = {metric: float(metrics[metric][row]) for metric in METRICS}
+        if values["proximity"] != values["proximity"]:  # NaN -> "ND"
+            values["proximity"] = None
+        key = {"node_id": node_id, "min": min, "vel": vel, "preset": PRESET_NAME}
+        operations.append(UpdateOne(key, {"$set": {**key, **values}}, upsert=True))
+    return operations
+
+
+def materialize_node_metrics(workers: int = 8, batch_size: int = 200, force: bool = False) -> int:
+    """
+    Calcola e salva in 'node_metrics' le metriche di ogni nodo per ogni preset (min, vel).
+    Senza force i nodi già materializzati per un preset vengono saltati, quindi il job può essere rilanciato.
+
+    :param workers: Thread usati per leggere isocrone e POI dei nodi
+    :param batch_size: Nodi per ogni calcolo vettoriale e bulk_write
+    :param force: Ricalcola anche le metriche già presenti
+    :return: Numero di documenti scritti
+    """
+    collection = db["node_metrics"]
+    collection.create_index(
+        [("node_id", ASCENDING), ("min", ASCENDING), ("vel", ASCENDING), ("preset", ASCENDING)],
+        unique=True
+    )
+    node_ids = db["isochrone_walk"].distinct("node_id")
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for min in PRESET_MINUTES:
+            for vel in PRESET_VELOCITIES:
+                todo = node_ids
+                if not force:
+                    done = set(collection.distinct("node_id", {"min": min, "vel": vel, "preset": PRESET_NAME}))
+                    todo = [node_id for node_id in node_ids if node_id not in done]
+
+                for start in range(0, len(todo), batch_size):
+                    operations = _materialize_batch(executor, todo[start:start + batch_size], min, vel)
+                    if operations:
+                        result = collection.bulk_write(operations, ordered=False)
+                        written += result.upserted_count + result.modified_count
+                logging.info(f"Preset {min} min, {vel} km/h completato ({written} documenti scritti)")
+
+    return written
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Materializza le metriche per nodo dei preset standard")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--force", action="store_true", help="ricalcola anche le metriche già presenti")
+    args = parser.parse_args()
+
+    materialize_node_metrics(args.workers, args.batch_size, args.force)
@@ -1,5 +1,8 @@
-from typing import Union, Tuple
+import math
+import os
+from typing import Union, Tuple, List, Dict
 
+import numpy as np
 from pydantic import BaseModel
 
 from backend.db import db
@@ -9,12 +12,180 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
+# Indice in memoria per lo snapping sul nodo più vicino (disattivabile per debug)
+NODE_INDEX_ENABLED = os.getenv("NODE_INDEX_ENABLED", "1") == "1"
+# Lato delle celle della griglia in metri
+NODE_INDEX_CELL_SIZE_M = float(os.getenv("NODE_INDEX_CELL_SIZE_M", "100"))
+# Distanza massima di snapping: oltre questa soglia il punto è fuori dall'area coperta
+NODE_MAX_SNAP_DISTANCE_M = float(os.getenv("NODE_MAX_SNAP_DISTANCE_M", "500"))
+
+EARTH_RADIUS_M = 6_371_008.8
+
 
 class Coordinates(BaseModel):
     lat: float
     lon: float
 
 
+class NodeIndex:
+    """
+    Indice spaziale in memoria (griglia uniforme) sui nodi della collezione 'nodes'.
+
+    Le coordinate sono proiettate in metri con una equirettangolare centrata sulla
+    latitudine media dei nodi, abbastanza precisa alla scala di una città.
+    I nodi sono ordinati per cella, così ogni cella è una slice contigua degli array.
+    """
+
+    def __init__(self, node_ids, lons, lats, cell_size_m: float = NODE_INDEX_CELL_SIZE_M):
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+
+        self.cell_size_m = float(cell_size_m)
+        lat0 = float(np.mean(lats))
+        self._kx = EARTH_RADIUS_M * math.cos(math.radians(lat0)) * math.pi / 180.0
+        self._ky = EARTH_RADIUS_M * math.pi / 180.0
+
+        x, y = self._project(lons, lats)
+        cx, cy = self._cells(x, y)
+        order = np.lexsort((cy, cx))
+
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)[order]
+        self.x = x[order]
+        self.y = y[order]
+
+        cells, starts, counts = np.unique(
+            np.column_stack((cx[order], cy[order])), axis=0, return_index=True, return_counts=True
+        )
+        self._cells_slices = {
+            (int(gx), int(gy)): (int(start), int(start + count))
+            for (gx, gy), start, count in zip(cells, starts, counts)
+        }
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def _project(self, lons, lats) -> Tuple[np.ndarray, np.ndarray]:
+        return lons * self._kx, lats * self._ky
+
+    def _cells(self, x, y) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.floor(x / self.cell_size_m).astype(np.int64),
+                np.floor(y / self.cell_size_m).astype(np.int64))
+
+    def _ring(self, gx: int, gy: int, k: int) -> np.ndarray:
+        """Indici dei nodi nelle celle a distanza di Chebyshev esattamente k da (gx, gy)."""
+        if k == 0:
+            cells = [(gx, gy)]
+        else:
+            cells = [(gx + dx, gy + dy) for dx in range(-k, k + 1) for dy in (-k, k)]
+            cells += [(gx + dx, gy + dy) for dx in (-k, k) for dy in range(-k + 1, k)]
+
+        ranges = [self._cells_slices[c] for c in cells if c in self._cells_slices]
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    def _search_cell(self, gx: int, gy: int, qx: np.ndarray, qy: np.ndarray, max_distance_m: float) -> (
+            Tuple)[np.ndarray, np.ndarray]:
+        """
+        Cerca il nodo più vicino per un gruppo di punti che cadono tutti nella cella (gx, gy),
+        visitando gli anelli di celle attorno finché il nodo migliore non può più essere battuto.
+        """
+        d_best = np.full(len(qx), np.inf)
+        i_best = np.full(len(qx), -1, dtype=np.int64)
+        max_ring = int(math.ceil(max_distance_m / self.cell_size_m))
+        rows = np.arange(len(qx))
+
+        for k in range(max_ring + 1):
+            candidates = self._ring(gx, gy, k)
+            if candidates.size:
+                d = np.hypot(self.x[candidates] - qx[:, None], self.y[candidates] - qy[:, None])
+                j = np.argmin(d, axis=1)
+                d_j = d[rows, j]
+                better = d_j < d_best
+                d_best[better] = d_j[better]
+                i_best[better] = candidates[j[better]]
+
+            # i nodi non ancora visitati distano almeno k celle da qualunque punto della cella
+            reach = k * self.cell_size_m
+            if reach >= max_distance_m or np.all(d_best <= reach):
+                break
+
+        return d_best, i_best
+
+    def nearest_many(self, lons, lats, max_distance_m: float = NODE_MAX_SNAP_DISTANCE_M) -> (
+            Tuple)[np.ndarray, np.ndarray]:
+        """
+        Snapping vettorizzato di molti punti: i punti vengono raggruppati per cella
+        e ogni gruppo viene risolto con un'unica matrice di distanze per anello.
+
+        :return: (node_ids, distanze in metri) nell'ordine di input; -1 e inf per i punti
+                 senza nodi entro max_distance_m
+        """
+        qx, qy = self._project(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+        qcx, qcy = self._cells(qx, qy)
+
+        best_d = np.full(len(qx), np.inf)
+        best_i = np.full(len(qx), -1, dtype=np.int64)
+        if len(qx) == 0:
+            return best_i, best_d
+
+        groups, inverse = np.unique(np.column_stack((qcx, qcy)), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(groups) + 1))
+
+        for g, (gx, gy) in enumerate(groups):
+            members = order[bounds[g]:bounds[g + 1]]
+            best_d[members], best_i[members] = self._search_cell(
+                int(gx), int(gy), qx[members], qy[members], max_distance_m
+            )
+
+        found = (best_i >= 0) & (best_d <= max_distance_m)
+        node_ids = np.where(found, self.node_ids[np.maximum(best_i, 0)], -1)
+        distances = np.where(found, best_d, np.inf)
+        return node_ids, distances
+
+    def nearest(self, lon: float, lat: float, max_distance_m: float = NODE_MAX_SNAP_DISTANCE_M) -> (
+            Tuple)[Union[int, None], float]:
+        x, y = lon * self._kx, lat * self._ky
+        gx, gy = math.floor(x / self.cell_size_m), math.floor(y / self.cell_size_m)
+        d_best, i_best = self._search_cell(gx, gy, np.array([x]), np.array([y]), max_distance_m)
+        if i_best[0] < 0 or d_best[0] > max_distance_m:
+            return None, math.inf
+        return int(self.node_ids[i_best[0]]), float(d_best[0])
+
+
+# Istanza caricata all'avvio da load_node_index(); None finché non è disponibile
+node_index: Union[NodeIndex, None] = None
+
+
+def load_node_index() -> Union[NodeIndex, None]:
+    """
+    Carica le coordinate di tutti i nodi dalla collezione 'nodes' e costruisce l'indice in memoria.
+    In caso di errore l'indice resta non disponibile e lo snapping usa la query $near su MongoDB.
+    """
+    global node_index
+    try:
+        node_ids, lons, lats = [], [], []
+        cursor = db['nodes'].find({}, {"_id": 0, "node_id": 1, "location.coordinates": 1})
+        for node in cursor:
+            lon, lat = node["location"]["coordinates"][:2]
+            node_ids.append(node["node_id"])
+            lons.append(lon)
+            lats.append(lat)
+
+        if not node_ids:
+            logging.warning("Nessun nodo trovato: indice dei nodi non costruito")
+            return None
+
+        node_index = NodeIndex(node_ids, lons, lats)
+        logging.info(f"Indice dei nodi costruito su {len(node_index)} nodi")
+        return node_index
+    except Exception as e:
+        logging.error(f"Errore nella costruzione dell'indice dei nodi: {str(e)}")
+        return None
+
+
 # Funzione per ottenere l'ID del nodo in base alle coordinate
 def get_id_node_by_coordinates(coordinates: Coordinates) -> Tuple[int, str, Union[int, None]]:
     #print("get_id_node_by_coordinates 0.1")
@@ -22,29 +193,31 @@ def get_id_node_by_coordinates(coordinates: Coordinates) -> Tuple[int, str, Unio
     try:
         logging.info("get_id_node_by_coordinates 0")
         logging.info(coordinates)
-        nodes_collection = db['nodes']
-
-        # Query per trovare il nodo con le coordinate specificate
-        node = nodes_collection.count_documents({})
-        logging.info(node)
-
-        node = nodes_collection.find_one({
-            "location": {
-                "$near": {
-                    "$geometry": {
-                        "type": "Point",
-                        "coordinates": [coordinates.lon, coordinates.lat]
-                    },
+
+        if node_index is not None:
+            node_id, distance = node_index.nearest(coordinates.lon, coordinates.lat)
+            logging.info(f"{node_id} a {distance} m")
+        else:
+            # Indice non disponibile: query geospaziale su MongoDB, limitata alla stessa distanza massima
+            node = db['nodes'].find_one({
+                "location": {
+                    "$near": {
+                        "$geometry": {
+                            "type": "Point",
+                            "coordinates": [coordinates.lon, coordinates.lat]
+                        },
+                        "$maxDistance": NODE_MAX_SNAP_DISTANCE_M
+                    }
                 }
-            }
-        })
-        #print("nodes_collection.find_one")
-        #print(node)
-        logging.info(node)
+            }, {"_id": 0, "node_id": 1})
+            #print("nodes_collection.find_one")
+            #print(node)
+            logging.info(node)
+            node_id = node['node_id'] if node else None
 
         # Controlla se il nodo è stato trovato
-        if node:
-            return 200, "OK", node['node_id']
+        if node_id is not None:
+            return 200, "OK", node_id
         else:
             logging.info(f"Nodo non trovato!")
 
@@ -53,3 +226,31 @@ def get_id_node_by_coordinates(coordinates: Coordinates) -> Tuple[int, str, Unio
         print(e)
         # Gestione degli errori generali
         return 500, f"Errore del server: {str(e)}", None
+
+
+def get_id_nodes_by_coordinates(coordinates: List[Coordinates]) -> Tuple[int, str, Union[List[Dict], None]]:
+    """
+    Snapping di più coordinate in un'unica passata sull'indice dei nodi.
+
+    :param coordinates: Lista di coordinate da agganciare alla rete
+    :return: Tuple con codice di stato, messaggio e una lista nell'ordine di input di
+             {"node_id": ..., "distance": ...} (distanza in metri); node_id e distance sono
+             None per i punti oltre la distanza massima di snapping. 503 se l'indice dei nodi non è caricato.
+    """
+    # Senza indice servirebbe una $geoNear per punto, che terrebbe occupato il pool di MongoDB per tutti
+    if node_index is None:
+        return 503, "Indice dei nodi non disponibile", None
+
+    try:
+        node_ids, distances = node_index.nearest_many(
+            [c.lon for c in coordinates], [c.lat for c in coordinates]
+        )
+        result = [
+            {"node_id": int(node_id), "distance": float(distance)} if node_id >= 0
+            else {"node_id": None, "distance": None}
+            for node_id, distance in zip(node_ids, distances)
+        ]
+        return 200, "OK", result
+    except Exception as e:
+        logging.error(f"Errore nello snapping multiplo: {str(e)}")
+        return 500, f"Errore del server: {str(e)}", None
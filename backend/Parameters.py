@@ -1,18 +1,26 @@
 import math
-import random
+from functools import lru_cache
 
+import numpy as np
+
+import shapely
 from shapely.geometry import shape
-from shapely.ops import transform
 import pyproj
 
+from backend import PoiStore
+
 
-def compute_isochrone_parameters(pois_data, isochrone_data, vel, total_pois, max_minutes=60, categories=None):
+def compute_isochrone_parameters(pois_data, isochrone_data, vel, total_pois, max_minutes=60, categories=None,
+                                 closeness=None):
     """
     Calcola i parametri:
     - Proximity
     - Density
     - Entropy
     - Poi Accessibility
+
+    La closeness non dipende dai POI: è quella precalcolata sulla rete pedonale
+    (backend.Closeness) e viene solo riportata nel risultato, None se non disponibile.
     """
     if categories is None:
         categories = []
@@ -60,17 +68,7 @@ def compute_isochrone_parameters(pois_data, isochrone_data, vel, total_pois, max
         entropy_score = 0.0
     else:
         # Conta quante volte appare ogni categoria
-        counts = {cat: 0 for cat in categories}
-        for poi in pois_data:
-            primary = poi["categories"]["primary"]
-            if primary in counts:
-                counts[primary] += 1
-            else:
-                # se non è nella primary, guarda le alternate
-                for alt in poi["categories"].get("alternate", []):
-                    if alt in counts:
-                        counts[alt] += 1
-                        break
+        counts = count_categories(pois_data, categories)
         #print("NUMERI PER CATEGORIA")
         #for cat in categories:
             #print(cat, ":", counts[cat])
@@ -96,45 +94,178 @@ def compute_isochrone_parameters(pois_data, isochrone_data, vel, total_pois, max
     poi_accessibility = (proximity_score + density_score + entropy_score) / 3.0
     #print("POIS ACCECCIBILITY: ", poi_accessibility)
 
-    # 7) Randomizzo la closeness per simulare
-    # TODO: aggiornare in seguito con valore preso dal databse
-    closeness_random = random.random()
-
     return {
         "proximity": proximity_min,
         "proximity_score": proximity_score,
         "density_score": density_score,
         "entropy_score": entropy_score,
-        "closeness": closeness_random,
+        "closeness": closeness,
         "poi_accessibility": poi_accessibility,
     }
 
+def stack_parameters_inputs(pois_per_node, categories):
+    """
+    Prepara gli input di compute_isochrone_parameters_batch a partire dalle liste di POI
+    (come restituite da get_detailed_pois_by_node_id) di più nodi.
+
+    :return: (distances, offsets, category_codes): distanze concatenate, offsets tali che il nodo i
+             possiede distances[offsets[i]:offsets[i + 1]], e per ogni POI l'indice della categoria
+             contata (stessa regola di count_categories) tra le categorie distinte, -1 se nessuna
+    """
+    codes_by_category = {cat: code for code, cat in enumerate(dict.fromkeys(categories))}
+
+    distances, category_codes, offsets = [], [], [0]
+    for pois_data in pois_per_node:
+        for poi in pois_data:
+            distances.append(poi["distance"])
+            code = codes_by_category.get(poi["categories"]["primary"], -1)
+            if code < 0:
+                # se non è nella primary, guarda le alternate
+                for alt in poi["categories"].get("alternate") or []:
+                    if alt in codes_by_category:
+                        code = codes_by_category[alt]
+                        break
+            category_codes.append(code)
+        offsets.append(len(distances))
+
+    return (np.asarray(distances, dtype=np.float64),
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(category_codes, dtype=np.int64))
+
+
+def compute_isochrone_parameters_batch(distances, offsets, category_codes, total_pois, areas_km2, vel,
+                                       max_minutes=60, categories=None):
+    """
+    Versione vettoriale di compute_isochrone_parameters per molti nodi insieme (closeness esclusa).
+
+    :param distances: distanze in metri dei POI filtrati di tutti i nodi, concatenate
+    :param offsets: array di n_nodi + 1 elementi: il nodo i possiede distances[offsets[i]:offsets[i + 1]]
+    :param category_codes: per ogni POI l'indice della categoria contata tra le categorie distinte, -1 se nessuna
+    :param total_pois: numero totale di POI (non filtrati) per nodo
+    :param areas_km2: area dell'isocrona per nodo
+    :param vel: velocità in km/h (scalare o per nodo)
+    :param max_minutes: minuti per la normalizzazione della proximity
+    :param categories: categorie richieste, per l'entropia
+    :return: dict di array per nodo: proximity (NaN dove lo scalare restituisce "ND"), proximity_score,
+             density_score, entropy_score, poi_accessibility
+    """
+    if categories is None:
+        categories = []
+
+    distances = np.asarray(distances, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    category_codes = np.asarray(category_codes, dtype=np.int64)
+    total_pois = np.asarray(total_pois, dtype=np.float64)
+    areas_km2 = np.asarray(areas_km2, dtype=np.float64)
+    n_nodes = len(offsets) - 1
+    sizes = np.diff(offsets)
+    node_of_poi = np.repeat(np.arange(n_nodes), sizes)
+
+    # 1) Proximity: tempo (minuti) del POI più lontano
+    speed_m_min = np.asarray(vel, dtype=np.float64) * 1000 / 60.0
+    proximity = np.full(n_nodes, np.nan)
+    non_empty = sizes > 0
+    if distances.size:
+        proximity[non_empty] = np.maximum.reduceat(distances, offsets[:-1][non_empty])
+    proximity = proximity / speed_m_min
+    proximity_score = np.where(non_empty, np.minimum(proximity / max_minutes, 1.0), 0.0)
+
+    # 2) Density, normalizzata in [0..1] con > 100 POI/km^2 => 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        density_raw = np.where((total_pois == 0) | (areas_km2 == 0), 0.0, total_pois / areas_km2)
+    density_score = np.minimum(density_raw / 100.0, 1.0)
+
+    # 3) Entropia di Shannon (base 2) sui conteggi per categoria, divisi per il totale non filtrato
+    distinct = list(dict.fromkeys(categories))
+    weights = np.array([categories.count(cat) for cat in distinct], dtype=np.float64)
+    counted = category_codes >= 0
+    counts = np.bincount(
+        node_of_poi[counted] * len(distinct) + category_codes[counted],
+        minlength=n_nodes * len(distinct)
+    ).reshape(n_nodes, len(distinct)).astype(np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = counts / total_pois[:, None]
+        terms = np.where(counts > 0, p * np.log2(np.where(counts > 0, p, 1.0)), 0.0)
+    H = -(terms * weights).sum(axis=1)
+
+    k = len(categories)
+    max_H = math.log2(k) if k > 1 else 1.0
+    entropy_score = np.where(total_pois == 0, 0.0, H / max_H if max_H > 0 else 0.0)
+
+    # 4) PoiAccessibility = media (proximity_score, density_score, entropy_score)
+    poi_accessibility = (proximity_score + density_score + entropy_score) / 3.0
+
+    return {
+        "proximity": proximity,
+        "proximity_score": proximity_score,
+        "density_score": density_score,
+        "entropy_score": entropy_score,
+        "poi_accessibility": poi_accessibility,
+    }
+
+
+def count_categories(pois_data, categories):
+    """
+    Conta i POI per categoria: la categoria primaria se richiesta, altrimenti la prima alternata richiesta.
+    Con lo store dei POI in memoria il conteggio è vettoriale sugli indici dei POI.
+    """
+    store = PoiStore.poi_store
+    if store is not None and all("poi_id" in poi for poi in pois_data):
+        indices = store.lookup([poi["poi_id"] for poi in pois_data])
+        if np.all(indices >= 0):
+            return store.count_categories(indices, categories)
+
+    counts = {cat: 0 for cat in categories}
+    for poi in pois_data:
+        primary = poi["categories"]["primary"]
+        if primary in counts:
+            counts[primary] += 1
+        else:
+            # se non è nella primary, guarda le alternate
+            for alt in poi["categories"].get("alternate", []):
+                if alt in counts:
+                    counts[alt] += 1
+                    break
+    return counts
+
+# Proiezione equivalente (EASE-Grid 2.0 globale): conserva le aree, a differenza di EPSG:3857
+# che alla latitudine di Torino le gonfia di circa 2 volte
+AREA_CRS = "EPSG:6933"
+
+
+@lru_cache(maxsize=8)
+def _get_transformer(source_crs: str, target_crs: str) -> pyproj.Transformer:
+    """Transformer riutilizzato tra le chiamate: costruirlo ogni volta è costoso."""
+    return pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+
+def compute_area_km2(coordinates) -> float:
+    """
+    Area in km^2 di un poligono GeoJSON in WGS84, calcolata nella proiezione equivalente AREA_CRS.
+    La riproiezione è vettoriale su tutti i vertici (shapely.transform).
+    """
+    polygon_wgs84 = shape({"type": "Polygon", "coordinates": coordinates})  # shapely geometry in WGS84
+    transformer = _get_transformer("EPSG:4326", AREA_CRS)
+
+    polygon_m = shapely.transform(
+        polygon_wgs84,
+        lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1]))
+    )
+    return polygon_m.area / 1_000_000.0
+
+
 def compute_area_km2_from_iso(isochrone_data: dict) -> float:
     """
     Calcola l'area in km^2 data la geometria dell'isocrona (convex_hull).
-    isochrone_data è il JSON di /api/get_isochrone
+    isochrone_data è il JSON di /api/get_isochrone; se contiene l'area precalcolata
+    (vedi BackfillIsochroneAreas) viene usata quella.
     """
     try:
-        coords = isochrone_data["convex_hull"]["coordinates"]  # poligono in GeoJSON
+        if isochrone_data.get("area_km2") is not None:
+            return float(isochrone_data["area_km2"])
 
-        # Costruisci un dict GeoJSON "minimo" di tipo Polygon
-        polygon_geojson = {
-            "type": "Polygon",
-            "coordinates": coords
-        }
-
-        polygon_wgs84 = shape(polygon_geojson)  # shapely geometry in WGS84
-
-        # Proiezione in metri (EPSG:3857 o altra proiezione consona)
-        project = pyproj.Transformer.from_crs(
-            "EPSG:4326",  # WGS84
-            "EPSG:3857",  # proiezione metrica
-            always_xy=True
-        ).transform
-
-        polygon_m = transform(project, polygon_wgs84)
-        area_m2 = polygon_m.area
-        area_km2 = area_m2 / 1_000_000.0
-        return area_km2
+        coords = isochrone_data["convex_hull"]["coordinates"]  # poligono in GeoJSON
+        return compute_area_km2(coords)
     except:
-        return 0.0
\ No newline at end of file
+        return 0.0
@@ -1,13 +1,94 @@
+import bisect
+import math
 from typing import Dict, Tuple, Union, List
+
+import numpy as np
+
+from backend import PoiStore
+from backend.SingleFlight import single_flight
 from backend.db import db
 
 
+# Ampiezza dei bucket di 'poi_bucket_counts' nel formato ordinato di distances_to_pois_walk
+POI_DISTANCE_BUCKET_M = 100
+
+
+def _distance_stages(node_id: int, max_distance: float) -> List[Dict]:
+    """
+    Stadi di aggregazione che producono {poi_id, distance} per i POI del nodo entro max_distance.
+
+    Sui documenti migrati (poi_ids/poi_distances ordinati per distanza crescente) viene letto solo
+    il prefisso degli array fino al bucket che contiene max_distance: 'poi_bucket_counts[i]' è il numero
+    di POI con distanza < (i + 1) * POI_DISTANCE_BUCKET_M. I documenti non migrati usano ancora 'PoIs'.
+    """
+    bucket = max(0, math.ceil(max_distance / POI_DISTANCE_BUCKET_M) - 1)
+    buckets = {"$ifNull": ["$poi_bucket_counts", []]}
+    prefix = {
+        "$max": [1, {"$arrayElemAt": [buckets, {"$min": [bucket, {"$subtract": [{"$size": buckets}, 1]}]}]}]
+    }
+    return [
+        {"$match": {"node_id": node_id}},
+        {
+            "$project": {
+                "_id": 0,
+                "PoIs": {
+                    "$cond": [
+                        {"$isArray": "$poi_distances"},
+                        {"$zip": {"inputs": [
+                            {"$slice": ["$poi_ids", prefix]},
+                            {"$slice": ["$poi_distances", prefix]}
+                        ]}},
+                        "$PoIs"
+                    ]
+                }
+            }
+        },
+        {"$unwind": "$PoIs"},
+        {"$match": {"PoIs.1": {"$lt": max_distance}}},
+        {
+            "$project": {
+                "poi_id": {"$arrayElemAt": ["$PoIs", 0]},
+                "distance": {"$arrayElemAt": ["$PoIs", 1]}
+            }
+        }
+    ]
+
+
+def _get_detailed_pois_from_store(store: "PoiStore.PoiStore", node_id: int, max_distance: float,
+                                  categories: List[str]) -> Tuple[int, str, Union[List[Dict], None], int]:
+    """
+    Come get_detailed_pois_by_node_id, ma da MongoDB legge solo le distanze del nodo:
+    dettagli e categorie dei POI vengono dallo store in memoria.
+    """
+    documents = list(db["distances_to_pois_walk"].aggregate(_distance_stages(node_id, max_distance)))
+    if not documents:
+        return 200, "not found", [], 0
+
+    indices = store.lookup([d["poi_id"] for d in documents])
+    distances = np.array([d["distance"] for d in documents], dtype=np.float64)
+
+    # scarta i POI che non esistono nella collezione 'pois'
+    found = indices >= 0
+    indices, distances = indices[found], distances[found]
+    total_count = len(indices)
+    if total_count == 0:
+        return 200, "not found", [], 0
+
+    keep = store.primary_in(indices, categories)
+    indices, distances = indices[keep], distances[keep]
+    order = np.lexsort((store.ids[indices], distances))
+
+    return 200, "OK", store.to_dicts(indices[order], distances[order]), total_count
 
+
+
+@single_flight
 def get_detailed_pois_by_node_id(node_id: int, min: int, vel: int, categories: List[str]) -> Tuple[int, str, Union[List[Dict], None], int]:
     """
     Recupera i POI associati a un dato node_id dalla collezione distance_to_pois_walk,
     arricchisce i dati con le informazioni dettagliate dalla collezione pois,
     e li restituisce ordinati per distanza in ordine crescente.
+    Join, filtro, ordinamento e proiezione vengono eseguiti da MongoDB in un'unica aggregazione.
     Filtra i POI in base alla distanza massima raggiungibile con la velocità e il tempo forniti.
     Inoltre, filtra i POI sulla base delle categorie specificate, considerando sia primary che alternate.
 
@@ -15,73 +96,108 @@ def get_detailed_pois_by_node_id(node_id: int, min: int, vel: int, categories: L
     :param min: Tempo in minuti
     :param vel: Velocità in km/h
     :param categories: Lista di categorie da filtrare
-    :return: Lista dei POI filtrati
+    :return: Lista dei POI filtrati e numero totale dei POI raggiungibili (senza filtro sulle categorie)
     """
     try:
         #print("get_detailed_pois_by_node_id")
         distance_collection = db["distances_to_pois_walk"]
-        pois_collection = db["pois"]
         #print(1)
         # Calcola la distanza massima raggiungibile in metri
         max_distance = (vel * 1000 / 60) * min
 
-        # Trova il documento con il node_id specificato
-        pipeline = [
-            {"$match": {"node_id": node_id}},
-            {"$unwind": "$PoIs"},
-            {"$match": {"PoIs.1": {"$lt": max_distance}}},
+        if PoiStore.poi_store is not None:
+            return _get_detailed_pois_from_store(PoiStore.poi_store, node_id, max_distance, categories)
+
+        # Tutto il lavoro avviene in un'unica pipeline lato server:
+        # POI entro la distanza -> join con 'pois' sulla sola categoria primaria -> conteggio totale
+        # (serve alla density) e, per i soli POI delle categorie richieste, join sui dettagli ordinati per distanza
+        pipeline = _distance_stages(node_id, max_distance) + [
+            {
+                "$lookup": {
+                    "from": "pois",
+                    "localField": "poi_id",
+                    "foreignField": "pois_id",
+                    "pipeline": [{"$limit": 1}, {"$project": {"_id": 0, "primary": "$categories.primary"}}],
+                    "as": "category"
+                }
+            },
+            # scarta i POI che non esistono nella collezione 'pois'
+            {"$unwind": "$category"},
             {
-                "$project": {
-                    "_id": 0,
-                    "poi_id": {"$arrayElemAt": ["$PoIs", 0]},
-                    "distance": {"$arrayElemAt": ["$PoIs", 1]}
+                "$facet": {
+                    "total": [{"$count": "count"}],
+                    "pois": [
+                        {"$match": {"category.primary": {"$in": categories}}},
+                        {"$sort": {"distance": 1, "poi_id": 1}},
+                        {
+                            "$lookup": {
+                                "from": "pois",
+                                "localField": "poi_id",
+                                "foreignField": "pois_id",
+                                "pipeline": [
+                                    {"$limit": 1},
+                                    {"$project": {"_id": 0, "location": 1, "names": 1, "categories": 1}}
+                                ],
+                                "as": "poi"
+                            }
+                        },
+                        {"$unwind": "$poi"},
+                        {
+                            "$project": {
+                                "poi_id": 1,
+                                "distance": 1,
+                                "location": "$poi.location",
+                                "names": "$poi.names",
+                                "categories": "$poi.categories"
+                            }
+                        }
+                    ]
                 }
             }
         ]
 
-        documents = list(distance_collection.aggregate(pipeline))
-        #print("documents")
-        #print(documents)
-        if len(documents)==0:
-            #print(2)
-            return 200,"not found",[],0
-
-        pois_ids = [d["poi_id"] for d in documents]
-        pois_distances = {d["poi_id"]: d["distance"] for d in documents}
+        result = next(distance_collection.aggregate(pipeline), None)
+        #print("result")
+        #print(result)
+        total_count = result["total"][0]["count"] if result and result["total"] else 0
+        #print("TOT POIS in Poi: ", total_count)
 
         # Se non ci sono POI per questo nodo, ritorna una lista vuota
-        if not pois_ids:
-            #print(3)
-            return 200,"not found",[],0
-        #print(4)
-        # Recupera i dettagli dei POI dalla collezione 'pois'
-
-        pois_details = {poi["pois_id"]: poi for poi in pois_collection.find({"pois_id": {"$in": pois_ids}})}
-        total_count = len(pois_details)
-        #print("TOT POIS in Poi: ", len(pois_details))
-
-        # Creazione della lista dei POI con dettagli filtrati per distanza e categorie
-        detailed_pois_list = []
-        for poi_id in pois_ids:
-            if poi_id in pois_details:
-                poi = pois_details[poi_id]
-                primary_category = poi["categories"].get("primary", "")
-                alternate_categories = poi["categories"].get("alternate", []) or []
-
-                # Verifica se il POI appartiene a una delle categorie richieste
-                if primary_category in categories: #or any(cat in categories for cat in alternate_categories):
-                    detailed_pois_list.append({
-                        "poi_id": poi_id,
-                        "distance": pois_distances[poi_id],
-                        "location": poi["location"],
-                        "names": poi["names"],
-                        "categories": poi["categories"]
-                    })
-
-        # Ordina la lista per distanza in ordine crescente
-        detailed_pois_list.sort(key=lambda x: x["distance"])
+        if total_count == 0:
+            #print(2)
+            return 200, "not found", [], 0
+
+        detailed_pois_list = result["pois"]
 
         return 200, "OK", detailed_pois_list, total_count
 
     except Exception as e:
         return 200, e, [], 0
+
+
+@single_flight
+def get_detailed_pois_by_bands(node_id: int, bands: List[int], vel: int, categories: List[str]) -> Tuple[int, str, Union[List[Dict], None], int]:
+    """
+    Come get_detailed_pois_by_node_id per più fasce di minuti con una sola lettura delle distanze:
+    i POI vengono letti fino alla fascia più ampia e ognuno riceve il campo "band", cioè i minuti
+    della fascia più stretta che lo raggiunge.
+
+    :param node_id: Identificatore univoco del nodo
+    :param bands: Minuti delle fasce (es. [5, 10, 15, 20])
+    :param vel: Velocità in km/h
+    :param categories: Lista di categorie da filtrare
+    :return: Lista dei POI filtrati ed etichettati e numero totale dei POI raggiungibili nella fascia più ampia
+    """
+    bands = sorted(set(bands))
+    status_code, message, pois, total_count = get_detailed_pois_by_node_id(node_id, bands[-1], vel, categories)
+    if not isinstance(pois, list):
+        return status_code, message, pois, total_count
+
+    # soglie in metri: un POI appartiene alla prima fascia con distanza massima > distanza del POI
+    thresholds = [(vel * 1000 / 60) * minute for minute in bands]
+    # copie: la lista di get_detailed_pois_by_node_id può essere condivisa con altre richieste
+    pois = [
+        {**poi, "band": bands[min(bisect.bisect_right(thresholds, poi["distance"]), len(bands) - 1)]}
+        for poi in pois
+    ]
+    return status_code, message, pois, total_count
@@ -0,0 +1,154 @@
+import os
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+
+from backend.db import db
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+# Store opzionale: se attivo la collezione 'pois' viene caricata in memoria all'avvio
+POI_STORE_ENABLED = os.getenv("POI_STORE_ENABLED", "0") == "1"
+
+
+class PoiStore:
+    """
+    Copia colonnare in memoria della collezione 'pois'.
+
+    Le colonne numeriche (lon/lat, codice della categoria primaria, bitmask delle categorie
+    alternate) permettono di filtrare e contare per categoria con operazioni vettoriali
+    sugli indici dei POI candidati. Nomi e categorie originali sono tenuti solo per
+    ricostruire la risposta dell'API.
+    """
+
+    def __init__(self, pois: Iterable[Dict]):
+        self.categories: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+        ids, lons, lats, primary, alternates, alternate_codes, names = [], [], [], [], [], [], []
+        for poi in pois:
+            poi_categories = poi.get("categories") or {}
+            coordinates = poi["location"]["coordinates"]
+            ids.append(poi["pois_id"])
+            lons.append(coordinates[0])
+            lats.append(coordinates[1])
+            primary.append(self._intern(poi_categories.get("primary")))
+            alternates.append(poi_categories.get("alternate"))
+            alternate_codes.append([self._intern(c) for c in poi_categories.get("alternate") or []])
+            names.append(poi.get("names"))
+
+        # i POI sono ordinati per id, così la ricerca degli indici è una searchsorted
+        order = np.argsort(np.array(ids, dtype=str), kind="stable")
+        self.ids = np.array(ids, dtype=str)[order]
+        self.lons = np.array(lons, dtype=np.float64)[order]
+        self.lats = np.array(lats, dtype=np.float64)[order]
+        self.primary = np.array(primary, dtype=np.int32)[order]
+        self.alternates = np.empty(len(ids), dtype=object)
+        self.alternates[:] = [alternates[i] for i in order]
+        self.names = np.empty(len(ids), dtype=object)
+        self.names[:] = [names[i] for i in order]
+
+        # bitmask delle alternate: un bit per categoria, su più parole da 64 bit
+        words = max(1, (len(self.categories) + 63) // 64)
+        self.alternate_mask = np.zeros((len(ids), words), dtype=np.uint64)
+        for row, i in enumerate(order):
+            for code in alternate_codes[i]:
+                self.alternate_mask[row, code // 64] |= np.uint64(1 << (code % 64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _intern(self, category: Union[str, None]) -> int:
+        if category is None:
+            return -1
+        if category not in self._codes:
+            self._codes[category] = len(self.categories)
+            self.categories.append(category)
+        return self._codes[category]
+
+    def codes(self, categories: List[str]) -> np.ndarray:
+        """Codici delle categorie note (quelle mai viste nei POI vengono ignorate)."""
+        return np.array([self._codes[c] for c in categories if c in self._codes], dtype=np.int32)
+
+    def category_mask(self, categories: List[str]) -> np.ndarray:
+        mask = np.zeros(self.alternate_mask.shape[1], dtype=np.uint64)
+        for code in self.codes(categories):
+            mask[code // 64] |= np.uint64(1 << (int(code) % 64))
+        return mask
+
+    def lookup(self, poi_ids) -> np.ndarray:
+        """Indici dei POI con gli id dati; -1 per gli id non presenti nello store."""
+        poi_ids = np.asarray(poi_ids, dtype=str)
+        if len(self.ids) == 0 or len(poi_ids) == 0:
+            return np.full(len(poi_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, poi_ids), len(self.ids) - 1)
+        return np.where(self.ids[positions] == poi_ids, positions, -1)
+
+    def primary_in(self, indices: np.ndarray, categories: List[str]) -> np.ndarray:
+        """Maschera dei POI (per indice) la cui categoria primaria è tra quelle richieste."""
+        return np.isin(self.primary[indices], self.codes(categories))
+
+    def alternate_in(self, indices: np.ndarray, categories: List[str]) -> np.ndarray:
+        """Maschera dei POI (per indice) con almeno una categoria alternata tra quelle richieste."""
+        return np.any(self.alternate_mask[indices] & self.category_mask(categories), axis=1)
+
+    def count_categories(self, indices: np.ndarray, categories: List[str]) -> Dict[str, int]:
+        """
+        Conta i POI per categoria come compute_isochrone_parameters: la categoria primaria se
+        richiesta, altrimenti la prima alternata richiesta nell'ordine in cui è salvata.
+        """
+        counts = {category: 0 for category in categories}
+        codes = self.codes(categories)
+        if len(indices) == 0 or len(codes) == 0:
+            return counts
+
+        primary = self.primary[indices]
+        by_primary = np.isin(primary, codes)
+        primary_counts = np.bincount(primary[by_primary], minlength=len(self.categories))
+        for code in codes:
+            counts[self.categories[code]] += int(primary_counts[code])
+
+        # solo le poche righe senza primaria richiesta ma con un'alternata richiesta vanno in Python
+        fallback = indices[~by_primary & self.alternate_in(indices, categories)]
+        for alternate in self.alternates[fallback]:
+            for category in alternate:
+                if category in counts:
+                    counts[category] += 1
+                    break
+        return counts
+
+    def to_dicts(self, indices: np.ndarray, distances: np.ndarray) -> List[Dict]:
+        """POI nel formato restituito da get_detailed_pois_by_node_id."""
+        return [
+            {
+                "poi_id": str(self.ids[i]),
+                "distance": float(distance),
+                "location": {"type": "Point", "coordinates": [float(self.lons[i]), float(self.lats[i])]},
+                "names": self.names[i],
+                "categories": {
+                    "primary": self.categories[self.primary[i]] if self.primary[i] >= 0 else None,
+                    "alternate": self.alternates[i]
+                }
+            }
+            for i, distance in zip(indices, distances)
+        ]
+
+
+# Istanza caricata all'avvio da load_poi_store(); None se lo store non è attivo
+poi_store: Union[PoiStore, None] = None
+
+
+def load_poi_store() -> Union[PoiStore, None]:
+    """Carica la collezione 'pois' nello store colonnare in memoria."""
+    global poi_store
+    try:
+        cursor = db["pois"].find({}, {"_id": 0, "pois_id": 1, "location": 1, "names": 1, "categories": 1})
+        poi_store = PoiStore(cursor)
+        logging.info(f"Store dei POI caricato: {len(poi_store)} POI, {len(poi_store.categories)} categorie")
+        return poi_store
+    except Exception as e:
+        logging.error(f"Errore nel caricamento dello store dei POI: {str(e)}")
+        return None
@@ -1,7 +1,18 @@
 # questo file contiene quali dati servono per le richieste API (per validazione, prima di mandare al backend)
 
-from typing import List, Optional
-from pydantic import BaseModel
+import os
+from typing import List, Optional, Union
+from pydantic import BaseModel, Field, conint, field_validator
+
+from backend.LevelOfDetail import MAX_PRECISION, MAX_ZOOM
+
+# Limiti delle richieste di analisi dei quartieri: ogni nodo campione è un task sul pool condiviso
+ANALYSIS_MAX_NODES = int(os.getenv("ANALYSIS_MAX_NODES", "100"))
+ANALYSIS_MAX_NEIGHBOURHOODS = int(os.getenv("ANALYSIS_MAX_NEIGHBOURHOODS", "10"))
+# Fasce (minuti) al massimo in una richiesta di isocrone o POI per fasce
+MAX_BANDS = int(os.getenv("MAX_BANDS", "8"))
+# Punti al massimo in una richiesta multipla (snapping e assegnazione ai quartieri)
+BATCH_MAX_COORDINATES = int(os.getenv("BATCH_MAX_COORDINATES", "10000"))
 
 
 class Node(BaseModel):
@@ -15,14 +26,32 @@ class Coordinates(BaseModel):
     lon: float
 
 
+class BatchCoordinatesRequest(BaseModel):
+    coords: List[Coordinates] = Field(..., min_length=1, max_length=BATCH_MAX_COORDINATES)
+
+
 class ReverseGeocodingRequest(BaseModel):
     text: str
 
 
+def _unique_bands(bands: Optional[List[int]]) -> Optional[List[int]]:
+    if bands is not None and len(set(bands)) != len(bands):
+        raise ValueError("bands must not contain duplicate minutes")
+    return bands
+
+
 class IsochroneRequest(BaseModel):
     coords: Coordinates
     min: int
     vel: int
+    # più isocrone (minuti) in una sola richiesta, al posto di min
+    bands: Optional[List[conint(gt=0)]] = Field(None, min_length=1, max_length=MAX_BANDS)
+    # livello di dettaglio del poligono (vedi LevelOfDetail): zoom della mappa o tolleranza in gradi
+    zoom: Optional[int] = Field(None, ge=0, le=MAX_ZOOM)
+    tolerance: Optional[float] = Field(None, ge=0)  # arrotondata a quella dello zoom più vicino
+    precision: Optional[int] = Field(None, ge=0, le=MAX_PRECISION)  # cifre decimali delle coordinate
+
+    _check_bands = field_validator("bands")(_unique_bands)
 
 
 class PoisRequest(BaseModel):
@@ -30,6 +59,18 @@ class PoisRequest(BaseModel):
     min: int
     vel: int
     categories: List[str]
+    # POI etichettati con la fascia (minuti) in cui cadono, al posto di min
+    bands: Optional[List[conint(gt=0)]] = Field(None, min_length=1, max_length=MAX_BANDS)
+
+    _check_bands = field_validator("bands")(_unique_bands)
+
+
+class NeighbourhoodAnalysisRequest(BaseModel):
+    neighbourhood_ids: List[Union[int, str]] = Field(..., min_length=1, max_length=ANALYSIS_MAX_NEIGHBOURHOODS)
+    min: int
+    vel: int
+    categories: List[str]
+    max_nodes: int = Field(25, ge=1, le=ANALYSIS_MAX_NODES)
 
 
 class NodeRequest(BaseModel):
@@ -1,11 +1,40 @@
-from functools import lru_cache
 import json
+import os
 from typing import Union, List, Tuple, Annotated
 
 import requests
 from annotated_types import Len
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from backend import Geocoder
+from backend.GeocodeCache import FRESH, GEOCODE_CACHE_ENABLED, STALE, geocode_cache, nominatim_breaker
+
+# Nominatim resta come ripiego per le ricerche che il geocoder locale non conosce: viene chiamato solo
+# se l'indice locale trova meno di NOMINATIM_MIN_LOCAL_RESULTS luoghi o se la ricerca sembra un indirizzo
+NOMINATIM_FALLBACK = os.getenv("NOMINATIM_FALLBACK", "1") == "1"
+NOMINATIM_MIN_LOCAL_RESULTS = int(os.getenv("NOMINATIM_MIN_LOCAL_RESULTS", "3"))
+NOMINATIM_CONNECT_TIMEOUT_S = float(os.getenv("NOMINATIM_CONNECT_TIMEOUT_S", "2"))
+NOMINATIM_TIMEOUT_S = float(os.getenv("NOMINATIM_TIMEOUT_S", "5"))
+NOMINATIM_RETRIES = int(os.getenv("NOMINATIM_RETRIES", "2"))
+NOMINATIM_POOL_SIZE = int(os.getenv("NOMINATIM_POOL_SIZE", "10"))
+
+# Sessione condivisa: riusa le connessioni TCP/TLS verso Nominatim e ritenta gli errori temporanei
+session = requests.Session()
+session.headers.update({'User-Agent': 'United and close'})
+session.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=NOMINATIM_POOL_SIZE,
+    max_retries=Retry(total=NOMINATIM_RETRIES, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"],
+                      raise_on_status=False)
+))
+
+
+# Parole con cui iniziano gli indirizzi: l'indice locale non contiene vie né numeri civici
+STREET_WORDS = {"via", "corso", "piazza", "piazzale", "piazzetta", "largo", "viale", "vicolo", "strada",
+                "lungo", "lungodora", "lungopo", "galleria", "borgata", "str", "c", "p"}  # c.so, p.za
 
 # https://nominatim.org/release-docs/latest/admin/Installation/
 
@@ -23,28 +52,120 @@ class ReverseGeocodingResult(BaseModel):
     # "coordinates":["-19.9160819","-175.202642"]}])
 
 
-@lru_cache(maxsize=1000)
-def reverse_geocoding(query: str) -> Tuple[int, str, Union[List[Place] | None]]:
+def _nominatim_request(query: str) -> requests.Response:
+    return session.get("https://nominatim.openstreetmap.org/search",
+                       params={"format": "jsonv2", "q": query},
+                       timeout=(NOMINATIM_CONNECT_TIMEOUT_S, NOMINATIM_TIMEOUT_S))
+
+
+def _places(documents: List[dict]) -> List[Place]:
+    return [Place(**document) for document in documents]
+
+
+def nominatim_search(query: str) -> Tuple[int, str, Union[List[Place] | None]]:
+    """
+    Cerca su Nominatim passando dalla cache persistente (backend/GeocodeCache.py).
+    Se Nominatim è lento o non raggiungibile si usano le voci scadute ancora in cache.
+    """
+    state, cached = geocode_cache.get(query) if GEOCODE_CACHE_ENABLED else (None, None)
+    if state == FRESH:
+        return 200, "OK", _places(cached)
+
+    if not nominatim_breaker.allow():
+        if state == STALE:
+            return 200, "OK", _places(cached)
+        return 503, "Nominatim temporarily unavailable", None
+
     try:
-        headers = {'User-Agent': 'United and close'}
-        response = requests.get(f"https://nominatim.openstreetmap.org/search?format=jsonv2&q={query}", headers=headers)
+        response = _nominatim_request(query)
     except Exception as e:
+        nominatim_breaker.record_failure()
+        if state == STALE:
+            return 200, "OK", _places(cached)
         return 500, f"Error: {str(e)}", None
 
-    if response.status_code == 200:
-        response_data = json.loads(response.text)
-        places = [
-            Place(
-                name=row["display_name"],
-                importance=row.get("importance", 0),
-                coordinates=[float(row["lat"]), float(row["lon"])]
-            )
-            for row in response_data
-        ]
-        return 200, "OK", places
-    else:
+    # errori del servizio (anche dopo i tentativi di Retry): mai salvati in cache
+    if response.status_code == 429 or response.status_code >= 500:
+        nominatim_breaker.record_failure()
+        if state == STALE:
+            return 200, "OK", _places(cached)
+        return response.status_code, response.reason, None
+
+    # qualunque altra risposta (anche 403 o 404) vuol dire che Nominatim è raggiungibile:
+    # chiude il circuito, compresa la chiamata di prova
+    nominatim_breaker.record_success()
+    if response.status_code != 200:
         return response.status_code, response.reason, None
 
+    response_data = json.loads(response.text)
+    places = [
+        Place(
+            name=row["display_name"],
+            importance=row.get("importance", 0),
+            coordinates=[float(row["lat"]), float(row["lon"])]
+        )
+        for row in response_data
+    ]
+    if GEOCODE_CACHE_ENABLED:
+        geocode_cache.set(query, [place.model_dump() for place in places])
+    return 200, "OK", places
+
+
+def looks_like_address(query: str) -> bool:
+    """Vero se la ricerca contiene un numero (civico, CAP) o inizia con una parola da indirizzo ("via", "corso", ...)."""
+    tokens = Geocoder.tokenize(query)
+    return bool(tokens) and (tokens[0] in STREET_WORDS or any(token.isdigit() for token in tokens))
+
+
+def reverse_geocoding(query: str) -> Tuple[int, str, Union[List[Place] | None]]:
+    """
+    Cerca un luogo per nome. Di norma risponde solo il geocoder locale, senza rete; con il ripiego
+    attivo Nominatim viene interrogato solo se la ricerca sembra un indirizzo (vie e civici non sono
+    nell'indice locale) o se i luoghi trovati localmente sono meno di NOMINATIM_MIN_LOCAL_RESULTS.
+    In quel caso i risultati vengono uniti: prima i luoghi con esattamente il nome cercato, poi
+    Nominatim, poi le corrispondenze parziali locali. Un quartiere o la città cercati per nome
+    esatto rispondono sempre in locale.
+    """
+    index = Geocoder.geocoder_index
+    if index is None:
+        return nominatim_search(query)
+
+    def to_places(matches):
+        return [Place(name=name, importance=importance, coordinates=coordinates)
+                for name, importance, coordinates in matches]
+
+    exact = index.exact_matches(query)
+    local = to_places(index.search(query))
+    if (not NOMINATIM_FALLBACK
+            or any(importance >= Geocoder.NEIGHBOURHOOD_IMPORTANCE for _, importance, _ in exact)
+            or (len(local) >= NOMINATIM_MIN_LOCAL_RESULTS and not looks_like_address(query))):
+        return 200, "OK", local
+
+    status_code, message, places = nominatim_search(query)
+    if status_code != 200:
+        # Nominatim non disponibile: meglio le corrispondenze locali che un errore
+        return (200, "OK", local) if local else (status_code, message, places)
+
+    merged, names = [], set()
+    for place in to_places(exact) + places + local:
+        if place.name not in names:
+            names.add(place.name)
+            merged.append(place)
+    return 200, "OK", merged
+
+
+def autocomplete(query: str, limit: int = Geocoder.AUTOCOMPLETE_MAX_RESULTS) -> Tuple[int, str, Union[List[Place] | None]]:
+    """
+    Suggerimenti durante la digitazione dall'indice per prefisso del geocoder locale; mai su Nominatim.
+    """
+    if Geocoder.autocomplete_index is None:
+        return 503, "Autocomplete index not loaded", None
+    if not 1 <= limit <= Geocoder.autocomplete_index.limit:
+        return 400, f"limit must be between 1 and {Geocoder.autocomplete_index.limit}", None
+    matches = Geocoder.autocomplete_index.complete(query, limit)
+    return 200, "OK", [Place(name=name, importance=importance, coordinates=coordinates)
+                       for name, importance, coordinates in matches]
+
 
 if __name__ == "__main__":
     print(reverse_geocoding("torino"))
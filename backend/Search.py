@@ -0,0 +1,94 @@
+from typing import Dict, Tuple, Union, List
+
+from backend.Cache import cached_call
+from backend.Closeness import get_closeness_by_node_id
+from backend.Isochrones import get_isocronewalk_by_node_id
+from backend.NodeMetrics import get_node_metrics, is_preset
+from backend.Parameters import compute_isochrone_parameters
+from backend.Poi import get_detailed_pois_by_node_id
+import logging
+logging.basicConfig(
+    #level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+
+def get_search_by_node_id(node_id: int, min: int, vel: int, categories: List[str]) -> Tuple[int, str, Union[Dict, None]]:
+    """
+    Esegue una ricerca completa per un nodo già agganciato alla rete:
+    isocrona, POI raggiungibili e parametri calcolati sugli stessi dati,
+    leggendo isocrona e POI una sola volta.
+
+    :param node_id: ID del nodo
+    :param min: Tempo in minuti
+    :param vel: Velocità in km/h
+    :param categories: Lista di categorie da filtrare
+    :return: Tuple con codice di stato, messaggio e {"node_id", "isochrone", "pois", "parameters"}
+    """
+    status_code, message, isochrone = cached_call("isochrone", get_isocronewalk_by_node_id, node_id, min, vel)
+    if status_code != 200:
+        return status_code, message, None
+
+    status_code, message, pois, total_count = cached_call(
+        "pois", get_detailed_pois_by_node_id, node_id, min, vel, categories
+    )
+    if status_code != 200 or not isinstance(pois, list):
+        return 404, "PoIs not found", None
+    logging.info(f"Numero totale di POI filtrati: {total_count}")
+
+    parameters = _get_preset_parameters(node_id, min, vel, categories)
+    if parameters is None:
+        parameters = _compute_parameters(node_id, min, vel, categories, isochrone, pois, total_count)
+
+    return 200, "OK", {
+        "node_id": node_id,
+        "isochrone": isochrone,
+        "pois": pois,
+        "parameters": parameters
+    }
+
+
+def _get_preset_parameters(node_id: int, min: int, vel: int, categories: List[str]) -> Union[Dict, None]:
+    # richieste standard: metriche materializzate, se presenti
+    if not is_preset(min, vel, categories):
+        return None
+    status_code, message, parameters = get_node_metrics(node_id, min, vel)
+    return parameters
+
+
+def _compute_parameters(node_id: int, min: int, vel: int, categories: List[str], isochrone: Dict,
+                        pois: List[Dict], total_count: int) -> Dict:
+    return compute_isochrone_parameters(
+        pois_data=pois,
+        isochrone_data=isochrone,
+        vel=vel,
+        total_pois=total_count,
+        max_minutes=60,
+        categories=categories,
+        closeness=get_closeness_by_node_id(node_id, min, vel)[2]
+    )
+
+
+def get_parameters_by_node_id(node_id: int, min: int, vel: int, categories: List[str]) -> Tuple[int, str, Union[Dict, None]]:
+    """
+    Parametri dell'isocrona di un nodo: metriche materializzate per i preset standard,
+    altrimenti calcolate su isocrona e POI (letti passando dalla cache).
+
+    :return: Tuple con codice di stato, messaggio e i parametri di compute_isochrone_parameters
+    """
+    parameters = _get_preset_parameters(node_id, min, vel, categories)
+    if parameters is not None:
+        return 200, "OK", parameters
+
+    status_code, message, isochrone = cached_call("isochrone", get_isocronewalk_by_node_id, node_id, min, vel)
+    # isochrone ha la shape: { "node_id":..., "convex_hull": { "coordinates": [...], ... } }
+    if not isochrone or "convex_hull" not in isochrone:
+        return 404, "Isochrone not found", None
+
+    status_code, message, pois, total_count = cached_call(
+        "pois", get_detailed_pois_by_node_id, node_id, min, vel, categories
+    )
+    if not isinstance(pois, list):
+        return 404, "PoIs not found", None
+
+    return 200, "OK", _compute_parameters(node_id, min, vel, categories, isochrone, pois, total_count)
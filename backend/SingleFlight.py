@@ -0,0 +1,86 @@
+# Coalescenza delle richieste identiche e concorrenti ("single flight").
+#
+# Quando molte richieste uguali arrivano insieme (un confronto tra quartieri, un punto condiviso)
+# solo la prima esegue la query: le altre, con la stessa chiave, aspettano il suo risultato invece
+# di ripetere la stessa lettura su MongoDB. Finito il calcolo la chiave viene rimossa, quindi non
+# è una cache: le richieste successive ricalcolano (o passano da backend.Cache).
+
+import os
+import threading
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable
+
+from pydantic import BaseModel
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """Gruppo di chiamate in corso, una per chiave; sicuro tra thread."""
+
+    def __init__(self):
+        self.shared = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """Esegue func una sola volta per tutte le chiamate concorrenti con la stessa chiave."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+single_flight_group = SingleFlight()
+
+
+def _freeze(value: Any) -> Hashable:
+    """Versione hashable degli argomenti (liste, dict e modelli pydantic compresi)."""
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def single_flight(func: Callable) -> Callable:
+    """
+    Decoratore: le chiamate concorrenti di func con gli stessi argomenti condividono un'unica esecuzione.
+    Il risultato è lo stesso oggetto per tutti i chiamanti e non va modificato.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not SINGLE_FLIGHT_ENABLED:
+            return func(*args, **kwargs)
+        key = (func.__module__, func.__qualname__, _freeze(args), _freeze(kwargs))
+        return single_flight_group.do(key, func, *args, **kwargs)
+    return wrapper
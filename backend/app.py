@@ -1,8 +1,10 @@
+import json
 import logging
 import os
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
 from backend.RequestModels import *
 from backend.Parameters import *
@@ -11,9 +13,20 @@ from backend.ReverseGeocoding import *
 from backend.Isochrones import *
 from backend.Nodes import *
 from backend.Neighbourhoods import *
-from backend.db import db
-from backend.auth import create_access_token, get_current_user
-from backend.users import create_user, authenticate_user, update_user_preferences, get_user_preferences
+from backend.Search import *
+from backend.NeighbourhoodAnalysis import analyze_neighbourhoods
+from backend.PoiStore import POI_STORE_ENABLED, load_poi_store
+from backend.IsochroneEngine import ISOCHRONE_ENGINE_ENABLED, load_isochrone_engine
+from backend.Cache import cache_key, cached_call, result_cache
+from backend.GeocodeCache import geocode_cache, nominatim_breaker
+from backend.Indexes import INDEXES_ON_STARTUP, INDEXES_STRICT, bootstrap_indexes
+from backend.Geocoder import AUTOCOMPLETE_MAX_RESULTS, GEOCODER_ENABLED, load_geocoder
+from backend.LevelOfDetail import MAX_PRECISION, MAX_ZOOM, cached_simplify_isochrone, resolve_level_of_detail
+from backend.SingleFlight import single_flight_group
+from backend.db import db, run_db
+from backend.auth import (create_access_token, get_current_user, get_password_hash, invalidate_principal, run_hash,
+                          verify_password)
+from backend.users import create_user, get_user_by_email, update_user_preferences, get_user_preferences
 
 logging.basicConfig(
     #level=logging.INFO,
@@ -22,6 +35,9 @@ logging.basicConfig(
 
 app = FastAPI()
 
+# Durata in secondi per cui browser e proxy possono riusare i quartieri senza rivalidarli
+NEIGHBOURHOODS_MAX_AGE_S = int(os.getenv("NEIGHBOURHOODS_MAX_AGE_S", "3600"))
+
 # Calcolo corretto dei percorsi basato sulla tua struttura
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
@@ -33,6 +49,22 @@ app.mount("/public", StaticFiles(directory=PUBLIC_DIR), name="public")
 app.mount("/views", StaticFiles(directory=VIEWS_DIR), name="views")
 
 
+@app.on_event("startup")
+def load_in_memory_indexes():
+    """Costruisce all'avvio le strutture in memoria usate dagli endpoint."""
+    # prima gli indici di MongoDB, usati anche dai caricamenti qui sotto
+    if INDEXES_ON_STARTUP:
+        bootstrap_indexes(strict=INDEXES_STRICT)
+    if NODE_INDEX_ENABLED:
+        load_node_index()
+    if POI_STORE_ENABLED:
+        load_poi_store()
+    if ISOCHRONE_ENGINE_ENABLED:
+        load_isochrone_engine()
+    if GEOCODER_ENABLED:
+        load_geocoder()
+
+
 # Modello per i dati del nodo
 
 
@@ -92,10 +124,14 @@ async def serve_personalArea():
 @app.post("/api/reverse_geocoding")
 def app_reverse_geocoding(request: ReverseGeocodingRequest) -> List[Place]:
     """
-    Ricerca indirizzi tramite Nominatim e restituisce la posizione geocodificata.
+    Ricerca luoghi per nome e restituisce la posizione geocodificata.
 
     Questo endpoint consente di cercare indirizzi utilizzando un input di testo (ad esempio, una città).
-    L'implementazione utilizza il servizio di geocoding Nominatim basato su OpenStreetMap.
+    La ricerca usa il geocoder locale (`backend/Geocoder.py`), costruito all'avvio da POI, quartieri e
+    città senza chiamate di rete. Con `NOMINATIM_FALLBACK=1` il servizio Nominatim basato su OpenStreetMap
+    viene interrogato solo se il testo sembra un indirizzo (un numero civico, "via ...", "corso ...") o se
+    il geocoder locale trova meno di `NOMINATIM_MIN_LOCAL_RESULTS` luoghi: allora vengono restituiti i
+    luoghi con esattamente quel nome, poi i risultati di Nominatim e infine le corrispondenze parziali locali.
 
     Parametri:
     ----------
@@ -154,8 +190,67 @@ def app_reverse_geocoding(request: ReverseGeocodingRequest) -> List[Place]:
                                 "type": status_code}])
 
 
+@app.get("/api/autocomplete")
+def app_autocomplete(q: str, limit: int = AUTOCOMPLETE_MAX_RESULTS) -> List[Place]:
+    """
+    Suggerimenti di luoghi mentre l'utente digita.
+
+    Cerca i nomi di POI, quartieri e città con una parola che inizia con il testo digitato, usando
+    l'indice per prefisso caricato all'avvio (`Geocoder.AutocompleteIndex`): la risposta non richiede
+    query a MongoDB né chiamate di rete, quindi i suggerimenti possono essere aggiornati a ogni tasto.
+    A differenza di `/api/reverse_geocoding` non viene mai interrogato Nominatim.
+
+    Parametri:
+    ----------
+    - **q** (str): Testo digitato, anche incompleto (es. `croc`).
+    - **limit** (int, opzionale): Numero massimo di suggerimenti (default `AUTOCOMPLETE_MAX_RESULTS`, 8),
+      tra 1 e `AUTOCOMPLETE_MAX_LIMIT` (20), il numero di risultati precalcolati per prefisso.
+
+    Risposta:
+    ---------
+    Una lista di oggetti `Place`, per importanza decrescente (città, quartieri, POI), senza nomi ripetuti:
+    - `name` (str): Nome del luogo.
+    - `importance` (float): Indicatore di rilevanza.
+    - `coordinates` (List[float]): Latitudine e longitudine.
+
+    Risposta di esempio:
+    ---------------------
+    ```json
+    [
+        {
+            "name": "Crocetta, Torino",
+            "importance": 0.6,
+            "coordinates": [45.0573, 7.6686]
+        },
+        {
+            "name": "Bar Crocetta, Torino",
+            "importance": 0.3,
+            "coordinates": [45.0589, 7.6702]
+        }
+    ]
+    ```
+
+    Errori:
+    -------
+    - **400**: `limit` fuori dall'intervallo consentito.
+    - **422**: Parametri non validi.
+    - **503**: Indice dei suggerimenti non caricato (`GEOCODER_ENABLED=0` o errore all'avvio).
+
+    """
+    status_code, message, result = autocomplete(q, limit)
+
+    if status_code == 200:
+        return result
+    else:
+        raise HTTPException(status_code=status_code,
+                            detail=[{
+                                "loc": [],
+                                "msg": message,
+                                "type": status_code}])
+
+
 @app.post("/api/get_isochrone")
-def search_proximity(request: IsochroneRequest):
+async def search_proximity(request: IsochroneRequest):
     """
         Calcola e restituisce i dati dell'isocrona di tipo "walk" per un punto specifico.
 
@@ -169,6 +264,9 @@ def search_proximity(request: IsochroneRequest):
           - `coords` (Coordinates): latitudine e longitudine del punto di partenza.
           - `min` (int): minuti per i quali calcolare l'isocrona.
           - `vel` (int): velocità (in km/h).
+          - `bands` (List[int], opzionale): minuti di più isocrone da restituire insieme, positivi e senza
+            ripetizioni, da 1 a `MAX_BANDS` (8) valori.
+          - `zoom` (int, opzionale), `tolerance` (float, opzionale), `precision` (int, opzionale): livello di dettaglio.
 
         ### Esempio di chiamata
         ```bash
@@ -206,27 +304,50 @@ def search_proximity(request: IsochroneRequest):
         }
         ```
 
+        Con `bands` (es. `[5, 10, 15, 20]`) al posto del solo `min` restituisce tutte le fasce
+        lette con un'unica query: `{"node_id": ..., "bands": [{"min": 5, "convex_hull": {...}}, ...]}`.
+
+        Con `zoom` (livello della mappa) o `tolerance` (gradi) il poligono viene semplificato
+        preservandone la topologia; `precision` fissa le cifre decimali delle coordinate
+        (di default quelle adatte alla tolleranza). Il risultato semplificato è in cache per livello.
+
+        Se la combinazione minuti/velocità non è precalcolata e `ISOCHRONE_ENGINE_ENABLED=1`,
+        l'isocrona viene calcolata al volo sulla rete pedonale (con in più `area_km2`).
+
         ### Errori:
         - **404**: Nodo non trovato o isocrona non disponibile.
+        - **422**: `bands` vuota, con minuti non positivi o ripetuti, o con più di `MAX_BANDS` fasce.
         - **500**: Errore interno del server.
     """
     logging.info(f"Valori coordinate per isocrona walk: lat={request.coords.lat}, lon={request.coords.lon}")
 
     try:
-        status_code1, message, node_id = get_id_node_by_coordinates(request.coords)
+        status_code1, message, node_id = await run_db(get_id_node_by_coordinates, request.coords)
 
         if status_code1 == 200:
             #print("Nodo trovato",node_id)
-            status_code, message, result = get_isocronewalk_by_node_id(
-                node_id=node_id,
-                minute=request.min,
-                velocity=request.vel
-            )
+            if request.bands is not None:
+                # più fasce lette dallo stesso documento del nodo
+                status_code, message, result = await run_db(
+                    cached_call, "isochrone_bands", get_isochrone_bands_by_node_id,
+                    node_id, request.bands, request.vel
+                )
+            else:
+                status_code, message, result = await run_db(
+                    cached_call, "isochrone", get_isocronewalk_by_node_id,
+                    node_id, request.min, request.vel
+                )
             #print(status_code, message, result )
             #print(1)
             if status_code == 200:
                 #print(2)
                 #print(result)
+                level = resolve_level_of_detail(request.zoom, request.tolerance, request.precision)
+                if level is not None:
+                    # stessa chiave del risultato completo in cache, più il livello di dettaglio
+                    key = (cache_key("isochrone_bands", node_id, request.bands, request.vel) if request.bands
+                           else cache_key("isochrone", node_id, request.min, request.vel))
+                    result = cached_simplify_isochrone(key, result, *level)
                 return result
             else:
                 #print(3)
@@ -248,7 +369,7 @@ def search_proximity(request: IsochroneRequest):
 
 
 @app.post("/api/get_pois_isochrone")
-def get_pois_data_in_isochrone(request: PoisRequest):
+async def get_pois_data_in_isochrone(request: PoisRequest):
     """
             Restituisce la lista dei POI (Points Of Interest) raggiungibili entro una certa isocrona a piedi.
 
@@ -263,6 +384,8 @@ def get_pois_data_in_isochrone(request: PoisRequest):
               - `min` (int): Numero di minuti per l'isocrona.
               - `vel` (int): Velocità di percorrenza (km/h).
               - `categories` (List[str]): Lista di categorie da filtrare.
+              - `bands` (List[int], opzionale): Minuti delle fasce con cui etichettare i POI, positivi e senza
+                ripetizioni, da 1 a `MAX_BANDS` (8) valori.
 
             ### Esempio di chiamata
             ```bash
@@ -315,23 +438,35 @@ def get_pois_data_in_isochrone(request: PoisRequest):
             ]
             ```
 
+            Con `bands` (es. `[5, 10, 15, 20]`) i POI vengono letti fino alla fascia più ampia
+            e ognuno ha il campo `band` con i minuti della fascia più stretta che lo raggiunge.
+
             ### Errori:
             - **404**: Nodo non trovato o nessun POI disponibile.
+            - **422**: `bands` vuota, con minuti non positivi o ripetuti, o con più di `MAX_BANDS` fasce.
             - **500**: Errore interno del server.
     """
     logging.info(f"Valori coordinate per pois in isocrone: lat={request.coords.lat}, lon={request.coords.lon}")
     #print("get_pois_isochrone ")
     try:
-        status_code1, message, node_id = get_id_node_by_coordinates(request.coords)
+        status_code1, message, node_id = await run_db(get_id_node_by_coordinates, request.coords)
         #print("get_id_node_by_coordinates ",status_code1,node_id)
 
         if status_code1 == 200:
             logging.info("Nodo trovato, ottenimento POI...")
             #print("Nodo trovato, ottenimento POI...")
 
-            status_code2, message2, pois_list, total_count = get_detailed_pois_by_node_id(
-                node_id, request.min, request.vel, request.categories
-            )
+            if request.bands is not None:
+                # una sola lettura delle distanze fino alla fascia più ampia, POI etichettati con "band"
+                status_code2, message2, pois_list, total_count = await run_db(
+                    cached_call, "pois_bands", get_detailed_pois_by_bands,
+                    node_id, request.bands, request.vel, request.categories
+                )
+            else:
+                status_code2, message2, pois_list, total_count = await run_db(
+                    cached_call, "pois", get_detailed_pois_by_node_id,
+                    node_id, request.min, request.vel, request.categories
+                )
             #print("get_detailed_pois_by_node_id ", status_code2, node_id)
 
             if status_code2 == 200:
@@ -360,7 +495,7 @@ def get_pois_data_in_isochrone(request: PoisRequest):
 
 
 @app.post("/api/get_isochrone_parameters")
-def get_isochrone_parameters(req: PoisRequest):
+async def get_isochrone_parameters(req: PoisRequest):
     """
         Calcola Proximity, Density, Entropy, Poi Accessibility
 
@@ -369,6 +504,9 @@ def get_isochrone_parameters(req: PoisRequest):
         2. Recupera i POI entro l'isocrona.
         3. Calcola parametri di area, prossimità, densità e varietà di POI (entropy).
 
+        Se **min**, **vel** e **categories** corrispondono a un preset standard dell'interfaccia
+        (vedi `NodeMetrics`), i parametri vengono letti dalla collezione `node_metrics` senza ricalcolarli.
+
         ### Parametri:
         - **req**: `PoisRequest`
           - `coords` (Coordinates): latitudine e longitudine
@@ -401,43 +539,24 @@ def get_isochrone_parameters(req: PoisRequest):
         }
         ```
 
+        La `closeness` è la closeness armonica precalcolata sulla rete pedonale (`python -m backend.Closeness`),
+        divisa per il massimo della rete per la stessa combinazione (0..1); vale `null` se per il nodo e la combinazione richiesta non è disponibile.
+
         ### Errori:
         - **404**: Isocrona o POI non trovati.
         - **500**: Errore interno del server.
     """
     try:
-        status_code1, message, node_id = get_id_node_by_coordinates(req.coords)
-        status_code, message, iso_resp = get_isocronewalk_by_node_id(
-            node_id=node_id,
-            minute=req.min,
-            velocity=req.vel
-        )
-        # iso_resp ha la shape: { "node_id":..., "convex_hull": { "coordinates": [...], ... } }
-        if not iso_resp or "convex_hull" not in iso_resp:
-            raise HTTPException(status_code=404, detail="Isochrone not found")
-
-        # 2) /api/get_pois_isochrone
-        #print("2) /api/get_pois_isochrone")
-        status_code2, message2, pois_resp, total_count = get_detailed_pois_by_node_id(
-            node_id, req.min, req.vel, req.categories
-        )
-        print("2.5)     if not isinstance(pois_resp, list):")
-
-        if not isinstance(pois_resp, list):
-            raise HTTPException(status_code=404, detail="PoIs not found")
-
-        #print("Entra")
-        # 3) Calcolo parametri
-        #print("3) Calcolo parametri")
-
-        result = compute_isochrone_parameters(
-            pois_data=pois_resp,
-            isochrone_data=iso_resp,
-            vel=req.vel,
-            total_pois=total_count,
-            max_minutes=60,
-            categories=req.categories
+        status_code, message, node_id = await run_db(get_id_node_by_coordinates, req.coords)
+        if status_code != 200:
+            raise HTTPException(status_code=status_code, detail=message)
+
+        # metriche materializzate per i preset standard, altrimenti calcolo su isocrona e POI
+        status_code, message, result = await run_db(
+            cached_call, "parameters", get_parameters_by_node_id, node_id, req.min, req.vel, req.categories
         )
+        if status_code != 200:
+            raise HTTPException(status_code=status_code, detail=message)
         return result
 
     except HTTPException as e:
@@ -446,6 +565,69 @@ def get_isochrone_parameters(req: PoisRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/search")
+async def search(req: PoisRequest):
+    """
+        Restituisce in un'unica chiamata isocrona, POI e parametri per un punto.
+
+        ### Dettagli
+        Equivale a `/api/get_isochrone`, `/api/get_pois_isochrone` e `/api/get_isochrone_parameters`
+        insieme, ma individua il nodo più vicino una sola volta, legge isocrona e POI una sola volta
+        e calcola i parametri sugli stessi dati.
+
+        ### Parametri:
+        - **req**: `PoisRequest`
+          - `coords` (Coordinates): latitudine e longitudine
+          - `min` (int): minuti per cui calcolare l'isocrona
+          - `vel` (int): velocità di percorrenza (km/h)
+          - `categories` (List[str]): categorie di interesse
+
+        ### Esempio di chiamata
+        ```bash
+        curl -X POST \\
+            -H "Content-Type: application/json" \\
+            -d '{
+                "coords": {"lat": 45.0703, "lon": 7.6869},
+                "min": 15,
+                "vel": 5,
+                "categories": ["restaurant","beauty_and_spa"]
+            }' \\
+            http://localhost:8000/api/search
+        ```
+
+        ### Esempio di risposta
+        ```json
+        {
+            "node_id": 1227233452,
+            "isochrone": {"node_id": 1227233452, "convex_hull": {"coordinates": [...], "bbox": [...]}},
+            "pois": [{"poi_id": "08f1f984030131a103c98f5eca19fbd9", "distance": 201.467, ...}],
+            "parameters": {"proximity": 19.74864, "proximity_score": 0.329144, ...}
+        }
+        ```
+
+        ### Errori:
+        - **404**: Nodo, isocrona o POI non trovati.
+        - **500**: Errore interno del server.
+    """
+    try:
+        status_code, message, node_id = await run_db(get_id_node_by_coordinates, req.coords)
+        if status_code != 200:
+            raise HTTPException(status_code=status_code, detail=message)
+
+        status_code, message, result = await run_db(
+            cached_call, "search", get_search_by_node_id, node_id, req.min, req.vel, req.categories
+        )
+        if status_code != 200:
+            raise HTTPException(status_code=status_code, detail=message)
+        return result
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Errore inatteso nella ricerca: {str(e)}")
+        raise HTTPException(status_code=500, detail="Errore interno del server")
+
+
 @app.post("/api/get_node_id")
 async def get_node_id(coords: Coordinates):
     """
@@ -479,7 +661,7 @@ async def get_node_id(coords: Coordinates):
         - **500**: Errore interno del server.
     """
     try:
-        status_code, message, node_id = get_id_node_by_coordinates(coords)
+        status_code, message, node_id = await run_db(get_id_node_by_coordinates, coords)
         if status_code == 200:
             return {"node_id": node_id}
         else:
@@ -488,8 +670,58 @@ async def get_node_id(coords: Coordinates):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/get_node_ids")
+async def get_node_ids(request: BatchCoordinatesRequest):
+    """
+        Restituisce in un'unica chiamata il `node_id` più vicino per ciascuna delle coordinate fornite.
+
+        ### Dettagli
+        - Tutti i punti vengono agganciati alla rete stradale in un'unica passata sull'indice dei nodi in memoria.
+        - I risultati sono nello stesso ordine delle coordinate in ingresso.
+        - I punti oltre la distanza massima di snapping hanno `node_id` e `distance` a `null`.
+
+        ### Parametri:
+        - **request**: `BatchCoordinatesRequest`
+          - `coords` (List[Coordinates]): lista di coordinate (lat, lon), da 1 a `BATCH_MAX_COORDINATES` (10000)
+
+        ### Esempio di utilizzo
+        ```bash
+        curl -X POST \\
+            -H "Content-Type: application/json" \\
+            -d '{
+                "coords": [
+                    {"lat": 45.0703, "lon": 7.6869},
+                    {"lat": 45.0621, "lon": 7.6781}
+                ]
+            }' \\
+            http://localhost:8000/api/get_node_ids
+        ```
+
+        ### Esempio di risposta
+        ```json
+        [
+            {"node_id": 1227233452, "distance": 12.4},
+            {"node_id": 25989354, "distance": 31.8}
+        ]
+        ```
+
+        ### Errori:
+        - **422**: Lista di coordinate vuota o più lunga di `BATCH_MAX_COORDINATES`.
+        - **503**: Indice dei nodi in memoria non caricato.
+        - **500**: Errore interno del server.
+    """
+    status_code, message, result = await run_db(get_id_nodes_by_coordinates, request.coords)
+    if status_code == 200:
+        return result
+    else:
+        raise HTTPException(status_code=status_code, detail=message)
+
+
 @app.get("/api/get_all_neighbourhoods")
-async def get_all_neighbourhoods_endpoint(city: str = None):
+async def get_all_neighbourhoods_endpoint(request: Request, city: str = None,
+                                          zoom: int = Query(None, ge=0, le=MAX_ZOOM),
+                                          tolerance: float = Query(None, ge=0),
+                                          precision: int = Query(None, ge=0, le=MAX_PRECISION)):
     """
     Restituisce tutti i quartieri disponibili nel database per una città specifica.
 
@@ -501,6 +733,10 @@ async def get_all_neighbourhoods_endpoint(city: str = None):
 
     ### Parametri:
     - **city** (str, opzionale): Nome della città per cui recuperare i quartieri
+    - **zoom** (int, opzionale): Livello di zoom della mappa (da 0 a 22), per semplificare i poligoni
+    - **tolerance** (float, opzionale): Tolleranza di semplificazione in gradi (prevale su zoom), arrotondata
+      a quella dello zoom più vicino: i livelli di dettaglio in cache sono quindi pochi
+    - **precision** (int, opzionale): Cifre decimali delle coordinate (da 0 a 7)
 
     ### Response
     Lista di oggetti quartiere contenenti:
@@ -532,16 +768,41 @@ async def get_all_neighbourhoods_endpoint(city: str = None):
     ]
     ```
 
+    Il JSON (e la sua versione gzip) viene costruito una sola volta per versione dei dati
+    (`DATASET_VERSION`) e livello di dettaglio, e restituito con `ETag` e `Cache-Control`: con `If-None-Match`
+    il client riceve **304** senza scaricare di nuovo i poligoni.
+
     ### Errori:
     - **404**: Nessun quartiere trovato per la città specificata o città non supportata.
+    - **422**: `zoom`, `tolerance` o `precision` fuori dai limiti.
     - **500**: Errore interno del server.
     """
     try:
-        status_code, message, neighbourhoods = get_all_neighbourhoods(city)
-        if status_code == 200:
-            return neighbourhoods
-        else:
+        level = resolve_level_of_detail(zoom, tolerance, precision) or (None, None)
+        status_code, message, payload = await run_db(get_neighbourhoods_payload, city, *level)
+        if status_code != 200:
             raise HTTPException(status_code=status_code, detail=message)
+
+        headers = {
+            "Cache-Control": f"public, max-age={NEIGHBOURHOODS_MAX_AGE_S}",
+            "Vary": "Accept-Encoding",
+        }
+        gzip_accepted = "gzip" in request.headers.get("accept-encoding", "")
+        etag = payload.gzip_etag if gzip_accepted else payload.etag
+        headers["ETag"] = etag
+
+        # il client ha già questa versione: 304 senza corpo
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or payload.etag in tags or payload.gzip_etag in tags:
+            return Response(status_code=304, headers=headers)
+
+        if gzip_accepted:
+            return Response(payload.gzip_body, media_type="application/json",
+                            headers={**headers, "Content-Encoding": "gzip"})
+        return Response(payload.body, media_type="application/json", headers=headers)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -552,8 +813,8 @@ async def get_neighbourhoods_by_coordinates_endpoint(coords: Coordinates):
     Trova i quartieri che contengono un punto specifico.
 
     ### Dettagli
-    - Prende in ingresso coordinate (lat, lon) e ricerca i quartieri che contengono quel punto.
-    - Se la query geospaziale fallisce, restituisce tutti i quartieri disponibili.
+    - Prende in ingresso coordinate (lat, lon) e restituisce solo i quartieri che contengono quel punto.
+    - La ricerca usa un indice spaziale in memoria (STRtree) costruito una volta per versione dei dati.
 
     ### Parametri:
     - **coords**: `Coordinates`
@@ -579,22 +840,152 @@ async def get_neighbourhoods_by_coordinates_endpoint(coords: Coordinates):
     - **500**: Errore interno del server.
     """
     try:
-        status_code, message, neighbourhoods = get_neighbourhoods_by_coordinates(coords.lat, coords.lon)
+        status_code, message, neighbourhoods = await run_db(get_neighbourhoods_by_coordinates, coords.lat, coords.lon)
         if status_code == 200:
             return neighbourhoods
         else:
             raise HTTPException(status_code=status_code, detail=message)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/assign_neighbourhoods")
+async def assign_neighbourhoods_endpoint(req: BatchCoordinatesRequest):
+    """
+    Assegna molti punti ai quartieri che li contengono con una sola interrogazione dell'indice spaziale.
+
+    ### Parametri:
+    - **req**: `BatchCoordinatesRequest`
+      - `coords` (List[Coordinates]): lista di punti (lat, lon), da 1 a `BATCH_MAX_COORDINATES` (10000)
+
+    ### Esempio di utilizzo
+    ```bash
+    curl -X POST \\
+        -H "Content-Type: application/json" \\
+        -d '{"coords": [{"lat": 45.0703, "lon": 7.6869}, {"lat": 46.0, "lon": 9.0}]}' \\
+        http://localhost:8000/api/assign_neighbourhoods
+    ```
+
+    ### Esempio di risposta
+    ```json
+    [12, null]
+    ```
+    Un elemento per punto, nello stesso ordine: l'id del quartiere oppure `null` se il punto è fuori da tutti.
+
+    ### Errori:
+    - **500**: Errore interno del server.
+    """
+    status_code, message, ids = await run_db(
+        assign_neighbourhoods, [c.lat for c in req.coords], [c.lon for c in req.coords]
+    )
+    if status_code != 200:
+        raise HTTPException(status_code=status_code, detail=message)
+    return ids
+
+
+@app.post("/api/analyze_neighbourhoods")
+async def analyze_neighbourhoods_endpoint(req: NeighbourhoodAnalysisRequest):
+    """
+    Analizza uno o più quartieri lato server e restituisce le metriche medie per quartiere.
+
+    ### Dettagli
+    - Per ogni quartiere usa come campione i primi `max_nodes` nodi di confine.
+    - I nodi di tutti i quartieri vengono analizzati in parallelo su un pool di thread.
+    - La risposta è uno stream NDJSON (un oggetto JSON per riga) che permette al frontend di
+      aggiornare il contatore di avanzamento:
+      - `start`: numero di nodi e coordinate [lat, lon] del campione di un quartiere
+      - `node`: parametri di un nodo completato (`null` se il nodo non è analizzabile) e avanzamento `done/total`
+      - `result`: medie di proximity, density, entropy, accessibility e closeness del quartiere
+
+    ### Parametri:
+    - **req**: `NeighbourhoodAnalysisRequest`
+      - `neighbourhood_ids` (List): id dei quartieri da analizzare (da 1 a `ANALYSIS_MAX_NEIGHBOURHOODS`, 10)
+      - `min` (int): minuti per cui calcolare l'isocrona
+      - `vel` (int): velocità di percorrenza (km/h)
+      - `categories` (List[str]): categorie di interesse
+      - `max_nodes` (int, opzionale): nodi campione per quartiere (default 25, da 1 a `ANALYSIS_MAX_NODES`, 100);
+        per un quartiere formato da più poligoni il campione comprende i nodi di tutti i poligoni
+
+    ### Esempio di chiamata
+    ```bash
+    curl -N -X POST \\
+        -H "Content-Type: application/json" \\
+        -d '{
+            "neighbourhood_ids": [1, 2],
+            "min": 15,
+            "vel": 5,
+            "categories": ["restaurant","beauty_and_spa"]
+        }' \\
+        http://localhost:8000/api/analyze_neighbourhoods
+    ```
+
+    ### Esempio di risposta
+    ```
+    {"type": "start", "neighbourhood_id": 1, "total": 25, "coordinates": [[45.07, 7.68], ...]}
+    {"type": "node", "neighbourhood_id": 1, "index": 3, "parameters": {...}, "done": 1, "total": 25}
+    ...
+    {"type": "result", "neighbourhood_id": 1, "nodes_analyzed": 25, "averages": {"proximity": 0.31, ...}}
+    ```
+
+    ### Errori:
+    - **404**: Nessun quartiere trovato per gli id forniti.
+    - **422**: `neighbourhood_ids` o `max_nodes` fuori dai limiti.
+    - **500**: Errore interno del server.
+    """
+    status_code, message, neighbourhoods = await run_db(get_neighbourhoods_by_ids, req.neighbourhood_ids)
+    if status_code != 200:
+        raise HTTPException(status_code=status_code, detail=message)
+
+    events = analyze_neighbourhoods(neighbourhoods, req.min, req.vel, req.categories, req.max_nodes)
+    return StreamingResponse(
+        (json.dumps(event) + "\n" for event in events),
+        media_type="application/x-ndjson",
+        # eseguito anche se il client si disconnette: chiude il generatore e annulla i nodi in coda
+        background=BackgroundTask(events.close)
+    )
+
+
+@app.get("/api/cache_stats")
+async def get_cache_stats():
+    """
+    Restituisce lo stato della cache dei risultati per nodo (vedi `backend/Cache.py`).
+
+    ### Esempio di risposta
+    ```json
+    {
+        "enabled": true,
+        "backend": "memory",
+        "dataset_version": "1",
+        "size": 128,
+        "max_size": 4096,
+        "ttl": 600.0,
+        "hits": 342,
+        "misses": 128,
+        "hit_rate": 0.7276595744680852,
+        "shared_hits": 0,
+        "kinds": {"parameters": {"hits": 300, "misses": 100}, "isochrone": {"hits": 42, "misses": 28}},
+        "coalesced": 17,
+        "geocode": {"enabled": true, "memory_size": 12, "hits": 40, "stale_hits": 2, "misses": 12,
+                    "hit_rate": 0.7777777777777778, "breaker": {"state": "closed", "failures": 0}}
+    }
+    ```
+
+    `coalesced` conta le chiamate che hanno atteso una query identica già in corso (vedi `backend/SingleFlight.py`).
+    `geocode` è la cache delle risposte di Nominatim con lo stato del circuit breaker (vedi `backend/GeocodeCache.py`).
+    """
+    return {**result_cache.stats(), "coalesced": single_flight_group.shared,
+            "geocode": {**geocode_cache.stats(), "breaker": nominatim_breaker.stats()}}
+
+
 ######## API DI TESTING
 
 # Endpoint per trovare il nodo più vicino a un punto specifico
 @app.post("/api/nodes/nearest/")
 async def find_nearest_node(coords: Coordinates):
     collection = db["nodes"]
-    nearest_node = collection.find_one({
+    nearest_node = await run_db(collection.find_one, {
         "location": {
             "$near": {
                 "$geometry": {
@@ -621,7 +1012,7 @@ async def find_poi_by_coordinates(coords: Coordinates):
     collection = db["pois"]
 
     # Query per trovare il primo nodo con le coordinate esatte
-    poi = collection.find_one({
+    poi = await run_db(collection.find_one, {
         "location.coordinates": [coords.lat, coords.lon]  # attenzione a posizionamento lat/lon
     })
 
@@ -645,7 +1036,9 @@ async def find_poi_by_coordinates(coords: Coordinates):
 async def register_user(user: UserCreate):
 
     try:
-        created_user = create_user(user) # crea l'utente nel db, se gia presente ritorna None
+        # l'hash gira sul pool dedicato, non sull'event loop né sul pool del db
+        hashed_password = await run_hash(get_password_hash, user.password)
+        created_user = await run_db(create_user, user, hashed_password) # crea l'utente nel db, se gia presente ritorna None
         if created_user:
             return created_user
         else:
@@ -664,9 +1057,10 @@ async def login_user(user: UserLogin):
     # autentica e restituisce JWT token
     
     try:
-        # Verifica credenziali utente nel database
-        authenticated_user = authenticate_user(user.email, user.password)
-        if not authenticated_user:
+        # Verifica credenziali: utente dal database, password sul pool dell'hashing
+        user_doc = await run_db(get_user_by_email, user.email)
+        authenticated = user_doc is not None and await run_hash(verify_password, user.password, user_doc["hashed_password"])
+        if not authenticated:
             # Se credenziali non valide, restituisce errore 401
             raise HTTPException(
                 status_code=401,
@@ -675,7 +1069,7 @@ async def login_user(user: UserLogin):
             )
         
         # Crea token JWT con l'email 
-        access_token = create_access_token(data={"sub": authenticated_user.email})
+        access_token = create_access_token(data={"sub": user_doc["email"]})
         return {"access_token": access_token, "token_type": "bearer"}
     except HTTPException:
         raise
@@ -713,7 +1107,9 @@ async def save_user_preferences(
     - **categories** (List[str]): array of service IDs
     """
     try:
-        success = update_user_preferences(current_user.email, preferences.model_dump()) # salva nel db l'oggetto dizionario
+        success = await run_db(update_user_preferences, current_user.email, preferences.model_dump()) # salva nel db l'oggetto dizionario
+        # gli utenti in cache hanno ancora le preferenze vecchie
+        invalidate_principal(current_user.email)
         if success:
             return {"message": "Preferences saved successfully"}
         else:
@@ -730,7 +1126,7 @@ async def get_user_preferences_endpoint(current_user: User = Depends(get_current
     """
 
     try:
-        preferences = get_user_preferences(current_user.email)
+        preferences = await run_db(get_user_preferences, current_user.email)
         if preferences:
             return UserPreferences(**preferences)
         else:
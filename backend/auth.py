@@ -1,10 +1,17 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from typing import Optional #Optional[str] vuol dire che puo essere str o None
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
+from backend.Cache import TTLCache
+from backend.db import run_db
+
 # Configuration
 SECRET_KEY = "ricordatiDiSpostareQuestaVariabileInUnFileEnv"
 ALGORITHM = "HS256"
@@ -15,6 +22,17 @@ pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto") # ho do
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token") # dove il client ottiene il token
 
+# Pool dedicato all'hashing delle password: pbkdf2 impiega decine di millisecondi di CPU e non deve
+# bloccare l'event loop né occupare i thread di run_db; hashlib rilascia il GIL, quindi i thread
+# lavorano in parallelo e il numero di worker limita gli hash contemporanei
+HASH_EXECUTOR_WORKERS = int(os.getenv("HASH_EXECUTOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+hash_executor = ThreadPoolExecutor(max_workers=HASH_EXECUTOR_WORKERS, thread_name_prefix="hash")
+
+# Utenti autenticati per token: le richieste autenticate non rileggono l'utente dal db
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+PRINCIPAL_CACHE_TTL_S = float(os.getenv("PRINCIPAL_CACHE_TTL_S", "60"))
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_S)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """input: passoword inserita e password presa dal db, output: booleano se sono uguali"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -23,6 +41,11 @@ def get_password_hash(password: str) -> str:
     """Hash della password"""
     return pwd_context.hash(password)
 
+async def run_hash(func, *args, **kwargs):
+    """Esegue get_password_hash o verify_password sul pool dedicato e ne attende il risultato."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, partial(func, *args, **kwargs))
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """crea un token JWT"""
     to_encode = data.copy() # copia il dizionario passato 
@@ -35,17 +58,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> Optional[str]:
-    """verifica se il token è valido, restituisce l'email"""
+def decode_token(token: str) -> Optional[dict]:
+    """verifica se il token è valido, restituisce il payload"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+        if payload.get("sub") is None:
             return None
-        return email
+        return payload
     except JWTError:
         return None
 
+def verify_token(token: str) -> Optional[str]:
+    """verifica se il token è valido, restituisce l'email"""
+    payload = decode_token(token)
+    return payload["sub"] if payload else None
+
+def invalidate_principal(email: str) -> int:
+    """rimuove dalla cache l'utente (per tutti i suoi token), da chiamare quando cambiano i suoi dati"""
+    return principal_cache.delete_where(lambda token, user: user.email == email)
+
 async def get_current_user(token: str = Depends(oauth2_scheme)): # Depends: prima di tutto prendo oauth2_scheme (che è dove ho il token)
     """Dal token restituisce l'utente"""
 
@@ -55,20 +86,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme)): # Depends: prim
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    # utente già autenticato con questo token (la voce non sopravvive alla scadenza del token)
+    hit, user = principal_cache.get(token)
+    if hit:
+        return user
+
     # verifica token, prende email
-    email = verify_token(token)
-    if email is None:
+    payload = decode_token(token)
+    if payload is None:
         raise credentials_exception
+    email = payload["sub"]
     
     from backend.users import get_user_by_email
     from backend.RequestModels import User
     
     # prende l'utente dal db
-    user = get_user_by_email(email)
+    user = await run_db(get_user_by_email, email)
     if user is None:
         raise credentials_exception
     
-    return User(
+    principal = User(
         email=user["email"],
         preferences=user.get("preferences")
     )
+    ttl = PRINCIPAL_CACHE_TTL_S
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - datetime.now(timezone.utc).timestamp())
+    if ttl > 0:
+        principal_cache.set(token, principal, ttl=ttl)
+    return principal
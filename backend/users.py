@@ -3,11 +3,13 @@
 from typing import Optional 
 from pymongo.errors import DuplicateKeyError
 from backend.db import db
-from backend.auth import get_password_hash, verify_password
 from backend.RequestModels import User, UserCreate
 
-def create_user(user: UserCreate) -> Optional[User]:
-    """Create a new user in the database."""
+# l'hashing e la verifica delle password (backend.auth) non avvengono qui: gli endpoint li eseguono
+# sul pool dedicato con run_hash, queste funzioni fanno solo le operazioni sul db (con run_db)
+
+def create_user(user: UserCreate, hashed_password: str) -> Optional[User]:
+    """Create a new user in the database, with the password already hashed."""
     try:
         # Cerca l'user nel db
         existing_user = get_user_by_email(user.email)
@@ -15,9 +17,6 @@ def create_user(user: UserCreate) -> Optional[User]:
         if existing_user:
             return None
         
-        # Hash della password
-        hashed_password = get_password_hash(user.password)
-        
         # documento utente, da mettere nel db
         user_doc = {
             "email": user.email,  
@@ -50,29 +49,6 @@ def get_user_by_email(email: str) -> Optional[dict]:
         print(f"Error getting user by email: {e}")
         return None
 
-def authenticate_user(email: str, password: str) -> Optional[User]:
-    """Authenticate a user with email and password."""
-    try:
-        # Recupera l'utente 
-        user = get_user_by_email(email)
-
-        if not user: #se non lo trova
-            return None
-        
-        # Verifica la password fornita
-        if verify_password(password, user["hashed_password"]):
-            # Se corretta, restituisce l'oggetto User con preferences se presenti
-            return User(
-                email=user["email"], 
-                preferences=user.get("preferences")
-            )
-        # altrimenti None
-        return None
-        
-    except Exception as e:
-        print(f"Error authenticating user: {e}")
-        return None
-
 def update_user_preferences(email: str, preferences: dict) -> bool:
     """aggiorna le preferenze dell'utente nel db"""
     try:
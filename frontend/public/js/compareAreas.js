@@ -280,174 +280,118 @@ document.addEventListener('DOMContentLoaded', () => { // aspetta che la pagina s
         document.querySelectorAll('[id^="progress-"]').forEach(el => el.textContent = '');
         //non serve pulire le neighbourhoodLayers perchè selezionando un altro quartiere già si pulisce il layer precedente
 
-        // Per ogni quartiere selezionato... (per ora solo 2)
-        for (const neighbourhood of selectedNeighbourhoods) {
-            console.log(`\n=== Processing Neighbourhood ${neighbourhood.id} ===`);
-            
-            // raccoglie le metriche di tutti i nodi del quartiere per poter fare la media
-            const neighbourhoodMetrics = {
-                proximity: [],
-                density: [],
-                entropy: [],
-                accessibility: [],
-                closeness: []
-            };
-            
-            let nodeCoordinates = null;
-            
-             // Estrai le coordinate del quartiere
-            if (neighbourhood.coordinates && neighbourhood.coordinates.length > 0 && neighbourhood.coordinates[0]) {
-                nodeCoordinates = neighbourhood.coordinates[0]; //tutte le coordinate dei nodi di quel quartiere
-                console.log(`Found ${nodeCoordinates.length} nodes in neighbourhood ${neighbourhood.id}`);
-                
-                // max nodi: 25
-                const maxNodes = Math.min(nodeCoordinates.length, 25);
-                
+        // marker dei nodi campione, per quartiere e posizione nel campione
+        const markersByNeighbourhood = {};
+
+        function nodePopup(neighbourhoodId, index, total, nodeCoords, body) {
+            return `
+                <div class="popup-content">
+                    <h6 class="popup-title">Nodo Quartiere ${neighbourhoodId}</h6>
+                    <p class="popup-info"><strong>Posizione:</strong> ${index + 1}/${total}</p>
+                    <p class="popup-info"><strong>Coordinate:</strong> ${nodeCoords[0].toFixed(6)}, ${nodeCoords[1].toFixed(6)}</p>
+                    ${body}
+                </div>
+            `;
+        }
+
+        function handleAnalysisEvent(event) {
+            const neighbourhoodId = event.neighbourhood_id;
+            const progressElement = document.getElementById(`progress-${neighbourhoodId}`);
+
+            if (event.type === 'start') {
+                console.log(`\n=== Processing Neighbourhood ${neighbourhoodId} (${event.total} nodi) ===`);
+
                 // inizializzo il progress counter
-                const progressElement = document.getElementById(`progress-${neighbourhood.id}`);
                 if (progressElement) {
-                    progressElement.textContent = `0/${maxNodes}`;
+                    progressElement.textContent = `0/${event.total}`;
                 }
-                
-                // per ogni nodo del quartiere
-                for (let i = 0; i < maxNodes; i++) {
-                    const nodeCoords = nodeCoordinates[i];
-                    console.log(`\n--- Processing Node ${i + 1}/${maxNodes} ---`);
-                    console.log(`Coordinates: [${nodeCoords[0]}, ${nodeCoords[1]}]`);
-                    
-                    // Aggiungi un marker sulla mappa per questo nodo
-                    let marker = null;
-                    if (window.map) {
-                        marker = L.circleMarker([nodeCoords[0], nodeCoords[1]], {
-                            radius: 6,
-                            fillColor: '#ff7800',
-                            color: '#000',
-                            weight: 2,
-                            opacity: 1,
-                            fillOpacity: 0.8
-                        }).addTo(window.map);
-                        
-                        // Aggiungi popup con informazioni del nodo
-                        marker.bindPopup(`
-                            <div class="popup-content">
-                                <h6 class="popup-title">Nodo Quartiere ${neighbourhood.id}</h6>
-                                <p class="popup-info"><strong>Posizione:</strong> ${i + 1}/${maxNodes}</p>
-                                <p class="popup-info"><strong>Coordinate:</strong> ${nodeCoords[0].toFixed(6)}, ${nodeCoords[1].toFixed(6)}</p>
-                                <p class="popup-info"><strong>Stato:</strong> In elaborazione...</p>
-                            </div>
-                        `);
-                        
-                        nodeMarkers.push(marker); //aggiunge il marker al array dei marker
-                    }
-                    
-                    try {
-                        // Chiama ApiService.runSearch per questo nodo
-                        const results = await ApiService.runSearch(
-                            [nodeCoords[0], nodeCoords[1]], // coordinates [lat, lon]
-                            minutes, // minutes
-                            velocity,  // velocity
-                            categories // categorie da preferenze o default
-                        );
-                        
-                        const metrics = results.parameters;
-                        
-                        // Raccogli i risultati per il calcolo della media
-                        if (metrics.proximity_score !== null && metrics.proximity_score !== undefined) {
-                            neighbourhoodMetrics.proximity.push(metrics.proximity_score);
-                        }
-                        if (metrics.density_score !== null && metrics.density_score !== undefined) {
-                            neighbourhoodMetrics.density.push(metrics.density_score);
-                        }
-                        if (metrics.entropy_score !== null && metrics.entropy_score !== undefined) {
-                            neighbourhoodMetrics.entropy.push(metrics.entropy_score);
-                        }
-                        if (metrics.poi_accessibility !== null && metrics.poi_accessibility !== undefined) {
-                            neighbourhoodMetrics.accessibility.push(metrics.poi_accessibility);
-                        }
-                        if (metrics.closeness !== null && metrics.closeness !== undefined) {
-                            neighbourhoodMetrics.closeness.push(metrics.closeness);
-                        }
-                        
-                        // Aggiorna il marker con i risultati
-                        if (marker) {
-                            marker.setPopupContent(`
-                                <div class="popup-content">
-                                    <h6 class="popup-title">Nodo Quartiere ${neighbourhood.id}</h6>
-                                    <p class="popup-info"><strong>Posizione:</strong> ${i + 1}/${maxNodes}</p>
-                                    <p class="popup-info"><strong>Coordinate:</strong> ${nodeCoords[0].toFixed(6)}, ${nodeCoords[1].toFixed(6)}</p>
-                                    <p class="popup-info"><strong>Proximity:</strong> ${metrics.proximity_score || 'N/A'}</p>
-                                    <p class="popup-info"><strong>Density:</strong> ${metrics.density_score || 'N/A'}</p>
-                                    <p class="popup-info"><strong>Entropy:</strong> ${metrics.entropy_score || 'N/A'}</p>
-                                    <p class="popup-info"><strong>Accessibility:</strong> ${metrics.poi_accessibility || 'N/A'}</p>
-                                    <p class="popup-info"><strong>Closeness:</strong> ${metrics.closeness || 'N/A'}</p>
-                                </div>
-                            `);
-                            
-                            // Cambia colore del marker per indicare completamento
-                            // Usa il colore del quartiere se disponibile, altrimenti usa il verde
-                            const neighbourhoodColor = neighbourhoodColors[neighbourhood.id] || '#28a745';
-                            marker.setStyle({
-                                fillColor: neighbourhoodColor,
-                                color: '#000', // bordo nero 
-                                weight: 1
-                            });
-                        }
-                        
-                    } catch (error) {
-                        console.error(`Error processing node ${i + 1}:`, error);
-                        
-                        // Aggiorna il marker per indicare errore
-                        if (marker) {
-                            marker.setPopupContent(`
-                                <div class="popup-content">
-                                    <h6 class="popup-title">Nodo Quartiere ${neighbourhood.id}</h6>
-                                    <p class="popup-info"><strong>Posizione:</strong> ${i + 1}/${maxNodes}</p>
-                                    <p class="popup-info"><strong>Coordinate:</strong> ${nodeCoords[0].toFixed(6)}, ${nodeCoords[1].toFixed(6)}</p>
-                                    <p class="popup-info"><strong>Stato:</strong> <span class="error-message">Errore nell'elaborazione</span></p>
-                                </div>
-                            `);
-                            
-                            marker.setStyle({
-                                fillColor: '#dc3545',
-                                color: '#721c24'
-                            });
-                        }
-                    }
-                    
-                    // aggiorno il progress counter dopo ogni nodo
-                    const progressElement = document.getElementById(`progress-${neighbourhood.id}`);
-                    if (progressElement) {
-                        progressElement.textContent = `${i + 1}/${maxNodes}`;
-                    }
+
+                // Aggiungi un marker sulla mappa per ogni nodo del campione
+                markersByNeighbourhood[neighbourhoodId] = event.coordinates.map((nodeCoords, i) => {
+                    if (!window.map) return null;
+
+                    const marker = L.circleMarker([nodeCoords[0], nodeCoords[1]], {
+                        radius: 6,
+                        fillColor: '#ff7800',
+                        color: '#000',
+                        weight: 2,
+                        opacity: 1,
+                        fillOpacity: 0.8
+                    }).addTo(window.map);
+
+                    marker.bindPopup(nodePopup(neighbourhoodId, i, event.total, nodeCoords,
+                        '<p class="popup-info"><strong>Stato:</strong> In elaborazione...</p>'));
+                    marker.nodeCoords = nodeCoords;
+
+                    nodeMarkers.push(marker); //aggiunge il marker al array dei marker
+                    return marker;
+                });
+            } else if (event.type === 'node') {
+                const marker = (markersByNeighbourhood[neighbourhoodId] || [])[event.index];
+                const metrics = event.parameters;
+
+                // Aggiorna il marker con i risultati o con l'errore
+                if (marker && metrics) {
+                    marker.setPopupContent(nodePopup(neighbourhoodId, event.index, event.total, marker.nodeCoords, `
+                        <p class="popup-info"><strong>Proximity:</strong> ${metrics.proximity_score || 'N/A'}</p>
+                        <p class="popup-info"><strong>Density:</strong> ${metrics.density_score || 'N/A'}</p>
+                        <p class="popup-info"><strong>Entropy:</strong> ${metrics.entropy_score || 'N/A'}</p>
+                        <p class="popup-info"><strong>Accessibility:</strong> ${metrics.poi_accessibility || 'N/A'}</p>
+                        <p class="popup-info"><strong>Closeness:</strong> ${metrics.closeness || 'N/A'}</p>
+                    `));
+
+                    // Usa il colore del quartiere se disponibile, altrimenti usa il verde
+                    const neighbourhoodColor = neighbourhoodColors[neighbourhoodId] || '#28a745';
+                    marker.setStyle({
+                        fillColor: neighbourhoodColor,
+                        color: '#000', // bordo nero
+                        weight: 1
+                    });
+                } else if (marker) {
+                    console.error(`Error processing node ${event.index + 1} of neighbourhood ${neighbourhoodId}`);
+                    marker.setPopupContent(nodePopup(neighbourhoodId, event.index, event.total, marker.nodeCoords,
+                        '<p class="popup-info"><strong>Stato:</strong> <span class="error-message">Errore nell\'elaborazione</span></p>'));
+                    marker.setStyle({
+                        fillColor: '#dc3545',
+                        color: '#721c24'
+                    });
+                }
+
+                // aggiorno il progress counter dopo ogni nodo
+                if (progressElement) {
+                    progressElement.textContent = `${event.done}/${event.total}`;
+                }
+            } else if (event.type === 'result') {
+                // valori del quartiere: media dei valori di ogni nodo calcolata dal backend
+                const averages = {};
+                for (const [metric, value] of Object.entries(event.averages)) {
+                    averages[metric] = value !== null && value !== undefined ? value.toFixed(4) : 'N/A';
                 }
-            } else {
-                console.log(`No valid coordinates found for neighbourhood ${neighbourhood.id}`);
+
+                console.log(`VALORI QUARTIERE ${neighbourhoodId} (da ${event.nodes_analyzed} nodi):`);
+                console.log(`   Proximity: ${averages.proximity}`);
+                console.log(`   Density: ${averages.density}`);
+                console.log(`   Entropy: ${averages.entropy}`);
+                console.log(`   Accessibility: ${averages.accessibility}`);
+                console.log(`   Closeness: ${averages.closeness}`);
+
+                // Aggiorna i chart con i dati di questo quartiere
+                initializeSpiderChart('spider-chart-1', neighbourhoodId, averages);
+                initializeParallelChart('parallel-coordinates-1', neighbourhoodId, averages);
             }
-            
-            // otteniamo i valori del quartiere con la media dei valori di ogni nodo
-            const averages = {
-                proximity: neighbourhoodMetrics.proximity.length > 0 ? 
-                    (neighbourhoodMetrics.proximity.reduce((sum, val) => sum + val, 0) / neighbourhoodMetrics.proximity.length).toFixed(4) : 'N/A',
-                density: neighbourhoodMetrics.density.length > 0 ? 
-                    (neighbourhoodMetrics.density.reduce((sum, val) => sum + val, 0) / neighbourhoodMetrics.density.length).toFixed(4) : 'N/A',
-                entropy: neighbourhoodMetrics.entropy.length > 0 ? 
-                    (neighbourhoodMetrics.entropy.reduce((sum, val) => sum + val, 0) / neighbourhoodMetrics.entropy.length).toFixed(4) : 'N/A',
-                accessibility: neighbourhoodMetrics.accessibility.length > 0 ? 
-                    (neighbourhoodMetrics.accessibility.reduce((sum, val) => sum + val, 0) / neighbourhoodMetrics.accessibility.length).toFixed(4) : 'N/A',
-                closeness: neighbourhoodMetrics.closeness.length > 0 ? 
-                    (neighbourhoodMetrics.closeness.reduce((sum, val) => sum + val, 0) / neighbourhoodMetrics.closeness.length).toFixed(4) : 'N/A'
-            };
-            
-            console.log(`VALORI QUARTIERE ${neighbourhood.id}:`);
-            console.log(`   Proximity: ${averages.proximity} (da ${neighbourhoodMetrics.proximity.length} nodi)`);
-            console.log(`   Density: ${averages.density} (da ${neighbourhoodMetrics.density.length} nodi)`);
-            console.log(`   Entropy: ${averages.entropy} (da ${neighbourhoodMetrics.entropy.length} nodi)`);
-            console.log(`   Accessibility: ${averages.accessibility} (da ${neighbourhoodMetrics.accessibility.length} nodi)`);
-            console.log(`   Closeness: ${averages.closeness} (da ${neighbourhoodMetrics.closeness.length} nodi)`);
-            
-            // Aggiorna i chart con i dati di questo quartiere
-            initializeSpiderChart('spider-chart-1', neighbourhood.id, averages);
-            initializeParallelChart('parallel-coordinates-1', neighbourhood.id, averages);
+        }
+
+        // I quartieri selezionati (per ora solo 2) vengono analizzati in parallelo lato server
+        try {
+            await ApiService.analyzeNeighbourhoods(
+                selectedNeighbourhoods.map(n => n.id),
+                minutes,
+                velocity,
+                categories, // categorie da preferenze o default
+                handleAnalysisEvent
+            );
+        } catch (error) {
+            console.error('Error analyzing neighbourhoods:', error);
         }
 
         // assicurati che il chart visibile sia quello corretto
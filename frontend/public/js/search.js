@@ -122,6 +122,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
         setupSidebarToggle();
+        // suggerimenti locali a ogni tasto, ricerca completa (anche indirizzi) quando l'utente si ferma
+        elements.searchInput.addEventListener('input', debounce(handleSuggestionsInput, 150));
         elements.searchInput.addEventListener('input', debounce(handleSearchInput, 1500));
         //elements.searchInput.addEventListener('input', handleSearchInput);
         elements.searchButton.addEventListener('click', handleSearch);
@@ -252,6 +254,20 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function handleSuggestionsInput() {
+        const query = elements.searchInput.value.trim();
+        if (query.length < 2) {
+            elements.suggestionsList.innerHTML = '';
+            return;
+        }
+
+        const suggestions = await ApiService.fetchSuggestions(query);
+        // ignora le risposte arrivate dopo che il testo è cambiato
+        if (suggestions.length > 0 && elements.searchInput.value.trim() === query) {
+            updateSuggestionsList(suggestions);
+        }
+    }
+
     async function handleSearchInput() {
         const query = elements.searchInput.value.trim();
         if (query.length < 2) {
@@ -261,9 +277,27 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             console.log('Searching for:', query);
-            const places = await ApiService.fetchPlaces(query);
-            console.log('Places found:', places);
-            updateSuggestionsList(places);
+            // suggerimenti locali e ricerca completa insieme: i suggerimenti non nascondono indirizzi e vie
+            const [suggestions, places] = await Promise.all([
+                ApiService.fetchSuggestions(query),
+                ApiService.fetchPlaces(query).catch(error => {
+                    console.error('Error during search:', error);
+                    return null;
+                })
+            ]);
+            if (elements.searchInput.value.trim() !== query) {
+                return;
+            }
+            if (places === null && suggestions.length === 0) {
+                elements.suggestionsList.innerHTML = '<li class="list-group-item">Errore durante la ricerca</li>';
+                return;
+            }
+            // prima la ricerca completa (nomi esatti e indirizzi), poi i suggerimenti non già presenti
+            const results = places || [];
+            const names = new Set(results.map(place => place.name));
+            const merged = results.concat(suggestions.filter(place => !names.has(place.name)));
+            console.log('Places found:', merged);
+            updateSuggestionsList(merged);
         } catch (error) {
             console.error('Error during search:', error);
             elements.suggestionsList.innerHTML = '<li class="list-group-item">Errore durante la ricerca</li>';
@@ -17,6 +17,20 @@ export class ApiService {
         }
     }
 
+    static async fetchSuggestions(query) {
+        try {
+            const response = await fetch(`/api/autocomplete?q=${encodeURIComponent(query)}`);
+
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            return await response.json();
+        } catch (error) {
+            console.error('Error fetching suggestions:', error);
+            return [];
+        }
+    }
+
     static async fetchIsochroneData(coordinates, minutes, velocity, categories = []) {
         try {
             const response = await fetch('/api/get_isochrone', {
@@ -121,14 +135,32 @@ export class ApiService {
 
     static async runSearch(coordinates, minutes, velocity, categories) {
         try {
-            const isochroneData = await this.fetchIsochroneData(coordinates, minutes, velocity, categories);
-            const poisData = await this.getPoisInIsochrone(coordinates, minutes, velocity, categories);
-            const parametersData = await this.getIsochroneParameters(coordinates, minutes, velocity, categories);
+            // una sola richiesta: il backend trova il nodo una volta e restituisce isocrona, POI e parametri
+            const response = await fetch('/api/search', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    coords: {
+                        lat: coordinates[0],
+                        lon: coordinates[1]
+                    },
+                    min: minutes,
+                    vel: velocity,
+                    categories: categories
+                })
+            });
 
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            const data = await response.json();
             return {
-                isochrone: isochroneData,
-                pois: poisData,
-                parameters: parametersData
+                isochrone: data.isochrone,
+                pois: data.pois,
+                parameters: data.parameters
             };
         } catch (error) {
             console.error('Error in search operation:', error);
@@ -136,6 +168,54 @@ export class ApiService {
         }
     }
 
+    static async analyzeNeighbourhoods(neighbourhoodIds, minutes, velocity, categories, onEvent) {
+        try {
+            // il backend analizza i quartieri in parallelo e manda un evento NDJSON per riga
+            const response = await fetch('/api/analyze_neighbourhoods', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    neighbourhood_ids: neighbourhoodIds,
+                    min: minutes,
+                    vel: velocity,
+                    categories: categories
+                })
+            });
+
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop(); // l'ultima riga può essere incompleta
+
+                for (const line of lines) {
+                    if (line.trim()) {
+                        onEvent(JSON.parse(line));
+                    }
+                }
+            }
+
+            if (buffer.trim()) {
+                onEvent(JSON.parse(buffer));
+            }
+        } catch (error) {
+            console.error('Error analyzing neighbourhoods:', error);
+            throw error;
+        }
+    }
+
     static async fetchAllNeighbourhoods(cityName = null) {
         try {
             let url = '/api/get_all_neighbourhoods';